@@ -0,0 +1,8 @@
+"""
+Benchmarks for pybmt. Run the whole suite, from the root of the repo, with:
+
+    python -m benchmarks --output results.json
+
+and compare against an earlier run with --compare old_results.json. The bench_* modules are standalone comparisons
+against older implementations.
+"""
@@ -0,0 +1,106 @@
+"""
+Run the benchmark suite, print the results and optionally save them as JSON or compare them against a previous run.
+"""
+import argparse
+import datetime
+import json
+import platform
+import sys
+
+import numpy as np
+import zmq
+
+from benchmarks.suite import BENCHMARKS
+
+
+def environment():
+    """
+    Describe the machine and versions the benchmarks ran on, saved with the results.
+    """
+    return {'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'numpy': np.__version__,
+            'pyzmq': zmq.__version__,
+            'zmq': zmq.zmq_version()}
+
+
+def run(names, num_frames):
+    """
+    Run the named benchmarks.
+
+    :return: A dict mapping each benchmark name to its results.
+    """
+    results = {}
+    for name in names:
+        results[name] = BENCHMARKS[name](num_frames)
+        print_result(name, results[name])
+        sys.stdout.flush()
+
+    return results
+
+
+def print_result(name, result):
+    print("{:<28} {:>12.0f} fps   p50 {:>8.2f} us   p99 {:>8.2f} us   max {:>9.2f} us".format(
+        name, result['fps'], result['p50_us'], result['p99_us'], result['max_us']))
+
+
+def compare(results, baseline, tolerance):
+    """
+    Compare results against a baseline run, print the change in fps and p99 latency of each benchmark.
+
+    :return: The names of the benchmarks whose fps dropped by more than tolerance.
+    """
+    regressions = []
+    print("\nCompared to {}:".format(baseline['environment']['date']))
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+
+        base = baseline['results'][name]
+        fps_change = result['fps'] / base['fps'] - 1.0
+        p99_change = result['p99_us'] / base['p99_us'] - 1.0 if base['p99_us'] > 0 else 0.0
+
+        flag = ""
+        if fps_change < -tolerance:
+            flag = "  REGRESSION"
+            regressions.append(name)
+
+        print("{:<28} fps {:>+7.1%}   p99 {:>+7.1%}{}".format(name, fps_change, p99_change, flag))
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the pybmt benchmarks.")
+    parser.add_argument("benchmarks", nargs="*", default=list(BENCHMARKS.keys()),
+                        help="The benchmarks to run, all of them by default: {}".format(", ".join(BENCHMARKS)))
+    parser.add_argument("--frames", type=int, default=20000, help="Number of frames each benchmark runs.")
+    parser.add_argument("--output", default=None, help="Save the results to this JSON file.")
+    parser.add_argument("--compare", default=None, help="Compare against the results in this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Fractional drop in fps to report as a regression when comparing.")
+    args = parser.parse_args(argv)
+
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            parser.error("Unknown benchmark '{}'".format(name))
+
+    results = run(args.benchmarks, args.frames)
+
+    report = {'environment': environment(), 'frames': args.frames, 'results': results}
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    regressions = []
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
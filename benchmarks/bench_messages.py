@@ -0,0 +1,73 @@
+"""
+Benchmark the driver's receive path for FicTrac's text messages against the binary message mode. Messages are queued
+up on a local socket pair first, then received and parsed with the same FicTracDriver methods the message loop uses,
+so only receive, decode and parse are measured.
+
+Run it from the root of the repo:
+
+    python -m benchmarks.bench_messages
+"""
+import time
+
+import zmq
+
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+
+def time_receive_path(binary_msgs, num_msgs=50000):
+    """
+    Time receiving and parsing num_msgs messages with the driver.
+
+    :return: The time per message in microseconds.
+    """
+    states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(num_msgs)]
+    if binary_msgs:
+        messages = [bytes(s) for s in states]
+    else:
+        messages = [s.to_zmq_string_msg().encode() for s in states]
+
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:0", binary_msgs=binary_msgs)
+
+    context = zmq.Context()
+    sender = context.socket(zmq.PAIR)
+    port = sender.bind_to_random_port("tcp://127.0.0.1")
+    receiver = context.socket(zmq.PAIR)
+    receiver.connect("tcp://127.0.0.1:{}".format(port))
+    for s in (sender, receiver):
+        s.setsockopt(zmq.SNDHWM, 0)
+        s.setsockopt(zmq.RCVHWM, 0)
+
+    for msg in messages:
+        sender.send(msg)
+
+    # Wait for everything to arrive, we don't want to measure the network.
+    receiver.poll()
+    time.sleep(0.5)
+
+    t0 = time.perf_counter()
+    for i in range(num_msgs):
+        fstate = tracDrv._parse_message(tracDrv._recv_message(receiver))
+    t1 = time.perf_counter()
+
+    assert fstate.frame_cnt == num_msgs
+
+    sender.close(linger=0)
+    receiver.close(linger=0)
+    context.term()
+
+    return (t1 - t0) / num_msgs * 1e6
+
+
+def main():
+    t_text = time_receive_path(binary_msgs=False)
+    t_binary = time_receive_path(binary_msgs=True)
+
+    print("text messages:    {:8.2f} us/msg".format(t_text))
+    print("binary messages:  {:8.2f} us/msg".format(t_binary))
+    print("speedup:          {:8.2f}x".format(t_text / t_binary))
+
+
+if __name__ == "__main__":
+    main()
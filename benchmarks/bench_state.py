@@ -0,0 +1,62 @@
+"""
+Micro-benchmark for parsing FicTrac state messages. It times FicTracState.zmq_string_msg_to_state on the same message
+used in tests/fictrac/test_state.py and compares it against the original field by field parser.
+
+Run it from the root of the repo:
+
+    python -m benchmarks.bench_state
+"""
+import timeit
+
+from pybmt.fictrac.state import FicTracState
+
+# A test message that is exactly formatted like fictrac's state messages, see tests/fictrac/test_state.py
+test_msg = "1, 0.00061658055072047, 0.00049280924124894, 0.00028854775028054, 4383.0244305051, -0.00049229297796647, 0.00028846777828354, -0.00061703022026165, 0.0053108667004006, -0.0013475230246914, 0.00028682299296761, -1.2046443372631, 1.2104273986131, 1.2054460682211, 0.00028831588044736, 0.00049238194388207, 0.00061703022026165, 1.0407586027826, 0.00057058394234585, 0.00028846777828354, 0.00049229297796647, 20, 1, 0.0000234, 20.5"
+
+
+def field_by_field_msg_to_state(data):
+    """
+    The original parser, a python loop over the fields of the structure. Kept here as a reference point.
+    """
+    fstate = FicTracState()
+    values = [x.strip() for x in data.split(',')]
+
+    i = 0
+    for field_name, field_type in fstate._fields_:
+        field = getattr(fstate, field_name)
+        if isinstance(field, float):
+            setattr(fstate, field_name, float(values[i]))
+            i = i + 1
+        elif isinstance(field, int):
+            setattr(fstate, field_name, int(values[i]))
+            i = i + 1
+        elif len(field) == 3:
+            field[0] = float(values[i])
+            field[1] = float(values[i + 1])
+            field[2] = float(values[i + 2])
+            i = i + 3
+
+    return fstate
+
+
+def time_per_call(func, number=20000, repeat=5):
+    """
+    Time a function and return the best per call time in microseconds.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    # Warm up the cached message layout so we only measure the steady state.
+    FicTracState.zmq_string_msg_to_state(test_msg)
+
+    t_new = time_per_call(lambda: FicTracState.zmq_string_msg_to_state(test_msg))
+    t_old = time_per_call(lambda: field_by_field_msg_to_state(test_msg))
+
+    print("zmq_string_msg_to_state:     {:8.2f} us/msg".format(t_new))
+    print("field by field (reference):  {:8.2f} us/msg".format(t_old))
+    print("speedup:                     {:8.2f}x".format(t_old / t_new))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+The benchmark suite run by python -m benchmarks. Each benchmark is a function that takes the number of frames to run
+and returns a dict of results, frames per second and per frame latency percentiles in microseconds. Benchmarks are
+registered with the @benchmark decorator, in the order they should run.
+"""
+import contextlib
+import io
+import time
+
+import numpy as np
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.callback.stats import StateStats, WindowedMean, WindowedMedian, WindowedMinMax
+from pybmt.callback.threshold_callback import ThresholdCallback
+from pybmt.callback.triggers import Derived, Threshold, Trigger, TriggerEngine
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.kinematics import KinematicsTracker
+from pybmt.fictrac.simulator import FicTracPublisher, synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+# The registered benchmarks, name -> function
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """
+    Register a benchmark function under its name.
+    """
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def summarize(latencies, elapsed):
+    """
+    Summarize per frame timings.
+
+    :param latencies: A numpy array of the time each frame took, in seconds.
+    :param float elapsed: The total time, in seconds, taken to run all the frames.
+    :return: A dict of results.
+    """
+    return {'frames': len(latencies),
+            'fps': len(latencies) / elapsed,
+            'mean_us': float(np.mean(latencies)) * 1e6,
+            'p50_us': float(np.percentile(latencies, 50)) * 1e6,
+            'p99_us': float(np.percentile(latencies, 99)) * 1e6,
+            'max_us': float(np.max(latencies)) * 1e6}
+
+
+def time_per_frame(func, frames):
+    """
+    Call func once for each frame, timing each call.
+
+    :param func: The function to time, it is called with each frame.
+    :param frames: The list of frames.
+    :return: The summarize() results.
+    """
+    latencies = np.empty(len(frames))
+    clock = time.perf_counter
+
+    t_start = clock()
+    for i, frame in enumerate(frames):
+        t0 = clock()
+        func(frame)
+        latencies[i] = clock() - t0
+    elapsed = clock() - t_start
+
+    return summarize(latencies, elapsed)
+
+
+def _states(num_frames):
+    return [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(num_frames)]
+
+
+@benchmark
+def zmq_string_msg_to_state(num_frames):
+    """
+    Parse FicTrac's text messages into FicTracState.
+    """
+    messages = [s.to_zmq_string_msg() for s in _states(num_frames)]
+
+    # Warm up the cached message layout so we only measure the steady state.
+    FicTracState.zmq_string_msg_to_state(messages[0])
+
+    return time_per_frame(FicTracState.zmq_string_msg_to_state, messages)
+
+
+@benchmark
+def to_np_array(num_frames):
+    """
+    Convert FicTracState to a numpy array.
+    """
+    return time_per_frame(FicTracState.to_np_array, _states(num_frames))
+
+
+class _NullCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        return True
+
+
+def _process_messages(num_frames, binary_msgs):
+    publisher = FicTracPublisher(synthetic_states(num_frames), binary_msgs=binary_msgs)
+
+    # Publishing as fast as possible, the receive queue has to take up the slack without dropping anything.
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=_NullCallback(), plot_on=False, binary_msgs=binary_msgs,
+                            recv_queue_size=num_frames + 1, track_latency=True)
+    tracDrv.watchdog = None
+
+    publisher.start()
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_start = time.perf_counter()
+        tracDrv.run()
+        elapsed = time.perf_counter() - t_start - tracDrv.time_to_first_frame
+    publisher.join()
+
+    # Only the histograms of the latency are kept, report their estimates. The publisher runs flat out so messages
+    # pile up in the queue, the latency reported is for processing a frame once it is taken off the queue. The end to
+    # end latency, including the time queued, is kept as well.
+    stats = tracDrv.get_latency_stats()
+    process = stats['process']
+    return {'frames': tracDrv.frame_cnt,
+            'fps': tracDrv.frame_cnt / elapsed,
+            'mean_us': process['mean'] * 1e6,
+            'p50_us': process['p50'] * 1e6,
+            'p99_us': process['p99'] * 1e6,
+            'max_us': process['max'] * 1e6,
+            'total_p99_us': stats['total']['p99'] * 1e6}
+
+
+@benchmark
+def process_messages_text(num_frames):
+    """
+    The full driver message loop against a local publisher, text messages.
+    """
+    return _process_messages(num_frames, binary_msgs=False)
+
+
+@benchmark
+def process_messages_binary(num_frames):
+    """
+    The full driver message loop against a local publisher, binary messages.
+    """
+    return _process_messages(num_frames, binary_msgs=True)
+
+
+@benchmark
+def threshold_callback(num_frames):
+    """
+    ThresholdCallback.process_callback per frame.
+    """
+    callback = ThresholdCallback()
+    callback.setup_callback()
+
+    # The callback prints each time the stimulus goes on or off.
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = time_per_frame(callback.process_callback, _states(num_frames))
+
+    callback.shutdown_callback()
+
+    return results
+
+
+def _windowed_stats(window):
+    """
+    Make a benchmark of updating windowed statistics of the speed with each frame, for a window size. The per frame
+    cost should be the same for every window size. The window is filled before timing starts, so every timed frame
+    also drops the oldest value, however few frames are run.
+    """
+    def windowed_stats(num_frames):
+        stats = StateStats({'speed': [WindowedMean(window), WindowedMinMax(window),
+                                      WindowedMedian(window, low=0.0, high=0.03)]})
+        states = _states(window + num_frames)
+        for state in states[:window]:
+            stats.update(state)
+
+        return time_per_frame(stats.update, states[window:])
+
+    windowed_stats.__name__ = "windowed_stats_{}".format(window)
+    windowed_stats.__doc__ = "StateStats.update with windowed mean, min/max and median over {} frames.".format(window)
+    return windowed_stats
+
+
+for _window in (25, 1000, 100000):
+    benchmark(_windowed_stats(_window))
+
+
+@benchmark
+def trigger_engine(num_frames):
+    """
+    TriggerEngine.update with 48 triggers, on fields, derived signals and compound conditions.
+    """
+    avg_speed = Derived('speed', WindowedMean(25))
+    triggers = []
+    for i in range(16):
+        level = 0.005 + 0.0005 * i
+        triggers.append(Trigger('speed_{}'.format(i), Threshold(avg_speed, on=level, off=level * 0.9),
+                                min_on_frames=3, min_off_frames=3))
+        triggers.append(Trigger('turn_{}'.format(i), Threshold('heading', on=0.2 * i, off=0.2 * i - 0.1),
+                                refractory_frames=10))
+        triggers.append(Trigger('both_{}'.format(i), Threshold('speed', on=level) & Threshold('heading', on=0.2 * i)))
+
+    engine = TriggerEngine(triggers)
+    engine.compile()
+    return time_per_frame(engine.update, _states(num_frames))
+
+
+@benchmark
+def kinematics_tracker(num_frames):
+    """
+    KinematicsTracker.update, velocities, unwrapped heading, path length and curvature over 25 frames.
+    """
+    tracker = KinematicsTracker(curvature_window=25)
+    return time_per_frame(tracker.update, _states(num_frames))
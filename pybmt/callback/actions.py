@@ -0,0 +1,188 @@
+import queue
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import Future
+
+from pybmt.fictrac.latency import LatencyHistogram
+
+# What happened to an action. frame_cnt is the FicTrac frame it was submitted on. The times are time.perf_counter(),
+# t_start is None if the action never ran. error is the formatted traceback if it failed.
+ActionRecord = namedtuple('ActionRecord', ['name', 'frame_cnt', 't_submit', 't_start', 't_end', 'error'])
+
+
+class ActionExecutor:
+    """
+    Runs stimulus and acquisition actions (triggering an arduino, starting cameras, saving frames, etc.) for callbacks,
+    on worker threads, so they don't block the tracking loop. process_callback submits an action and returns straight
+    away, the action's Future tells when it is done and what it returned.
+
+    Actions submitted with a key are coalesced, if an action with the same key is still waiting to run, the new one
+    isn't queued and its Future is the waiting action's. With a single worker, the default, actions run one at a time
+    in the order they were submitted, so an 'off' action can't overtake the 'on' before it.
+
+    For each action the frame it was triggered on and the time from submitting it to it starting are recorded, see
+    records and report().
+    """
+
+    def __init__(self, num_workers=1, max_queued=64, name="pybmt-actions"):
+        """
+        :param int num_workers: The number of worker threads.
+        :param int max_queued: The most actions that can be waiting to run. Actions submitted when this many are
+        waiting fail straight away, submitting never blocks.
+        :param str name: The name of the worker threads.
+        """
+        self.num_workers = num_workers
+        self.max_queued = max_queued
+        self.name = name
+
+        self._queue = None
+        self._workers = []
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self.records = []
+        self.start_latency = LatencyHistogram()
+        self.num_coalesced = 0
+        self.num_rejected = 0
+
+    def start(self):
+        """
+        Start the worker threads.
+
+        :return: self
+        """
+        self._queue = queue.Queue(maxsize=self.max_queued)
+        self._pending = {}
+        self.records = []
+        self.start_latency.clear()
+        self.num_coalesced = 0
+        self.num_rejected = 0
+
+        self._workers = []
+        for i in range(self.num_workers):
+            worker = threading.Thread(target=self._run, name="{}-{}".format(self.name, i), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+        return self
+
+    def submit(self, func, *args, key=None, frame_cnt=None, **kwargs):
+        """
+        Submit an action to run on a worker thread.
+
+        :param func: The function to call.
+        :param args: Its arguments.
+        :param key: If not None, coalesce this action with any waiting action with the same key.
+        :param int frame_cnt: The FicTrac frame that triggered the action, for the records.
+        :param kwargs: Its keyword arguments.
+        :return: A concurrent.futures.Future for the action's result.
+        """
+        t_submit = time.perf_counter()
+
+        with self._lock:
+            if self._queue is None:
+                raise RuntimeError("Action executor {} is not started, or has been shutdown.".format(self.name))
+
+            if key is not None and key in self._pending:
+                self.num_coalesced = self.num_coalesced + 1
+                return self._pending[key]
+
+            future = Future()
+            name = key if key is not None else getattr(func, '__name__', repr(func))
+            try:
+                self._queue.put_nowait((future, key, name, frame_cnt, t_submit, func, args, kwargs))
+            except queue.Full:
+                self.num_rejected = self.num_rejected + 1
+                self.records.append(ActionRecord(name, frame_cnt, t_submit, None, None, "Action queue full."))
+                future.set_exception(RuntimeError("Too many actions waiting to run, {} not run.".format(name)))
+                return future
+
+            if key is not None:
+                self._pending[key] = future
+
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            future, key, name, frame_cnt, t_submit, func, args, kwargs = item
+
+            # Once it has started, a new action with the same key is queued behind it.
+            with self._lock:
+                if key is not None:
+                    self._pending.pop(key, None)
+
+            if not future.set_running_or_notify_cancel():
+                self.records.append(ActionRecord(name, frame_cnt, t_submit, None, None, "Cancelled."))
+                continue
+
+            t_start = time.perf_counter()
+            self.start_latency.record(t_start - t_submit)
+
+            error = None
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as ex:
+                error = traceback.format_exc()
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+            self.records.append(ActionRecord(name, frame_cnt, t_submit, t_start, time.perf_counter(), error))
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stop the worker threads.
+
+        :param bool wait: Let the waiting actions run first. If False, they are cancelled.
+        :param float timeout: How long, in seconds, to wait for each worker thread, None waits for ever.
+        :return: None
+        """
+        if self._queue is None:
+            return
+
+        if not wait:
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[0].cancel()
+                    self.records.append(ActionRecord(item[2], item[3], item[4], None, None, "Cancelled."))
+
+        for worker in self._workers:
+            self._queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+
+        self._workers = []
+        self._queue = None
+
+    @property
+    def errors(self):
+        """
+        The records of the actions that failed.
+        """
+        return [r for r in self.records if r.error is not None]
+
+    def report(self):
+        """
+        Summarize the actions run, how long they took to start, and any that failed.
+
+        :return: The report string.
+        """
+        latency = self.start_latency.summary()
+        lines = ["Actions: {} run, {} coalesced, {} rejected, {} failed".format(
+                     latency['count'], self.num_coalesced, self.num_rejected, len(self.errors)),
+                 "Start latency (us): mean {:.1f}, p99 {:.1f}, max {:.1f}".format(
+                     latency['mean'] * 1e6, latency['p99'] * 1e6, latency['max'] * 1e6)]
+        for r in self.errors:
+            lines.append("{} (frame {}) failed: {}".format(r.name, r.frame_cnt, r.error.strip().splitlines()[-1]))
+
+        return "\n".join(lines)
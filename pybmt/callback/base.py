@@ -1,5 +1,8 @@
 
 
+from pybmt.callback.profiling import NO_SECTION
+
+
 class PyBMTCallback:
     """
     FlyVRCallback is a base class that derived classes should use to implement control logic for closed loop experiments.
@@ -7,6 +10,9 @@ class PyBMTCallback:
     triggering stimuli. This class should never be instantiated directly, it provides only an abstract interface.
     """
 
+    # The pybmt.callback.profiling.CallbackProfiler timing this callback, None unless profiling is on.
+    profiler = None
+
     def setup_callback(self):
         """
         This method is called once and only once before any event processing is triggered. Place any one time setup
@@ -34,3 +40,100 @@ class PyBMTCallback:
         :return: bool True to keep running, False to stop running.
         """
         pass
+
+    def process_gap(self, first_frame, last_frame):
+        """
+        This method is called when the driver is tolerating gaps (tolerate_gaps=True) and frames from FicTrac went
+        missing. It is called before process_callback is called with the first frame after the gap.
+
+        :param int first_frame: The frame count of the first missing frame.
+        :param int last_frame: The frame count of the last missing frame.
+        :return: bool False to stop running, anything else keeps running.
+        """
+        pass
+
+    def shed_load(self, shed):
+        """
+        This method is called by the driver's watchdog, with the 'shed' policy, when processing is falling behind
+        FicTrac, and again once it has caught up. While shedding, skip any work that isn't needed to keep the
+        experiment going, logging, analysis, etc.
+
+        :param bool shed: True to start shedding load, False to stop.
+        :return: None
+        """
+        pass
+
+    def enable_profiling(self, profiler):
+        """
+        Turn on profiling, this is called by the driver before setup_callback when it is asked to profile. Callbacks
+        that wrap other callbacks should pass it on to them.
+
+        :param profiler: The pybmt.callback.profiling.CallbackProfiler, None turns profiling off.
+        :return: None
+        """
+        self.profiler = profiler
+
+    def profile_section(self, name):
+        """
+        Time a section of the callback's code, when profiling is on, so its share of each frame shows up in the
+        profile report. For example:
+
+            with self.profile_section('stimulus'):
+                self.arduino.write(b'1')
+
+        When profiling is off this costs next to nothing.
+
+        :param str name: The name of the section.
+        :return: A context manager.
+        """
+        if self.profiler is None:
+            return NO_SECTION
+
+        return self.profiler.section(name)
+
+
+class AsyncPyBMTCallback(PyBMTCallback):
+    """
+    The asyncio version of PyBMTCallback, for use with AsyncFicTracDriver. Each entry point is a coroutine, so
+    experiment code can await serial I/O, camera control, UI updates, etc. without threads. The driver awaits
+    process_callback for every tracking update, so longer running work should be started as its own task with
+    asyncio.create_task() rather than awaited in process_callback.
+    """
+
+    async def setup_callback(self):
+        """
+        This coroutine is awaited once and only once before any event processing is triggered. Place any one time
+        setup functionality within this function.
+
+        :return: None
+        """
+        pass
+
+    async def shutdown_callback(self):
+        """
+        This coroutine is awaited once and only once before exiting the programe. Place any one time shutdown
+        functionality within this function.
+
+        :return: None
+        """
+        pass
+
+    async def process_callback(self, track_state):
+        """
+        This coroutine is awaited each time an update is detected in the online tracking state. Code placed within
+        this method should execute as quickly and deterministically as possible.
+
+        :param track_state: The current FicTracState.
+        :return: bool True to keep running, False to stop running.
+        """
+        pass
+
+    async def process_gap(self, first_frame, last_frame):
+        """
+        This coroutine is awaited when frames from FicTrac went missing, see PyBMTCallback.process_gap.
+
+        :param int first_frame: The frame count of the first missing frame.
+        :param int last_frame: The frame count of the last missing frame.
+        :return: bool False to stop running, anything else keeps running.
+        """
+        pass
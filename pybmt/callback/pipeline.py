@@ -0,0 +1,309 @@
+import queue
+import threading
+import time
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.latency import LatencyHistogram
+
+
+def _stops(method, result):
+    """
+    Did a stage ask to stop? Like the driver, anything but a true value from process_callback stops, process_gap has
+    to return False.
+    """
+    if method == 'process_gap':
+        return result is False
+
+    return not result
+
+
+class PipelineStage:
+    """
+    A callback in a CallbackPipeline, with its time budget and timing statistics.
+    """
+
+    def __init__(self, callback, name=None, budget=None, deferred=False):
+        """
+        :param callback: The PyBMTCallback this stage runs.
+        :param str name: The name of the stage in reports, the callback's class name by default.
+        :param float budget: The time, in seconds, the stage should take per frame. Frames that take longer are
+        counted as overruns. None for no budget.
+        :param bool deferred: Run the stage on the pipeline's worker thread, off the hot path.
+        """
+        self.callback = callback
+        self.name = name if name is not None else type(callback).__name__
+        self.budget = budget
+        self.deferred = deferred
+
+        self.timing = LatencyHistogram()
+        self.num_overruns = 0
+        self.last_overrun_frame = None
+
+    def clear(self):
+        """
+        Reset the timing statistics.
+
+        :return: None
+        """
+        self.timing.clear()
+        self.num_overruns = 0
+        self.last_overrun_frame = None
+
+    def run(self, method, args, frame_cnt):
+        """
+        Call one of the callback's entry points, timing it and checking it against the budget.
+
+        :param str method: The name of the callback method, process_callback or process_gap.
+        :param args: The arguments to call it with.
+        :param int frame_cnt: The FicTrac frame the call is for.
+        :return: What the callback returned.
+        """
+        t0 = time.perf_counter()
+        result = getattr(self.callback, method)(*args)
+        elapsed = time.perf_counter() - t0
+
+        self.timing.record(elapsed)
+        if self.budget is not None and elapsed > self.budget:
+            self.num_overruns = self.num_overruns + 1
+            self.last_overrun_frame = frame_cnt
+
+        return result
+
+    def stats(self):
+        """
+        :return: A dict of the stage's timing statistics, times in seconds.
+        """
+        stats = self.timing.summary()
+        stats.update({'name': self.name,
+                      'deferred': self.deferred,
+                      'budget': self.budget,
+                      'overruns': self.num_overruns,
+                      'last_overrun_frame': self.last_overrun_frame})
+        return stats
+
+
+class CallbackPipeline(PyBMTCallback):
+    """
+    A callback made of several callbacks, run as stages in the order they were added. This lets logging, threshold
+    detection, stimulus control, etc. be written as separate callbacks and put together for an experiment.
+
+    Stages normally run on the hot path, one after another, for each frame. Stages marked as deferred are handed a
+    copy of the state through a bounded queue and run on a worker thread, so slow work like logging doesn't hold up
+    the next frame. If the queue fills up, frames for the deferred stages are dropped and counted, the hot path never
+    waits on them.
+
+    Every stage has its own time budget. Each call is timed and calls over budget are counted as overruns, the
+    summary printed at shutdown (or stage_stats()) shows which stage is eating the frame budget.
+
+    When the driver's watchdog asks the pipeline to shed load, frames aren't queued for the deferred stages until it
+    has caught up, these are counted too. The inline stages are asked to shed load as well.
+    """
+
+    def __init__(self, stages=(), deferred_queue_size=256):
+        """
+        :param stages: PipelineStage objects, or plain callbacks, to start with. More can be added with add_stage.
+        :param int deferred_queue_size: The number of frames that can be waiting for the deferred stages.
+        """
+        super(CallbackPipeline, self).__init__()
+
+        self.stages = []
+        for stage in stages:
+            if isinstance(stage, PipelineStage):
+                self.stages.append(stage)
+            else:
+                self.add_stage(stage)
+
+        self.deferred_queue_size = deferred_queue_size
+        self._queue = None
+        self._worker = None
+        self._deferred_error = None
+        self._deferred_stop = False
+        self.num_deferred_dropped = 0
+        self.shedding = False
+        self.num_deferred_shed = 0
+
+    def add_stage(self, callback, name=None, budget=None, deferred=False):
+        """
+        Add a stage to the end of the pipeline.
+
+        :param callback: The PyBMTCallback to run.
+        :param str name: The name of the stage in reports.
+        :param float budget: The time, in seconds, the stage should take per frame.
+        :param bool deferred: Run the stage off the hot path, on the worker thread.
+        :return: The new PipelineStage.
+        """
+        stage = PipelineStage(callback, name=name, budget=budget, deferred=deferred)
+        self.stages.append(stage)
+        return stage
+
+    @property
+    def inline_stages(self):
+        return [s for s in self.stages if not s.deferred]
+
+    @property
+    def deferred_stages(self):
+        return [s for s in self.stages if s.deferred]
+
+    def setup_callback(self):
+        """
+        Setup all the stages in order and start the worker thread if there are deferred stages.
+
+        :return: None
+        """
+        for stage in self.stages:
+            stage.clear()
+            stage.callback.setup_callback()
+
+        # Only lists are used on the hot path
+        self._inline = self.inline_stages
+        self._deferred = self.deferred_stages
+
+        self._deferred_error = None
+        self._deferred_stop = False
+        self.num_deferred_dropped = 0
+        self.shedding = False
+        self.num_deferred_shed = 0
+
+        if len(self._deferred) > 0:
+            self._queue = queue.Queue(maxsize=self.deferred_queue_size)
+            self._worker = threading.Thread(target=self._run_deferred, name="pybmt-pipeline", daemon=True)
+            self._worker.start()
+
+    def process_callback(self, track_state):
+        """
+        Run the stages for a frame. The inline stages all run, even if one of them asks to stop.
+
+        :param track_state: The FicTracState.
+        :return: False if any stage asked to stop, True otherwise.
+        """
+        isOK = self._dispatch('process_callback', track_state.frame_cnt, (track_state,), track_state)
+
+        # Deferred stages that asked to stop or failed take effect on the next frame.
+        if self._deferred_error is not None:
+            raise Exception("Deferred pipeline stage failed.") from self._deferred_error
+
+        return isOK and not self._deferred_stop
+
+    def process_gap(self, first_frame, last_frame):
+        """
+        Pass a gap in the frames on to all the stages, in order with the frames.
+
+        :return: False if any stage asked to stop, True otherwise.
+        """
+        return self._dispatch('process_gap', last_frame, (first_frame, last_frame), None)
+
+    def _dispatch(self, method, frame_cnt, args, track_state):
+        isOK = True
+        for stage in self._inline:
+            if _stops(method, stage.run(method, args, frame_cnt)):
+                isOK = False
+
+        if len(self._deferred) > 0:
+            if self.shedding:
+                self.num_deferred_shed = self.num_deferred_shed + 1
+                return isOK
+
+            # The driver may reuse the state once we return, the deferred stages need their own copy.
+            if track_state is not None:
+                args = (track_state.snapshot(),)
+
+            try:
+                self._queue.put_nowait((method, args, frame_cnt))
+            except queue.Full:
+                self.num_deferred_dropped = self.num_deferred_dropped + 1
+
+        return isOK
+
+    def shed_load(self, shed):
+        """
+        Stop, or start again, handing frames to the deferred stages, and pass the request on to the inline stages.
+
+        :param bool shed: True to start shedding load, False to stop.
+        :return: None
+        """
+        self.shedding = shed
+        for stage in self._inline:
+            stage.callback.shed_load(shed)
+
+    def enable_profiling(self, profiler):
+        """
+        Turn on profiling for the pipeline and its inline stages. The deferred stages run on another thread and
+        aren't profiled, their timing is in the pipeline's report.
+
+        :param profiler: The pybmt.callback.profiling.CallbackProfiler, None turns profiling off.
+        :return: None
+        """
+        self.profiler = profiler
+        for stage in self.inline_stages:
+            stage.callback.enable_profiling(profiler)
+
+    def _run_deferred(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            method, args, frame_cnt = item
+            try:
+                for stage in self._deferred:
+                    if _stops(method, stage.run(method, args, frame_cnt)):
+                        self._deferred_stop = True
+            except Exception as ex:
+                self._deferred_error = ex
+                return
+
+    def shutdown_callback(self):
+        """
+        Let the deferred stages finish the frames they have queued, then shutdown all the stages in reverse order and
+        print the stage timing summary.
+
+        :return: None
+        """
+        if self._worker is not None:
+
+            # If a deferred stage failed the worker is gone and nothing is emptying the queue.
+            while self._worker.is_alive():
+                try:
+                    self._queue.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+            self._worker.join()
+            self._worker = None
+
+        try:
+            for stage in reversed(self.stages):
+                stage.callback.shutdown_callback()
+        finally:
+            print(self.report())
+
+    def stage_stats(self):
+        """
+        Get the timing statistics of each stage.
+
+        :return: A list with a dict of statistics for each stage, in pipeline order.
+        """
+        return [stage.stats() for stage in self.stages]
+
+    def report(self):
+        """
+        Format the stage timing statistics as a table, times in microseconds.
+
+        :return: The report string.
+        """
+        lines = ["Callback pipeline stages (us)",
+                 "{:<24} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+                     "stage", "count", "mean", "p99", "max", "budget", "overruns")]
+        for s in self.stage_stats():
+            name = s['name'] + (" (deferred)" if s['deferred'] else "")
+            budget = "-" if s['budget'] is None else "{:.1f}".format(s['budget'] * 1e6)
+            lines.append("{:<24} {:>8d} {:>10.1f} {:>10.1f} {:>10.1f} {:>10} {:>10d}".format(
+                name, s['count'], s['mean'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6, budget, s['overruns']))
+
+        if self.num_deferred_dropped > 0:
+            lines.append("Frames dropped by deferred stages: {}".format(self.num_deferred_dropped))
+        if self.num_deferred_shed > 0:
+            lines.append("Frames shed by deferred stages: {}".format(self.num_deferred_shed))
+
+        return "\n".join(lines)
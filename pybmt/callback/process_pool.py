@@ -0,0 +1,184 @@
+import multiprocessing
+import queue
+import traceback
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.shmem import SharedStateRing
+
+
+def _worker_main(ring_name, callback, results, index, poll_interval):
+    """
+    The main function of a worker process. Reads each state from the ring and runs the callback on it until the ring
+    is closed or the callback asks to stop.
+    """
+    ring = SharedStateRing.attach(ring_name)
+    try:
+        callback.setup_callback()
+        try:
+            while True:
+                state = ring.wait(poll_interval=poll_interval)
+                if state is None:
+                    break
+
+                result = callback.process_callback(state)
+
+                # Let the driver know why before asking it to stop, it waits for the message when it sees the flag.
+                if result is False:
+                    results.put(('stop', index, state.frame_cnt, None))
+                    ring.request_stop()
+                    break
+                elif result is not True and result is not None:
+                    results.put(('result', index, state.frame_cnt, result))
+        finally:
+            callback.shutdown_callback()
+
+        results.put(('done', index, ring.num_missed, None))
+    except Exception:
+        results.put(('error', index, None, traceback.format_exc()))
+        ring.request_stop()
+    finally:
+        ring.close()
+
+
+class ProcessPoolCallback(PyBMTCallback):
+    """
+    Runs callbacks in worker processes, so CPU heavy analysis doesn't share the GIL with the driver's receive loop.
+    On the driver's thread each state is just copied into a SharedStateRing in shared memory, every worker process
+    reads every state from the ring and runs its own callback on it.
+
+    The worker callbacks are normal PyBMTCallback, set up and shut down in their process. Their process_callback
+    returns True (or None) to keep going, False to stop the whole run, or any other value as a result. Results come
+    back through a multiprocessing queue, see get_results(). The stop signal is a flag in the ring's shared memory,
+    checking it on the hot path is a memory read.
+
+    A worker that falls more than ring_capacity states behind skips ahead, the number of states each worker missed is
+    in num_missed after shutdown.
+    """
+
+    def __init__(self, callbacks, ring_capacity=1024, start_method=None, poll_interval=0.0005):
+        """
+        :param callbacks: The callbacks to run, each in its own worker process. They must be picklable.
+        :param int ring_capacity: The number of states the shared memory ring holds.
+        :param str start_method: The multiprocessing start method for the workers, the platform default if None.
+        :param float poll_interval: How often, in seconds, waiting workers check the ring for a new state.
+        """
+        super(ProcessPoolCallback, self).__init__()
+
+        self.callbacks = list(callbacks)
+        self.ring_capacity = ring_capacity
+        self.poll_interval = poll_interval
+        self._mp_context = multiprocessing.get_context(start_method)
+
+        self.ring = None
+        self.processes = []
+        self._results = None
+
+        # Results and statistics gathered from the workers.
+        self.results = []
+        self.worker_errors = {}
+        self.num_missed = {}
+
+    def setup_callback(self):
+        """
+        Create the shared memory ring and start the worker processes.
+
+        :return: None
+        """
+        self.results = []
+        self.worker_errors = {}
+        self.num_missed = {}
+
+        self.ring = SharedStateRing.create(self.ring_capacity)
+        self._results = self._mp_context.Queue()
+
+        self.processes = []
+        for i, callback in enumerate(self.callbacks):
+            p = self._mp_context.Process(target=_worker_main, name="pybmt-worker-{}".format(i),
+                                         args=(self.ring.name, callback, self._results, i, self.poll_interval),
+                                         daemon=True)
+            p.start()
+            self.processes.append(p)
+
+    def process_callback(self, track_state):
+        """
+        Copy the state into the ring for the workers.
+
+        :param track_state: The FicTracState.
+        :return: False if a worker asked to stop, True otherwise.
+        """
+        self.ring.write(track_state)
+
+        if self.ring.header.stop_requested:
+            self._collect_results(until=('stop', 'error'), timeout=1.0)
+            if len(self.worker_errors) > 0:
+                index, error = next(iter(self.worker_errors.items()))
+                raise Exception("Worker process {} failed:\n{}".format(index, error))
+            return False
+
+        return True
+
+    def _collect_results(self, timeout=None, until=()):
+        """
+        Move any messages from the workers off the results queue.
+
+        :param float timeout: Wait this long for each message, None doesn't wait.
+        :param until: Stop once a message of one of these kinds arrives.
+        :return: None
+        """
+        while True:
+            try:
+                if timeout is None:
+                    kind, index, frame_cnt, value = self._results.get_nowait()
+                else:
+                    kind, index, frame_cnt, value = self._results.get(timeout=timeout)
+            except queue.Empty:
+                return
+
+            if kind == 'result':
+                self.results.append((index, frame_cnt, value))
+            elif kind == 'error':
+                self.worker_errors[index] = value
+            elif kind == 'done':
+                self.num_missed[index] = frame_cnt
+
+            if kind in until:
+                return
+
+    def get_results(self):
+        """
+        Get the results the workers have sent back so far.
+
+        :return: A list of (worker index, frame count, result) tuples, in the order they arrived.
+        """
+        self._collect_results()
+        return list(self.results)
+
+    def shutdown_callback(self, timeout=10.0):
+        """
+        Close the ring, let the workers finish the states they haven't read yet, and clean up.
+
+        :param float timeout: How long, in seconds, to wait for the workers to finish, in total.
+        :return: None
+        """
+        if self.ring is None:
+            return
+
+        self.ring.mark_closed()
+
+        # Keep the results queue moving while the workers finish, a worker can't exit with results stuck in its pipe.
+        for p in self.processes:
+            while p.is_alive() and timeout > 0:
+                self._collect_results(timeout=0.05)
+                p.join(0.05)
+                timeout = timeout - 0.1
+            if p.is_alive():
+                p.terminate()
+                p.join()
+
+        self._collect_results()
+
+        self.ring.close()
+        self.ring = None
+
+        for index, error in self.worker_errors.items():
+            print("Worker process {} failed:\n{}".format(index, error))
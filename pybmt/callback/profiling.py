@@ -0,0 +1,250 @@
+import cProfile
+import heapq
+import io
+import pstats
+import time
+
+from pybmt.fictrac.latency import LatencyStats
+
+
+class _Section:
+    """
+    Times a named section of code into the profiler, see CallbackProfiler.section.
+    """
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.histogram = profiler.timings.add_stage(name)
+        self._t0 = 0.0
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        duration = time.perf_counter() - self._t0
+        self.histogram.record(duration)
+
+        # Keep track of the sections in the current frame, in case it turns out to be one of the slowest.
+        profiler = self.profiler
+        if profiler._in_frame:
+            if profiler._frame_sections is None:
+                profiler._frame_sections = {}
+            profiler._frame_sections[self.name] = profiler._frame_sections.get(self.name, 0.0) + duration
+
+        return False
+
+
+class _NoSection:
+    """
+    Stands in for a section when profiling is off, it does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+NO_SECTION = _NoSection()
+
+
+class CallbackProfiler:
+    """
+    Profiles a callback while the driver runs it. The wall time of each call of the callback's entry points, and of
+    the time the driver spent parsing each frame, is recorded in histograms. The callback can time sections of its
+    own code, stimulus side effects, analysis, etc. with PyBMTCallback.profile_section(), these get histograms too.
+
+    The slowest frames are kept, with their frame numbers and how long the parsing and each section took, so when a
+    session falls behind the report says which frames and where the time went. Optionally, one in every
+    profile_interval frames is run under cProfile, and the profiles of the slowest of these are kept for the report.
+    cProfile slows down the frames it profiles a lot, so keep the interval large.
+
+    The profiler isn't thread safe, sections should only be timed on the thread that runs process_callback.
+    """
+
+    def __init__(self, num_worst=10, profile_interval=0, num_profiles=3, report_file=None):
+        """
+        :param int num_worst: The number of slowest frames to keep.
+        :param int profile_interval: Run cProfile on one frame in every profile_interval, 0, the default, never does.
+        :param int num_profiles: The number of profiles of the slowest profiled frames to keep.
+        :param str report_file: If not None, the driver writes the report to this file at shutdown, as well as
+        printing it.
+        """
+        self.num_worst = num_worst
+        self.profile_interval = profile_interval
+        self.num_profiles = num_profiles
+        self.report_file = report_file
+
+        self.timings = LatencyStats(['parse', 'process_callback'])
+        self._sections = {}
+        self.clear()
+
+    def clear(self):
+        """
+        Forget everything recorded.
+
+        :return: None
+        """
+        self.timings.clear()
+        self.num_frames = 0
+        self.worst_frames = []
+        self.profiles = []
+        self._seq = 0
+
+        self._in_frame = False
+        self._frame_cnt = None
+        self._frame_sections = None
+        self._parse_time = None
+        self._profile = None
+        self._t0 = 0.0
+
+    def begin_frame(self, frame_cnt, parse_time=None):
+        """
+        Start timing a frame, call just before process_callback.
+
+        :param int frame_cnt: The frame's number.
+        :param float parse_time: How long the driver took to parse the frame, in seconds, if it knows.
+        :return: None
+        """
+        self._in_frame = True
+        self._frame_cnt = frame_cnt
+        self._parse_time = parse_time
+        if parse_time is not None:
+            self.timings.record('parse', parse_time)
+
+        if self.profile_interval > 0 and self.num_frames % self.profile_interval == 0:
+            self._profile = cProfile.Profile()
+            try:
+                self._profile.enable()
+            except ValueError:
+                # Another profiler, a debugger or coverage, is already running.
+                self._profile = None
+
+        self._t0 = time.perf_counter()
+
+    def end_frame(self):
+        """
+        Stop timing the frame, call just after process_callback returns.
+
+        :return: The time process_callback took, in seconds.
+        """
+        duration = time.perf_counter() - self._t0
+
+        profile = self._profile
+        if profile is not None:
+            profile.disable()
+            self._profile = None
+
+        self.timings.record('process_callback', duration)
+        self.num_frames = self.num_frames + 1
+        self._in_frame = False
+
+        # Keep the slowest frames in a min heap, most frames are quicker than the quickest kept, and that is one
+        # comparison.
+        worst = self.worst_frames
+        if len(worst) < self.num_worst or duration > worst[0][0]:
+            self._seq = self._seq + 1
+            entry = (duration, self._seq, self._frame_cnt, self._parse_time, self._frame_sections)
+            if len(worst) < self.num_worst:
+                heapq.heappush(worst, entry)
+            else:
+                heapq.heapreplace(worst, entry)
+
+        if profile is not None:
+            profiles = self.profiles
+            if len(profiles) < self.num_profiles or duration > profiles[0][0]:
+                self._seq = self._seq + 1
+                entry = (duration, self._seq, self._frame_cnt, profile)
+                if len(profiles) < self.num_profiles:
+                    heapq.heappush(profiles, entry)
+                else:
+                    heapq.heapreplace(profiles, entry)
+
+        self._frame_sections = None
+
+        return duration
+
+    def time_call(self, name, func, *args):
+        """
+        Call a function and record how long it took, for the callback's entry points other than process_callback.
+
+        :param str name: The name to record the time under.
+        :param func: The function.
+        :param args: Its arguments.
+        :return: What the function returned.
+        """
+        t0 = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def record(self, name, duration):
+        """
+        Record a time under a name, for anything timed outside of the profiler.
+
+        :param str name: The name to record the time under.
+        :param float duration: The time, in seconds.
+        :return: None
+        """
+        self.timings.add_stage(name).record(duration)
+
+    def section(self, name):
+        """
+        Get a context manager that times a section of code, each time it runs, under name.
+
+        :param str name: The name of the section.
+        :return: The context manager.
+        """
+        section = self._sections.get(name)
+        if section is None:
+            section = _Section(self, name)
+            self._sections[name] = section
+        return section
+
+    def slowest_frames(self):
+        """
+        :return: A list of (duration, frame_cnt, parse_time, sections) of the slowest frames, slowest first. sections
+        is a dict of the time each section took in the frame, or None if no sections were timed.
+        """
+        return [(w[0], w[2], w[3], w[4]) for w in sorted(self.worst_frames, reverse=True)]
+
+    def report(self, num_functions=15):
+        """
+        Format the timings, the slowest frames and any profiles.
+
+        :param int num_functions: The number of functions to list from each profile, by cumulative time.
+        :return: The report string.
+        """
+        lines = [self.timings.report(title="Callback profile"), "",
+                 "Slowest frames (us)"]
+        for duration, frame_cnt, parse_time, sections in self.slowest_frames():
+            line = "frame {:>8}: process_callback {:>10.1f}".format(frame_cnt, duration * 1e6)
+            if parse_time is not None:
+                line = line + ", parse {:.1f}".format(parse_time * 1e6)
+            if sections:
+                line = line + ", " + ", ".join("{} {:.1f}".format(name, t * 1e6) for name, t in sections.items())
+            lines.append(line)
+
+        for duration, _, frame_cnt, profile in sorted(self.profiles, reverse=True):
+            out = io.StringIO()
+            pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(num_functions)
+            lines.append("")
+            lines.append("Profile of frame {}, {:.1f} us".format(frame_cnt, duration * 1e6))
+            lines.append(out.getvalue().strip())
+
+        return "\n".join(lines)
+
+    def write_report(self, path=None):
+        """
+        Write the report to a file.
+
+        :param str path: The file, report_file if None.
+        :return: None
+        """
+        with open(path if path is not None else self.report_file, "w") as f:
+            f.write(self.report())
+            f.write("\n")
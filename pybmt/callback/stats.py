@@ -0,0 +1,390 @@
+import math
+from collections import deque
+
+
+class Estimator:
+    """
+    The base class of the streaming statistics. Each estimator is updated with one value per frame and keeps its
+    statistic up to date in constant time, however many values it has seen or however long its window is, so they can
+    be used in process_callback without slowing it down as experiments get longer. This class should never be
+    instantiated directly, it provides only an abstract interface.
+    """
+
+    def update(self, x):
+        """
+        Add a value.
+
+        :param float x: The new value.
+        :return: The updated statistic.
+        """
+        pass
+
+    @property
+    def value(self):
+        """
+        The current statistic, None before any values have been added.
+        """
+        pass
+
+    def reset(self):
+        """
+        Forget all the values.
+
+        :return: None
+        """
+        pass
+
+
+class RunningMean(Estimator):
+    """
+    The mean of all the values so far.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+
+    def update(self, x):
+        self.count = self.count + 1
+        self.mean = self.mean + (x - self.mean) / self.count
+        return self.mean
+
+    @property
+    def value(self):
+        return self.mean if self.count > 0 else None
+
+
+class RunningVariance(Estimator):
+    """
+    The mean and variance of all the values so far, with Welford's algorithm, which doesn't lose precision like
+    keeping sums of squares does.
+    """
+
+    def __init__(self, ddof=0):
+        """
+        :param int ddof: Delta degrees of freedom, 0 for the population variance, 1 for the sample variance, like
+        numpy.var.
+        """
+        self.ddof = ddof
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+
+    def update(self, x):
+        self.count = self.count + 1
+        delta = x - self.mean
+        self.mean = self.mean + delta / self.count
+        self._m2 = self._m2 + delta * (x - self.mean)
+        return self.variance
+
+    @property
+    def variance(self):
+        if self.count <= self.ddof:
+            return None
+        return self._m2 / (self.count - self.ddof)
+
+    @property
+    def std(self):
+        variance = self.variance
+        return math.sqrt(variance) if variance is not None else None
+
+    @property
+    def value(self):
+        return self.variance
+
+
+class EWMA(Estimator):
+    """
+    An exponentially weighted moving average. Each new value gets weight alpha and the average so far 1 - alpha. The
+    first value starts the average.
+    """
+
+    def __init__(self, alpha=None, span=None):
+        """
+        :param float alpha: The weight of each new value, between 0 and 1.
+        :param float span: Alternatively, the span, in values, like pandas, alpha is 2 / (span + 1).
+        """
+        if (alpha is None) == (span is None):
+            raise ValueError("Give an EWMA one of alpha or span.")
+        if span is not None:
+            alpha = 2.0 / (span + 1.0)
+        if not 0 < alpha <= 1:
+            raise ValueError("EWMA alpha must be in (0, 1], not {}.".format(alpha))
+
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.mean = None
+
+    def update(self, x):
+        if self.mean is None:
+            self.mean = float(x)
+        else:
+            self.mean = self.mean + self.alpha * (x - self.mean)
+        return self.mean
+
+    @property
+    def value(self):
+        return self.mean
+
+
+class WindowedMean(Estimator):
+    """
+    The mean of the last window values, from a running sum. The value dropping out of the window is subtracted as the
+    new one is added. The sum is compensated (Kahan-Babuska summation), so rounding errors don't build up however
+    many values go through the window.
+    """
+
+    def __init__(self, window):
+        """
+        :param int window: The number of values to average over.
+        """
+        if window < 1:
+            raise ValueError("The window must hold at least one value.")
+
+        self.window = window
+        self._values = [0.0] * window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._sum = 0.0
+        self._compensation = 0.0
+        self._index = 0
+
+    def _add(self, x):
+        s = self._sum
+        t = s + x
+        if abs(s) >= abs(x):
+            self._compensation = self._compensation + ((s - t) + x)
+        else:
+            self._compensation = self._compensation + ((x - t) + s)
+        self._sum = t
+
+    def update(self, x):
+        i = self._index
+        if self.count < self.window:
+            self.count = self.count + 1
+        else:
+            self._add(-self._values[i])
+
+        self._values[i] = x
+        self._add(x)
+        self._index = i + 1 if i + 1 < self.window else 0
+
+        return (self._sum + self._compensation) / self.count
+
+    @property
+    def sum(self):
+        return self._sum + self._compensation
+
+    @property
+    def value(self):
+        return self.sum / self.count if self.count > 0 else None
+
+
+class WindowedMinMax(Estimator):
+    """
+    The minimum and maximum of the last window values. Each is kept with a monotonic deque, the candidates for the
+    minimum (or maximum) in the order they arrived. A new value removes the candidates it beats from the back, and
+    values leave from the front as they fall out of the window. Each value is added and removed at most once, a
+    constant cost per value on average.
+    """
+
+    def __init__(self, window):
+        """
+        :param int window: The number of values to take the minimum and maximum over.
+        """
+        if window < 1:
+            raise ValueError("The window must hold at least one value.")
+
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self._mins = deque()
+        self._maxs = deque()
+
+    def update(self, x):
+        n = self.count
+        self.count = n + 1
+
+        mins = self._mins
+        while mins and mins[-1][1] >= x:
+            mins.pop()
+        mins.append((n, x))
+        if mins[0][0] <= n - self.window:
+            mins.popleft()
+
+        maxs = self._maxs
+        while maxs and maxs[-1][1] <= x:
+            maxs.pop()
+        maxs.append((n, x))
+        if maxs[0][0] <= n - self.window:
+            maxs.popleft()
+
+        return mins[0][1], maxs[0][1]
+
+    @property
+    def min(self):
+        return self._mins[0][1] if self.count > 0 else None
+
+    @property
+    def max(self):
+        return self._maxs[0][1] if self.count > 0 else None
+
+    @property
+    def value(self):
+        return (self.min, self.max) if self.count > 0 else None
+
+
+class WindowedMedian(Estimator):
+    """
+    An approximate median of the last window values. The values are counted in a histogram of num_bins bins between
+    low and high, values outside are counted in the end bins. The median is tracked as a position in the histogram,
+    moved along as values come and go, and interpolated within its bin. It is within a bin width, (high - low) /
+    num_bins, of the true median, if the median is in range. With an even number of values, it is the lower of the
+    middle two. Updates cost the same however long the window is, and as the median usually moves by a bin or less per
+    value, little more than a few additions.
+    """
+
+    def __init__(self, window, low, high, num_bins=256):
+        """
+        :param int window: The number of values to take the median of.
+        :param float low: The low end of the range of values expected.
+        :param float high: The high end of the range.
+        :param int num_bins: The number of histogram bins, more for a better approximation.
+        """
+        if window < 1:
+            raise ValueError("The window must hold at least one value.")
+        if not high > low:
+            raise ValueError("WindowedMedian high must be greater than low.")
+
+        self.window = window
+        self.low = low
+        self.high = high
+        self.num_bins = num_bins
+        self.bin_width = (high - low) / num_bins
+
+        self._counts = [0] * num_bins
+        self._bins = [0] * window
+        self.reset()
+
+    def reset(self):
+        for i in range(self.num_bins):
+            self._counts[i] = 0
+        self.count = 0
+        self._index = 0
+
+        # The bin the median is in, and the number of values in the bins below it.
+        self._median_bin = 0
+        self._below = 0
+
+    def update(self, x):
+        counts = self._counts
+
+        b = int((x - self.low) / self.bin_width)
+        if b < 0:
+            b = 0
+        elif b >= self.num_bins:
+            b = self.num_bins - 1
+
+        # Add the new value and drop the one falling out of the window.
+        i = self._index
+        if self.count < self.window:
+            self.count = self.count + 1
+        else:
+            old = self._bins[i]
+            counts[old] = counts[old] - 1
+            if old < self._median_bin:
+                self._below = self._below - 1
+
+        self._bins[i] = b
+        counts[b] = counts[b] + 1
+        if b < self._median_bin:
+            self._below = self._below + 1
+        self._index = i + 1 if i + 1 < self.window else 0
+
+        # Move to the bin with the (lower) median in it, the value of rank half.
+        half = (self.count + 1) // 2
+        m = self._median_bin
+        below = self._below
+        while below >= half:
+            m = m - 1
+            below = below - counts[m]
+        while below + counts[m] < half:
+            below = below + counts[m]
+            m = m + 1
+        self._median_bin = m
+        self._below = below
+
+        return self.value
+
+    @property
+    def value(self):
+        if self.count == 0:
+            return None
+
+        # Assume the values are spread evenly through the bin, update has already moved to the median bin.
+        half = (self.count + 1) // 2
+        m = self._median_bin
+        return self.low + (m + (half - self._below - 0.5) / self._counts[m]) * self.bin_width
+
+
+class StateStats:
+    """
+    Several estimators, on several fields of the tracking state, updated together once per frame. For example:
+
+        stats = StateStats({'speed': [WindowedMean(25), WindowedMinMax(100)],
+                            'heading': EWMA(alpha=0.1)})
+        stats.update(track_state)
+        avg_speed = stats['speed'][0].value
+
+    Only scalar fields can be used.
+    """
+
+    def __init__(self, estimators):
+        """
+        :param dict estimators: Maps field names to an estimator, or a list of estimators.
+        """
+        self.estimators = {}
+        self._updates = []
+        for field, field_estimators in estimators.items():
+            self.estimators[field] = field_estimators
+            if isinstance(field_estimators, Estimator):
+                field_estimators = [field_estimators]
+            for estimator in field_estimators:
+                self._updates.append((field, estimator.update))
+
+    def __getitem__(self, field):
+        return self.estimators[field]
+
+    def update(self, track_state):
+        """
+        Update the estimators with a new state.
+
+        :param track_state: The FicTracState, or anything with the fields as attributes.
+        :return: None
+        """
+        for field, update in self._updates:
+            update(getattr(track_state, field))
+
+    def reset(self):
+        """
+        Reset all the estimators.
+
+        :return: None
+        """
+        for field_estimators in self.estimators.values():
+            if isinstance(field_estimators, Estimator):
+                field_estimators = [field_estimators]
+            for estimator in field_estimators:
+                estimator.reset()
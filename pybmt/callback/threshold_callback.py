@@ -1,7 +1,7 @@
-import basler
+from pybmt.callback.actions import ActionExecutor
 from pybmt.callback.base import PyBMTCallback
-from collections import deque
-
+from pybmt.callback.stats import WindowedMean
+from pybmt.callback.triggers import Derived, Threshold, Trigger, TriggerEngine
 from pybmt.fictrac.state import FicTracState
 
 
@@ -12,13 +12,18 @@ class ThresholdCallback(PyBMTCallback):
     stimuli response.
     """
 
-    def __init__(self, speed_threshold=0.009, num_frames_mean=25, arduino=None, cameras=None):
+    def __init__(self, speed_threshold=0.009, num_frames_mean=25, arduino=None, cameras=None,
+                 speed_off_threshold=None, min_frames=1):
         """
         Setup a closed loop experiment that keeps track of a running average of the ball speed and generates a stimulus
         when the speed crosses a threshold.
 
         :param speed_threshold: The speed threshold that must be reached to generate a stimulus.
         :param num_frames_mean: The number frames to use in computing the average.
+        :param speed_off_threshold: The speed the average has to drop below to stop the stimulus, speed_threshold if
+        None. Set it lower than speed_threshold so noise around the threshold doesn't toggle the stimulus.
+        :param min_frames: The number of frames in a row the average speed has to be over (or under) the threshold
+        before the stimulus goes on (or off).
         """
 
         # Call the base class constructor
@@ -26,6 +31,8 @@ class ThresholdCallback(PyBMTCallback):
 
         self.speed_threshold = speed_threshold
         self.num_frames_mean = num_frames_mean
+        self.speed_off_threshold = speed_off_threshold
+        self.min_frames = min_frames
         self.arduino = arduino
         self.cameras = cameras
 
@@ -36,11 +43,18 @@ class ThresholdCallback(PyBMTCallback):
         :return:
         """
 
-        # Our buffer of past speeds
-        self.speed_history = deque(maxlen=self.num_frames_mean)
+        # The stimulus is on while the running average of the speed over the last num_frames_mean frames is over
+        # the threshold.
+        self.avg_speed = WindowedMean(self.num_frames_mean)
+        stimulus = Threshold(Derived('speed', self.avg_speed), on=self.speed_threshold, off=self.speed_off_threshold)
+        self.triggers = TriggerEngine([Trigger('stimulus', stimulus, min_on_frames=self.min_frames,
+                                               min_off_frames=self.min_frames)])
 
         self.is_signal_on = False
 
+        # Camera recording blocks for a while (the arduino trigger alone sleeps for 100 ms), so it is run on a worker
+        # thread and doesn't hold up tracking.
+        self.actions = ActionExecutor().start()
 
     def process_callback(self, track_state: FicTracState):
         """
@@ -52,32 +66,41 @@ class ThresholdCallback(PyBMTCallback):
         :return:
         """
 
-        # Get the current ball speed
-        speed = track_state.speed
-
-        # Add the speed to our history
-        self.speed_history.append(speed)
+        for transition in self.triggers.update(track_state):
+            self.is_signal_on = transition.active
+            if transition.active:
+                self._stimulus_on(transition.frame_cnt)
+            else:
+                self._stimulus_off(transition.frame_cnt)
 
-        # Get the running average speed
-        avg_speed = sum(self.speed_history)/len(self.speed_history)
+        return True
 
-        if avg_speed > self.speed_threshold and not self.is_signal_on:
-            print("Stimulus ON!")
-            # Start image aquisition of Basler cameras in sync with Basler.py code
-            basler.all_cameras_record(arduino=self.arduino, cam_array=self.cameras)
-            self.is_signal_on = True
+    def _stimulus_on(self, frame_cnt):
+        print("Stimulus ON!")
 
-        if avg_speed < self.speed_threshold and self.is_signal_on:
-            # Stop image aquisition of Basler cameras in sync with Basler.py code
-            print("Stimulus OFF!")
-            self.is_signal_on = False
+        # Start image aquisition of Basler cameras in sync with Basler.py code. If the cameras are still recording
+        # from the last stimulus, this one is queued behind it, and further ones while it waits are dropped.
+        if self.cameras is not None:
+            with self.profile_section('stimulus'):
+                self.actions.submit(_record_cameras, self.arduino, self.cameras, key='cameras_record',
+                                    frame_cnt=frame_cnt)
 
-        return True
+    def _stimulus_off(self, frame_cnt):
+        # Stop image aquisition of Basler cameras in sync with Basler.py code
+        print("Stimulus OFF!")
 
     def shutdown_callback(self):
         """
-        We don't need to do anything special during shutdown.
+        Wait for any camera recording to finish.
 
         :return:
         """
-        pass
\ No newline at end of file
+        self.actions.shutdown(wait=True)
+        if len(self.actions.records) > 0:
+            print(self.actions.report())
+
+
+def _record_cameras(arduino, cameras):
+    # The basler module needs pypylon and pyserial, only import it if we have cameras to record.
+    import basler
+    basler.all_cameras_record(arduino=arduino, cam_array=cameras)
\ No newline at end of file
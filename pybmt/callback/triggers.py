@@ -0,0 +1,408 @@
+from collections import namedtuple
+
+# A trigger turning on (active is True) or off, on FicTrac frame frame_cnt.
+Transition = namedtuple('Transition', ['frame_cnt', 'trigger', 'active'])
+
+_NO_TRANSITIONS = ()
+
+
+class Signal:
+    """
+    A value worked out from each frame's tracking state, that conditions are declared over. Each signal is worked out
+    once per frame, however many conditions use it. This class should never be instantiated directly, it provides only
+    an abstract interface.
+    """
+
+    def key(self):
+        """
+        :return: Signals with the same key are the same signal, and only worked out once per frame.
+        """
+        return id(self)
+
+    def getter(self):
+        """
+        :return: A function that takes the FicTracState and returns the signal's value.
+        """
+        pass
+
+    def reset(self):
+        pass
+
+
+class Field(Signal):
+    """
+    A field of the tracking state, like 'speed'. Plain strings are taken as fields wherever a signal is expected.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def key(self):
+        return ('field', self.name)
+
+    def getter(self):
+        name = self.name
+        return lambda state: getattr(state, name)
+
+
+class Derived(Signal):
+    """
+    A derived signal, a field of the tracking state run through a pybmt.callback.stats estimator. For example the
+    speed averaged over the last 25 frames, Derived('speed', WindowedMean(25)).
+    """
+
+    def __init__(self, field, estimator):
+        self.field = field
+        self.estimator = estimator
+
+    def getter(self):
+        name = self.field
+        update = self.estimator.update
+        return lambda state: update(getattr(state, name))
+
+    def reset(self):
+        self.estimator.reset()
+
+
+class Function(Signal):
+    """
+    A signal worked out by any function of the tracking state.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def getter(self):
+        return self.func
+
+
+def _as_signal(signal):
+    if isinstance(signal, Signal):
+        return signal
+    if isinstance(signal, str):
+        return Field(signal)
+    if callable(signal):
+        return Function(signal)
+
+    raise TypeError("Expected a signal, a field name or a function, not {!r}.".format(signal))
+
+
+class Condition:
+    """
+    Something that is true or false on each frame. Conditions can be put together with & (All), | (Any) and ~ (Not).
+    This class should never be instantiated directly, it provides only an abstract interface.
+    """
+
+    def signals(self):
+        """
+        :return: The signals the condition uses.
+        """
+        return []
+
+    def compile(self, signal_index):
+        """
+        Turn the condition into a function that is called once per frame.
+
+        :param signal_index: Maps each signal's key to the index of its value in the list of the frame's values.
+        :return: A function that takes the list of the frame's signal values and returns True or False.
+        """
+        pass
+
+    def __and__(self, other):
+        return All(self, other)
+
+    def __or__(self, other):
+        return Any(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+
+class Threshold(Condition):
+    """
+    A signal above a threshold, with hysteresis. The condition becomes true when the signal goes above on, and only
+    becomes false again when the signal goes below off, so noise around the threshold doesn't toggle it. With
+    below=True it is the other way around, true when the signal goes below on and false again when it goes above off.
+    """
+
+    def __init__(self, signal, on, off=None, below=False):
+        """
+        :param signal: The signal, a Signal, a field name, or a function of the tracking state.
+        :param float on: The level the signal has to cross to make the condition true.
+        :param float off: The level the signal has to cross back over to make it false again, on if None.
+        :param bool below: Trigger on the signal going below the levels instead of above.
+        """
+        self.signal = _as_signal(signal)
+        self.on = on
+        self.off = on if off is None else off
+        self.below = below
+
+        if (not below and self.off > self.on) or (below and self.off < self.on):
+            raise ValueError("A Threshold's off level must be on the other side of its on level, on={}, off={}".format(
+                self.on, self.off))
+
+    def signals(self):
+        return [self.signal]
+
+    def compile(self, signal_index):
+        i = signal_index[self.signal.key()]
+        on = self.on
+        off = self.off
+        state = [False]
+
+        if self.below:
+            def evaluate(values):
+                x = values[i]
+                if state[0]:
+                    if x > off:
+                        state[0] = False
+                elif x < on:
+                    state[0] = True
+                return state[0]
+        else:
+            def evaluate(values):
+                x = values[i]
+                if state[0]:
+                    if x < off:
+                        state[0] = False
+                elif x > on:
+                    state[0] = True
+                return state[0]
+
+        return evaluate
+
+
+class All(Condition):
+    """
+    True when all of the conditions are. Every condition is evaluated each frame, so thresholds keep track of their
+    state.
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = list(conditions)
+
+    def signals(self):
+        return [s for c in self.conditions for s in c.signals()]
+
+    def compile(self, signal_index):
+        evaluators = [c.compile(signal_index) for c in self.conditions]
+
+        def evaluate(values):
+            result = True
+            for e in evaluators:
+                if not e(values):
+                    result = False
+            return result
+
+        return evaluate
+
+
+class Any(Condition):
+    """
+    True when any of the conditions is. Every condition is evaluated each frame, so thresholds keep track of their
+    state.
+    """
+
+    def __init__(self, *conditions):
+        self.conditions = list(conditions)
+
+    def signals(self):
+        return [s for c in self.conditions for s in c.signals()]
+
+    def compile(self, signal_index):
+        evaluators = [c.compile(signal_index) for c in self.conditions]
+
+        def evaluate(values):
+            result = False
+            for e in evaluators:
+                if e(values):
+                    result = True
+            return result
+
+        return evaluate
+
+
+class Not(Condition):
+    """
+    True when the condition isn't.
+    """
+
+    def __init__(self, condition):
+        self.condition = condition
+
+    def signals(self):
+        return self.condition.signals()
+
+    def compile(self, signal_index):
+        e = self.condition.compile(signal_index)
+        return lambda values: not e(values)
+
+
+class Trigger:
+    """
+    A named trigger, that turns on and off with its condition. It is debounced, the condition has to hold for
+    min_on_frames frames in a row to turn the trigger on, and not hold for min_off_frames frames in a row to turn it
+    off. Once it has turned off, it stays off for at least refractory_frames frames.
+    """
+
+    def __init__(self, name, condition, min_on_frames=1, min_off_frames=1, refractory_frames=0, on_change=None):
+        """
+        :param str name: The name of the trigger, in the transitions.
+        :param condition: The Condition.
+        :param int min_on_frames: The number of frames in a row the condition must hold to turn the trigger on.
+        :param int min_off_frames: The number of frames in a row it must not hold to turn the trigger off.
+        :param int refractory_frames: The number of frames the trigger stays off for after turning off.
+        :param on_change: A function called with the Transition and the tracking state each time the trigger turns on
+        or off.
+        """
+        if min_on_frames < 1 or min_off_frames < 1:
+            raise ValueError("A trigger's condition has to hold for at least one frame.")
+
+        self.name = name
+        self.condition = condition
+        self.min_on_frames = min_on_frames
+        self.min_off_frames = min_off_frames
+        self.refractory_frames = refractory_frames
+        self.on_change = on_change
+
+
+class TriggerEngine:
+    """
+    Evaluates a set of triggers on each frame. The triggers' conditions are compiled once, into a list of the signals
+    to work out and a function per trigger. Each frame, each signal is worked out once, then each trigger's condition
+    is evaluated and the trigger's debouncing is applied. This is a fixed amount of work per frame, with nothing
+    allocated unless a trigger turns on or off.
+
+    Every transition is logged, with its frame number, in transitions.
+    """
+
+    def __init__(self, triggers=()):
+        """
+        :param triggers: The Trigger objects, more can be added with add().
+        """
+        self.triggers = []
+        for trigger in triggers:
+            self.add(trigger)
+
+        self._compiled = False
+        self.transitions = []
+
+    def add(self, trigger):
+        """
+        Add a trigger, before the engine has started.
+
+        :param trigger: The Trigger.
+        :return: The Trigger.
+        """
+        if any(t.name == trigger.name for t in self.triggers):
+            raise ValueError("There is already a trigger named '{}'.".format(trigger.name))
+
+        self.triggers.append(trigger)
+        self._compiled = False
+        return trigger
+
+    def compile(self):
+        """
+        Compile the triggers, this is done on the first update() if it hasn't been done already. Compiling again
+        resets the state of all the triggers.
+
+        :return: None
+        """
+        self._getters = []
+        signal_index = {}
+        for trigger in self.triggers:
+            for signal in trigger.condition.signals():
+                key = signal.key()
+                if key not in signal_index:
+                    signal_index[key] = len(self._getters)
+                    self._getters.append(signal.getter())
+
+        self._values = [0.0] * len(self._getters)
+        self._evaluators = [t.condition.compile(signal_index) for t in self.triggers]
+
+        num_triggers = len(self.triggers)
+        self._names = [t.name for t in self.triggers]
+        self._min_on = [t.min_on_frames for t in self.triggers]
+        self._min_off = [t.min_off_frames for t in self.triggers]
+        self._refractory = [t.refractory_frames for t in self.triggers]
+        self._on_change = [t.on_change for t in self.triggers]
+
+        # Per trigger, whether it is on, how many frames in a row its condition has disagreed with that, and the first
+        # frame it can turn on again.
+        self._active = [False] * num_triggers
+        self._streak = [0] * num_triggers
+        self._ready_at = [0] * num_triggers
+
+        self._frame = 0
+        self._compiled = True
+
+    def reset(self):
+        """
+        Turn all the triggers off, reset the derived signals, and clear the transitions.
+
+        :return: None
+        """
+        for trigger in self.triggers:
+            for signal in trigger.condition.signals():
+                signal.reset()
+
+        self.transitions = []
+        self.compile()
+
+    def update(self, state):
+        """
+        Evaluate the triggers on a new frame.
+
+        :param state: The FicTracState.
+        :return: The Transitions on this frame, an empty sequence if no trigger turned on or off.
+        """
+        if not self._compiled:
+            self.compile()
+
+        values = self._values
+        for i, getter in enumerate(self._getters):
+            values[i] = getter(state)
+
+        frame = self._frame
+        self._frame = frame + 1
+
+        active = self._active
+        streak = self._streak
+        transitions = _NO_TRANSITIONS
+        for i, evaluate in enumerate(self._evaluators):
+            if evaluate(values) == active[i]:
+                streak[i] = 0
+                continue
+
+            n = streak[i] + 1
+            streak[i] = n
+            if active[i]:
+                if n < self._min_off[i]:
+                    continue
+                self._ready_at[i] = frame + 1 + self._refractory[i]
+            elif n < self._min_on[i] or frame < self._ready_at[i]:
+                continue
+
+            active[i] = not active[i]
+            streak[i] = 0
+
+            transition = Transition(state.frame_cnt, self._names[i], active[i])
+            self.transitions.append(transition)
+            if transitions is _NO_TRANSITIONS:
+                transitions = []
+            transitions.append(transition)
+
+            if self._on_change[i] is not None:
+                self._on_change[i](transition, state)
+
+        return transitions
+
+    def is_active(self, name):
+        """
+        :param str name: The name of a trigger.
+        :return: Whether the trigger is on.
+        """
+        if not self._compiled:
+            return False
+
+        return self._active[self._names.index(name)]
@@ -0,0 +1,168 @@
+import inspect
+import time
+
+import zmq
+import zmq.asyncio
+
+from pybmt.fictrac.driver import FicTracDriver
+
+
+async def _maybe_await(result):
+    """
+    Await the result of a callback entry point if it is a coroutine, so plain PyBMTCallback objects work too.
+    """
+    if inspect.isawaitable(result):
+        return await result
+    else:
+        return result
+
+
+class AsyncFicTracDriver(FicTracDriver):
+    """
+    An asyncio version of FicTracDriver built on zmq.asyncio. run() is a coroutine, FicTrac's messages are received
+    without blocking the event loop and the callback entry points are awaited. This lets experiment code run serial
+    I/O, camera control, UI updates, etc. as tasks on the same event loop as the tracking, without threads.
+
+    The callback should be an AsyncPyBMTCallback, a plain PyBMTCallback works as well. Message parsing and validation
+    are shared with FicTracDriver, it takes the same arguments.
+    """
+
+    # The type of zero MQ context the message socket is created with.
+    _zmq_context_type = zmq.asyncio.Context
+
+    async def run(self):
+        """
+        Start the the FicTrac process and run until it closes. The callback is awaited each time the tracking state
+        is updated.
+
+        :return:
+        """
+
+        if self.recv_queue_size is not None:
+            raise ValueError("AsyncFicTracDriver receives on the event loop, recv_queue_size is not supported.")
+
+        # Setup anything the callback needs.
+        self._enable_profiling()
+        await self._await_callback('setup_callback')
+
+        try:
+            self._start_run()
+
+            # Start FicTrac if we need to, the message loop polls for the first frame while it starts up.
+            if self.start_fictrac:
+                with open(self.console_output_file, "wb") as out:
+                    self._start_fictrac_process(out)
+
+                    await self._process_messages()
+            else:
+                await self._process_messages()
+
+            self._check_exit_status()
+
+        except Exception as ex:
+            self._terminate_fictrac()
+
+            raise Exception("PyBMT Error!") from ex
+        finally:
+            self._end_run()
+            await self._await_callback('shutdown_callback')
+            self._finish_run()
+
+    async def _process_messages(self):
+
+        socket = self._connect()
+        try:
+            await self._message_loop(socket)
+        finally:
+            self._disconnect(socket)
+
+    async def _message_loop(self, socket):
+
+        isOK = True
+        while isOK:
+
+            # Receive state update from FicTrac process
+            data = await self._next_message(socket)
+            if data is None:
+                break
+
+            # Message received start the timer, want to keep track of how long it takes to process the message.
+            t0 = time.perf_counter()
+
+            # Parse the data packet into our state structure. Get our new state.
+            fstate = self._parse_message(data)
+
+            # If FicTrac sent and END signal, its time to clean up
+            if fstate is None:
+                break
+
+            isOK = await self._process_frame_async(fstate, t0)
+
+        self._terminate_fictrac()
+
+    async def _next_message(self, socket):
+        """
+        Wait for the next message from FicTrac. While starting up the socket is polled at startup_poll_interval, and
+        FicTrac is checked on between polls.
+
+        :param socket: The zero MQ SUB socket connected to FicTrac.
+        :return: The message, or None if FicTrac has gone away.
+        """
+        if self.time_to_first_frame is None:
+            poll_ms = max(1, int(self.startup_poll_interval * 1000))
+            while not await socket.poll(poll_ms):
+                self._check_startup()
+
+            return await self._recv_message(socket)
+
+        if await socket.poll(socket.RCVTIMEO):
+            return await self._recv_message(socket)
+
+        # If we get socket error, probably means fictrac is gone.  If we started it, just stop.
+        # If we didn't start it, signal the connection error.
+        if self.start_fictrac:
+            return None
+        else:
+            raise Exception("Socket timed out. Couldn't reach fictrac!")
+
+    async def _process_frame_async(self, fstate, t0):
+        """
+        FicTracDriver._process_frame, with the callback's entry points awaited.
+
+        :param fstate: The frame's state.
+        :param float t0: The time.perf_counter() when the frame's message arrived and parsing started.
+        :return: What process_callback returned, False if process_gap stopped the run.
+        """
+
+        # Let the callback know if frames went missing, it can decide to stop.
+        gap = self._check_frame(fstate)
+        if gap is not None and await self._await_callback('process_gap', *gap) is False:
+            return False
+
+        t1 = self._prepare_frame(fstate, t0)
+
+        # Call the main callback function with the current state
+        isOK = await _maybe_await(self.track_change_callback.process_callback(fstate))
+
+        self._finish_frame(fstate, t0, t0, t1)
+
+        return isOK
+
+    async def _await_callback(self, name, *args):
+        """
+        Call one of the callback's entry points, other than process_callback, awaiting it if it is a coroutine, and
+        timing it if we are profiling.
+
+        :param str name: The name of the method.
+        :param args: Its arguments.
+        :return: What it returned.
+        """
+        method = getattr(self.track_change_callback, name)
+        if self.profiler is None:
+            return await _maybe_await(method(*args))
+
+        t0 = time.perf_counter()
+        try:
+            return await _maybe_await(method(*args))
+        finally:
+            self.profiler.record(name, time.perf_counter() - t0)
@@ -0,0 +1,39 @@
+def read_fictrac_config(config_file):
+    """
+    Read a FicTrac configuration file. Each line of the file is a "key : value" pair, lines starting with # are
+    comments. The values are left as strings, exactly as they appear in the file, FicTrac itself is the authority on
+    how they are interpreted.
+
+    :param str config_file: The path to the FicTrac configuration file.
+    :return: A dict mapping each key to its value string.
+    """
+    config = {}
+    with open(config_file, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+
+            key, sep, value = line.partition(":")
+            if sep == "":
+                continue
+
+            config[key.strip()] = value.strip()
+
+    return config
+
+
+def get_socket_port(config_file, default=5556):
+    """
+    Get the port FicTrac will publish its tracking state on, the socket_port setting in its configuration file.
+
+    :param str config_file: The path to the FicTrac configuration file.
+    :param int default: The port to use if the file doesn't set one, FicTrac's default.
+    :return: The port number.
+    """
+    config = read_fictrac_config(config_file)
+
+    if "socket_port" not in config:
+        return default
+
+    return int(config["socket_port"])
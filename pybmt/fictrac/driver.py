@@ -1,11 +1,18 @@
+import ctypes
 import subprocess
 import time
 import os
-from collections import deque
 
 import zmq
 
-from pybmt.fictrac.state import FicTracState
+from pybmt.callback.profiling import CallbackProfiler
+from pybmt.fictrac.config import get_socket_port
+from pybmt.fictrac.latency import LatencyStats
+from pybmt.fictrac.plot import PlotProcess
+from pybmt.fictrac.receiver import MessageReceiver
+from pybmt.fictrac.shmem import SharedLatestState
+from pybmt.fictrac.state import FicTracState, FicTracStateView
+from pybmt.fictrac.watchdog import DeadlineWatchdog
 from pybmt.tools import which
 
 
@@ -14,8 +21,21 @@ class FicTracDriver:
     This class drives the tracking of the fly via a separate software called FicTrac. It invokes this process and
     calls a control function once for each time the tracking state is updated.
     """
+
+    # The type of zero MQ context the message socket is created with.
+    _zmq_context_type = zmq.Context
+
+    # The stages of processing a frame that are timed when tracking latency. recv_to_parse is the time from a message
+    # arriving until we start parsing it (time spent in the receive queue), process is parse and callback together,
+    # total is from arrival until the callback returns, and jitter is how far the time between message arrivals is
+    # off from the time between FicTrac frames.
+    LATENCY_STAGES = ('recv_to_parse', 'parse', 'callback', 'process', 'total', 'jitter')
+
     def __init__(self, config_file=None, remote_endpoint_url=None, console_ouput_file="output.txt",
-                 track_change_callback=None, pgr_enable=False, plot_on=True, fic_trac_bin_path=None):
+                 track_change_callback=None, pgr_enable=False, plot_on=False, fic_trac_bin_path=None,
+                 binary_msgs=False, reuse_state=False, recv_queue_size=None, drop_policy='block',
+                 track_latency=False, tolerate_gaps=False, max_lost_frames=None, state_shmem_name=None,
+                 recorder=None, watchdog_policy='warn', profile=False):
         """
         Create the FicTrac driver object. This function will perform a check to see if the FicTrac program is present
         on the path. If it is not, it will throw an exception.
@@ -27,33 +47,129 @@ class FicTracDriver:
         control.FlyVRCallback for example.
         :param bool pgr_enable: Is Point Grey camera support needed. This just decides which executable to call, either
         'FicTrac' or 'FicTrac-PGR'.
+        :param bool plot_on: Plot the tracking state live, in a separate process, see pybmt.fictrac.plot.PlotProcess.
+        The plot is set up with plot_args, the process is spawned rather than forked unless plot_args says otherwise.
+        Default is False. It used to default to True when plotting did nothing, now that it starts a matplotlib process
+        it has to be asked for.
         :param str fic_trac_bin_path: The path the the fictrac binary to use. Default is None. If None, we will try to
-        find fictrac on the path.
+        find fictrac on the path. This can also be a list, a command and its leading arguments, to start something
+        else in place of FicTrac. For example [sys.executable, '-m', 'pybmt.fictrac.simulator'] runs the simulator
+        (pybmt.fictrac.simulator) locally, on the config file's socket_port.
         :param str remote_enpoint_url
+        :param bool binary_msgs: Expect binary messages from FicTrac, each message is the packed FicTracState
+        structure. These are mapped straight onto the received frame, no string decoding or parsing is done. If
+        False, the default, FicTrac's comma separated text messages are expected.
+        :param bool reuse_state: Parse each message into one of two preallocated states instead of allocating a new
+        state per frame. The callback gets a read-only FicTracStateView that is only valid until the next frame is
+        processed, call snapshot() on it to keep a copy.
+        :param int recv_queue_size: If not None, receive messages on a dedicated thread and hand them over through a
+        queue of this size, see pybmt.fictrac.receiver.MessageReceiver. Default is None, receive on the thread that
+        calls run().
+        :param str drop_policy: What to do when the receive queue is full, 'block', 'drop_oldest' or 'conflate'. With
+        'drop_oldest' and 'conflate' a slow callback loses frames instead of stopping the run, the number lost is
+        kept in num_dropped_frames.
+        :param bool track_latency: Time each stage of processing every frame into histograms, see LATENCY_STAGES. A
+        summary is printed at shutdown and get_latency_stats() returns it while running.
+        :param bool tolerate_gaps: Keep running when FicTrac's frame counter jumps, instead of stopping with an error.
+        Each missing range of frames is added to gap_log and passed to the callback's process_gap. Loss statistics are
+        printed at shutdown, see get_loss_stats().
+        :param int max_lost_frames: With tolerate_gaps, the loss budget. Stop with an error if more than this many
+        frames go missing in total. None, the default, allows any number.
+        :param str state_shmem_name: If not None, publish the latest state in a shared memory block with this name,
+        for other local processes to read, see pybmt.fictrac.shmem.SharedLatestState. The block exists while run()
+        is running, run() fails if a block with this name already exists.
+        pybmt.fictrac.shmem.DEFAULT_STATE_SHMEM_NAME is what the plotter looks for by default.
+        :param recorder: A pybmt.fictrac.recorder.SessionRecorder to record every state, and any gaps, in. It is opened
+        when run() starts and closed when it finishes. None, the default, records nothing.
+        :param str watchdog_policy: What to do when processing can't keep up with FicTrac, 'warn', 'shed' or 'stop',
+        see pybmt.fictrac.watchdog.DeadlineWatchdog. Default is 'warn'. None turns the watchdog off. The watchdog is
+        in the watchdog attribute, its deadline and lag limit can be set there. With a lossy drop_policy, falling
+        behind only loses frames, 'stop' just warns.
+        :param profile: Profile the callback, see pybmt.callback.profiling.CallbackProfiler. True profiles with the
+        default settings, or pass a CallbackProfiler to choose them. The report is printed at shutdown. False, the
+        default, doesn't profile.
         """
 
         self.track_change_callback = track_change_callback
         self.plot_on = plot_on
+        self.binary_msgs = binary_msgs
+
+        # Two preallocated states, double buffered, that messages are parsed into when we are reusing state. The
+        # callback always gets the newest one, the other still holds the previous frame.
+        self.reuse_state = reuse_state
+        self._state_buffers = [FicTracStateView(), FicTracStateView()]
+        self._state_buffer_bytes = [memoryview(s).cast('B') for s in self._state_buffers]
+        self._state_buffer_index = 0
+
+        # Receive on a separate thread, through a bounded queue, if asked to.
+        if recv_queue_size is not None and drop_policy not in MessageReceiver.DROP_POLICIES:
+            raise ValueError("Unknown drop policy '{}', must be one of {}.".format(drop_policy,
+                                                                                 MessageReceiver.DROP_POLICIES))
+        self.recv_queue_size = recv_queue_size
+        self.drop_policy = drop_policy
+        self._receiver = None
+        self.num_dropped_frames = 0
+
+        # Checks each frame is processed before FicTrac's next frame, so we don't fall behind FicTrac in state.
+        self.watchdog = DeadlineWatchdog(policy=watchdog_policy) if watchdog_policy is not None else None
+
+        # How long to wait, in seconds, for the first tracking state to arrive from FicTrac before failing out, and
+        # how often to check on the FicTrac process while waiting.
+        self.startup_timeout = 10.0
+        self.startup_poll_interval = 0.01
+
+        # The time, in seconds, from starting FicTrac (or connecting to it) until the first frame was received.
+        self.time_to_first_frame = None
+        self._t_start = None
+
+        # Per frame latency histograms, if we are tracking them.
+        self.latency_stats = LatencyStats(self.LATENCY_STAGES) if track_latency else None
+
+        # Whether to keep running through gaps in the frame counter, and how many missing frames we can put up with.
+        self.tolerate_gaps = tolerate_gaps
+        self.max_lost_frames = max_lost_frames
+
+        # Where to publish the latest state for other processes, if anywhere.
+        self.state_shmem_name = state_shmem_name
+        self._state_shmem = None
+
+        # Where to record the session, if anywhere.
+        self.recorder = recorder
+
+        # Times the callback, if we are profiling it.
+        if isinstance(profile, CallbackProfiler):
+            self.profiler = profile
+        else:
+            self.profiler = CallbackProfiler() if profile else None
 
-        # The message loop has to stay above this average number of frames per second. If it falls below we are
-        # not grabbing messages fast enough and will fall behind FicTrac in state. I don't like this solution that
-        # much, with shared memory this was easier to detect.
-        self.average_fps_threshold = 400
+        # Keyword arguments for the PlotProcess started if plot_on is set, the fields to plot, display_rate, etc.
+        self.plot_args = {}
+        self._plotter = None
+
+        self._setup_source(config_file, remote_endpoint_url, console_ouput_file, pgr_enable, fic_trac_bin_path)
+
+        self.fictrac_process = None
+        self._reset_frame_accounting()
 
-        # This is the number of times to try an reconnect the the fictrac client over the socket before failing out.
-        # Each time will cause a sleep of 1 second.
-        self.max_num_connect_retries = 10
+    def _setup_source(self, config_file, remote_endpoint_url, console_ouput_file, pgr_enable, fic_trac_bin_path):
+        """
+        Work out where the states come from. If FicTrac is already running, for example on another machine, we
+        connect to it. Otherwise we start it ourselves, with the config file, and we have to find the binary first.
+        Drivers that get their states from somewhere else override this. The arguments are the same as __init__'s.
 
+        :return: None
+        """
         # If fictrac is already running, for example, on another machine, then we don't need to worry about running it.
         if remote_endpoint_url is not None:
             self.remote_endpoint_url = "tcp://" + remote_endpoint_url
             self.start_fictrac = False
         else:
             self.start_fictrac = True
-            self.remote_endpoint_url = "tcp://localhost:5556"
-
             self.config_file = config_file
 
+            # FicTrac publishes on the port set in its config file
+            self.remote_endpoint_url = "tcp://localhost:{}".format(get_socket_port(self.config_file))
+
             # Get the directory that the config file is in, this will be the current working directory
             # of FicTrac.
             self.config_dir = os.path.dirname(self.config_file)
@@ -64,9 +180,7 @@ class FicTracDriver:
             self.config_file_base = os.path.basename(self.config_file)
 
             self.console_output_file = console_ouput_file
-            self.track_change_callback = track_change_callback
             self.pgr_enable = pgr_enable
-            self.plot_on = plot_on
 
             # If the user didn't specify the path to fictrac, look for it on the path.
             if fic_trac_bin_path is None:
@@ -89,8 +203,6 @@ class FicTracDriver:
 
                 # TODO: Make sure we are using the correct version of fictrac.
 
-        self.fictrac_process = None
-
     def run(self):
         """
         Start the the FicTrac process and block till it closes. This function will poll a shared memory region for
@@ -101,51 +213,127 @@ class FicTracDriver:
         """
 
         # Setup anything the callback needs.
-        self.track_change_callback.setup_callback()
+        self._setup_callback()
 
         try:
-            # Start FicTrac if we need to
-            if self.start_fictrac:
-                with open(self.console_output_file, "wb") as out:
-                    self.fictrac_process = subprocess.Popen([self.fictrac_bin_fullpath,
-                                                         self.config_file_base],
-                                                         stdout=out, stderr=subprocess.STDOUT,
-                                                         cwd=self.config_dir)
-
-                    # Lets sleep for a couple seconds, give fictrac a chance to start up.
-                    # FIXME: Eww, this is hacky.
-                    time.sleep(2)
-
-                    self._process_messages()
-            else:
+            self._start_run()
+            self._run_messages()
+            self._check_exit_status()
+
+        except Exception as ex:
+            self._terminate_fictrac()
+
+            raise Exception("PyBMT Error!") from ex
+        finally:
+            self._end_run()
+            self._call_callback('shutdown_callback')
+            self._finish_run()
+
+    def _run_messages(self):
+        """
+        Process messages until FicTrac is done, or the callback stops. Start FicTrac if we need to. We don't wait for
+        it to start up here, the message loop polls for the first frame and keeps an eye on the process while it does.
+
+        :return: None
+        """
+        if self.start_fictrac:
+            with open(self.console_output_file, "wb") as out:
+                self._start_fictrac_process(out)
+
                 self._process_messages()
+        else:
+            self._process_messages()
 
-            # Call poll one last time to get the return value
-            self.fictrac_process.poll()
+    def _setup_callback(self):
+        """
+        Start profiling, if we are, and setup the callback.
 
-            # Get the fic trac process return code
-            if self.fictrac_process is not None and self.fictrac_process.returncode is not None and self.fictrac_process.returncode != 0:
-                raise RuntimeError("FicTrac failed because of an application error. " +
-                                   "Consult the FicTrac console output file ({}). ".format(self.console_output_file))
-            if self.frame_cnt == 0:
-                raise RuntimeError("Zero frames processed. FicTrac failed because of an application error. " +
-                             "Consult the FicTrac console output file ({}). ".format(self.console_output_file))
+        :return: None
+        """
+        self._enable_profiling()
+        self._call_callback('setup_callback')
 
+    def _start_run(self):
+        """
+        Get ready to process frames, after the callback is setup. The frame accounting is reset, and the shared
+        memory, plotter and recorder are started.
 
-        except Exception as ex:
-            if self.fictrac_process is not None:
-                self.fictrac_process.terminate()
+        :return: None
+        """
+        self._t_start = time.perf_counter()
+        self.time_to_first_frame = None
+        self._reset_frame_accounting()
+        self._open_outputs()
 
-            raise Exception("PyBMT Error!") from ex
+    def _end_run(self):
+        """
+        Stop the shared memory, plotter and recorder, and print the reports, before the callback is shutdown.
+
+        :return: None
+        """
+        self._close_outputs()
+        self._report_latency()
+        self._report_losses()
+        self._report_watchdog()
+
+    def _finish_run(self):
+        """
+        Print the profile report and clean up, after the callback is shutdown.
+
+        :return: None
+        """
+        try:
+            self._report_profile()
         finally:
-            self.track_change_callback.shutdown_callback()
             self._cleanup()
 
-    def _process_messages(self):
+    def _start_fictrac_process(self, out):
+        """
+        Launch the FicTrac process.
+
+        :param out: The open file FicTrac's console output should go to.
+        :return: The subprocess.Popen for FicTrac.
+        """
+        if isinstance(self.fictrac_bin_fullpath, (list, tuple)):
+            cmd = list(self.fictrac_bin_fullpath)
+        else:
+            cmd = [self.fictrac_bin_fullpath]
+
+        self.fictrac_process = subprocess.Popen(cmd + [self.config_file_base],
+                                                stdout=out, stderr=subprocess.STDOUT,
+                                                cwd=self.config_dir)
+        return self.fictrac_process
+
+    def _check_exit_status(self):
+        """
+        Check how things went once message processing is done, raise an exception if FicTrac failed.
+
+        :return: None
+        """
+
+        # Call poll one last time to get the return value
+        if self.fictrac_process is not None:
+            self.fictrac_process.poll()
+
+        # Get the fic trac process return code
+        if self.fictrac_process is not None and self.fictrac_process.returncode is not None and self.fictrac_process.returncode != 0:
+            raise RuntimeError("FicTrac failed because of an application error. " +
+                               "Consult the FicTrac console output file ({}). ".format(self.console_output_file))
+        if self.frame_cnt == 0:
+            raise RuntimeError("Zero frames processed. FicTrac failed because of an application error. " +
+                         "Consult the FicTrac console output file ({}). ".format(self.console_output_file))
+
+    def _connect(self, rcvhwm=1):
+        """
+        Setup the zero MQ context and SUB socket we receive FicTrac's state messages on.
+
+        :param int rcvhwm: The receive high water mark of the socket.
+        :return: The connected and subscribed socket.
+        """
 
         #  Setup ZeroMQ context and socket to talk to server
-        context = zmq.Context()
-        socket = context.socket(zmq.SUB)
+        self._zmq_context = self._zmq_context_type()
+        socket = self._zmq_context.socket(zmq.SUB)
 
         # Set a timeout on this socket so we don't block forever
         socket.RCVTIMEO = 1000  # in milliseconds
@@ -153,26 +341,45 @@ class FicTracDriver:
         # This is the receiver high water mark, zero mq will start to drop incoming messages after it
         # has queued this many. This will let us detect if we are not picking up messages quick enough because of a
         # slow callback process. This isn't perfect though since OS buffers messages as well.
-        socket.setsockopt(zmq.RCVHWM, 1)
+        socket.setsockopt(zmq.RCVHWM, rcvhwm)
 
         # Bind and subscribe
         socket.connect(self.remote_endpoint_url)
         socket.setsockopt(zmq.SUBSCRIBE, b"")
 
-        #           if self.plot_on:
-        #               self.plot_task = ConcurrentTask(task=plot_task_fictrac, comms="pipe",
-        #                                      taskinitargs=[state])
-        #               self.plot_task.start()
+        return socket
 
-        # Lets track average frame rate we are receiving the messages
-        # Our buffer of past speeds
-        time_history = deque(maxlen=10)
-        avg_fps = 0
-        self.frame_cnt = 0
+    def _disconnect(self, socket):
+        """
+        Close the socket and the zero MQ context created by _connect.
+
+        :return: None
+        """
+        socket.close(linger=0)
+        self._zmq_context.term()
+
+    def _process_messages(self):
+
+        self._receiver = None
+
+        # With a receiver thread, it owns the socket and stands in for it in the message loop.
+        if self.recv_queue_size is not None:
+            self._receiver = MessageReceiver(self, maxsize=self.recv_queue_size, drop_policy=self.drop_policy)
+            self._receiver.start()
+            try:
+                self._message_loop(self._receiver)
+            finally:
+                self._receiver.stop()
+            return
+
+        socket = self._connect()
+        try:
+            self._message_loop(socket)
+        finally:
+            self._disconnect(socket)
+
+    def _message_loop(self, socket):
 
-        # Lets keep track of the last fictrac state we received
-        last_fstate: FicTracState = None
-        fstate: FicTracState = None
         isOK = True
         while isOK:
 
@@ -181,76 +388,506 @@ class FicTracDriver:
             #    print("FicTrac process gone!")
             #    break
 
-            # Receive state update from FicTrac process
-            num_connect_trys = 0
-            while True:
-                try:
-                    data = socket.recv_string()
-
-                    # If we got data successfully, We can break out.
+            # Receive state update from FicTrac process, until the first frame arrives we are still starting up.
+            try:
+                if self.time_to_first_frame is None:
+                    data = self._wait_for_first_message(socket)
+                else:
+                    data = self._recv_message(socket)
+            except zmq.error.Again:
+
+                # If we get socket error, probably means fictrac is gone.  If we started it, just break.
+                # If we didn't start it, signal the connection error.
+                if self.start_fictrac:
                     break
-                except zmq.error.Again:
-
-                    # If we get socket error, probably means fictrac is gone.  If we started it, just break.
-                    # If we didn't start it, signal the connection error.
-                    if self.start_fictrac:
-
-                        if self.frame_cnt == 0:
-                            time.sleep(1)
-                            num_connect_trys = num_connect_trys + 1
-
-                            if num_connect_trys > self.max_num_connect_retries:
-                                isOK = False
-                                break
-                            else:
-                                pass
-                        else:
-                            isOK = False
-                            break
-                    else:
-                        raise Exception("Socket timed out. Couldn't reach fictrac!")
-
-            if not isOK:
-                break
+                else:
+                    raise Exception("Socket timed out. Couldn't reach fictrac!")
 
             # Message received start the timer, want to keep track of how long it takes to process the message.
             t0 = time.perf_counter()
 
+            # Parse the data packet into our state structure. Get our new state.
+            fstate = self._parse_message(data)
+
             # If FicTrac sent and END signal, its time to clean up
-            if data == "END":
+            if fstate is None:
                 break
 
-            # Lets keep track of the last fictrac state we received
-            last_fstate = fstate
+            isOK = self._process_frame(fstate, self._message_arrival_time(t0), t0)
 
-            # Parse the data packet into our state structure. Get our new state.
-            fstate = FicTracState.zmq_string_msg_to_state(data)
+        # Count any messages the receiver thread dropped in favour of the END message.
+        if self._receiver is not None:
+            self.num_dropped_frames = self._receiver.num_dropped_at_get
+
+        self._terminate_fictrac()
+
+    def _wait_for_first_message(self, socket):
+        """
+        Wait for the first message from FicTrac. The socket is polled at startup_poll_interval, between polls we check
+        that FicTrac is still running, so we return as soon as FicTrac is ready and fail as soon as it dies.
+
+        :param socket: The zero MQ SUB socket connected to FicTrac.
+        :return: The first message.
+        """
+        poll_ms = max(1, int(self.startup_poll_interval * 1000))
+        while True:
+            if socket.poll(poll_ms):
+                return self._recv_message(socket)
+
+            self._check_startup()
+
+    def _check_startup(self):
+        """
+        Make sure FicTrac is still starting up fine, called between polls while waiting for the first message.
+
+        :return: None
+        """
+        if self.fictrac_process is not None and self.fictrac_process.poll() is not None:
+            raise RuntimeError("FicTrac exited with return code {} before sending any tracking state. ".format(
+                               self.fictrac_process.returncode) +
+                               "Consult the FicTrac console output file ({}). ".format(self.console_output_file))
+
+        if time.perf_counter() - self._t_start > self.startup_timeout:
+            raise RuntimeError("No tracking state received from FicTrac within startup_timeout ({} s). ".format(
+                               self.startup_timeout) +
+                               "Is it running and publishing to {}?".format(self.remote_endpoint_url))
+
+    def _open_outputs(self):
+        """
+        Open everything the states are handed on to during the run. The session recorder, if we are recording, the
+        shared memory block the latest state is published in, if we are publishing it, and the plot process, if we
+        are plotting.
+
+        :return: None
+        """
+        if self.recorder is not None:
+            self.recorder.open()
+
+        if self.state_shmem_name is not None:
+            self._state_shmem = SharedLatestState.create(self.state_shmem_name)
+
+        if self.plot_on:
+            # By the time we start plotting the callback and receiver may have threads running, forking with those
+            # around isn't safe.
+            plot_args = {'start_method': 'spawn'}
+            plot_args.update(self.plot_args)
+            self._plotter = PlotProcess(**plot_args)
+            self._plotter.start()
+
+    def _close_outputs(self):
+        """
+        Close everything _open_outputs opened. The session recorder writes out what it has left, and the readers of
+        the published state and the plot process are told we are done before their shared memory is cleaned up.
+
+        :return: None
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+
+        if self._state_shmem is not None:
+            self._state_shmem.mark_closed()
+            self._state_shmem.close()
+            self._state_shmem = None
+
+        if self._plotter is not None:
+            self._plotter.stop()
+
+    def _first_frame_received(self):
+        """
+        Record how long it took to get the first frame from FicTrac.
+
+        :return: None
+        """
+        self.time_to_first_frame = time.perf_counter() - self._t_start
+        print("FicTrac time to first frame: {:.3f} s".format(self.time_to_first_frame))
+
+    def _reset_frame_accounting(self):
+        """
+        Reset the frame counting and timing history before processing messages.
+
+        :return: None
+        """
 
-            if last_fstate is not None and fstate.frame_cnt - last_fstate.frame_cnt != 1:
-                self.fictrac_process.terminate()
-                raise Exception(("FicTrac frame counter jumped by more than 1! oldFrame = " +
-                                 str(last_fstate.frame_cnt) + ", newFrame = " + str(fstate.frame_cnt)))
+        self.frame_cnt = 0
+        if self.watchdog is not None:
+            self.watchdog.reset()
+
+        # Lets keep track of the last fictrac frame we received
+        self._last_frame_cnt = None
+        self.num_dropped_frames = 0
+
+        # The (first, last) frame counts of each range of missing frames, and the number of frames lost in them.
+        self.gap_log = []
+        self.num_lost_frames = 0
+
+        # The arrival time and FicTrac frame counter and timestamp of the last message, for measuring jitter.
+        self._last_arrival = None
+        self._last_arrival_frame = None
+        self._last_arrival_timestamp = None
+        if self.latency_stats is not None:
+            self.latency_stats.clear()
+
+    def _check_frame(self, fstate):
+        """
+        Validate a newly parsed state against the previous one. FicTrac's frame counter should go up by exactly one
+        each message, otherwise we missed messages. If we are tolerating gaps, a jump forward is logged instead of
+        being an error, as long as we are within the loss budget.
+
+        :param fstate: The new state.
+        :return: The (first, last) frame counts of the missing frames if there was a gap we are tolerating, None
+        otherwise.
+        """
+
+        # If the receiver thread dropped messages since the last one, the frame counter jumps by that many more.
+        expected_jump = 1
+        if self._receiver is not None:
+            expected_jump = expected_jump + self._receiver.num_dropped_at_get - self.num_dropped_frames
+            self.num_dropped_frames = self._receiver.num_dropped_at_get
+
+        gap = None
+        if self._last_frame_cnt is not None and fstate.frame_cnt - self._last_frame_cnt != expected_jump:
+            jump = fstate.frame_cnt - self._last_frame_cnt
+
+            # A counter that doesn't go up isn't lost frames, FicTrac restarted or messages got out of order. Gaps
+            # can't be tolerated either.
+            if jump <= 0:
+                self._terminate_fictrac()
+                raise Exception(("FicTrac frame counter went backwards or repeated! oldFrame = " +
+                                 str(self._last_frame_cnt) + ", newFrame = " + str(fstate.frame_cnt)))
+
+            if not self.tolerate_gaps or jump < expected_jump:
+                self._terminate_fictrac()
+                raise Exception(("FicTrac frame counter jumped by {}, expected {}! oldFrame = ".format(
+                                 jump, expected_jump) + str(self._last_frame_cnt) + ", newFrame = " +
+                                 str(fstate.frame_cnt)))
+
+            # The range covers any frames the receiver thread dropped too, those aren't counted as lost.
+            gap = (self._last_frame_cnt + 1, fstate.frame_cnt - 1)
+            self.gap_log.append(gap)
+            self.num_lost_frames = self.num_lost_frames + jump - expected_jump
+
+            if self.recorder is not None:
+                self.recorder.record_event('gap', value=jump - expected_jump, frame_cnt=gap[0])
 
-            # Call the main callback function with the current state
-            isOK = self.track_change_callback.process_callback(fstate)
+            if self.max_lost_frames is not None and self.num_lost_frames > self.max_lost_frames:
+                self._terminate_fictrac()
+                raise Exception("FicTrac lost {} frames, more than the loss budget max_lost_frames ({}).".format(
+                                self.num_lost_frames, self.max_lost_frames))
 
-            # Stop the clock
+        # Lets keep track of the last fictrac frame we received
+        self._last_frame_cnt = fstate.frame_cnt
+
+        return gap
+
+    def _process_frame(self, fstate, t_arrival, t0):
+        """
+        Process a frame's state, everything that happens to each frame between parsing it and the next one. Gaps are
+        checked for and passed to the callback, the state is published, plotted and recorded, the callback is called
+        with it, and it is timed and checked by the watchdog.
+
+        :param fstate: The frame's state.
+        :param float t_arrival: The time.perf_counter() when the frame's message arrived.
+        :param float t0: The time.perf_counter() when parsing the message started.
+        :return: What process_callback returned, False if process_gap stopped the run.
+        """
+
+        # Let the callback know if frames went missing, it can decide to stop.
+        gap = self._check_frame(fstate)
+        if gap is not None and self._call_callback('process_gap', *gap) is False:
+            return False
+
+        t1 = self._prepare_frame(fstate, t0)
+
+        # Call the main callback function with the current state
+        isOK = self.track_change_callback.process_callback(fstate)
+
+        self._finish_frame(fstate, t_arrival, t0, t1)
+
+        return isOK
+
+    def _prepare_frame(self, fstate, t0):
+        """
+        The part of _process_frame before the callback is called, after the gap check. Drivers that call the callback
+        differently use this and _finish_frame around it.
+
+        :param fstate: The frame's state.
+        :param float t0: The time.perf_counter() when parsing the message started.
+        :return: The time.perf_counter() when the frame was ready for the callback, None if it isn't being timed.
+        """
+        if self.time_to_first_frame is None:
+            self._first_frame_received()
+
+        if self._state_shmem is not None:
+            self._state_shmem.publish(fstate)
+        if self._plotter is not None:
+            self._plotter.write(fstate)
+        if self.recorder is not None:
+            self.recorder.record_state(fstate)
+
+        t1 = None
+        if self.latency_stats is not None or self.profiler is not None:
             t1 = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.begin_frame(fstate.frame_cnt, t1 - t0)
+
+        return t1
+
+    def _finish_frame(self, fstate, t_arrival, t0, t1):
+        """
+        The part of _process_frame after the callback returns.
+
+        :param fstate: The frame's state.
+        :param float t_arrival: The time.perf_counter() when the frame's message arrived.
+        :param float t0: The time.perf_counter() when parsing the message started.
+        :param float t1: What _prepare_frame returned.
+        :return: None
+        """
+        if self.profiler is not None:
+            self.profiler.end_frame()
+        if self.latency_stats is not None:
+            self._record_latency(t_arrival, t0, t1, time.perf_counter(), fstate)
+
+        self._check_processing_time(t_arrival, fstate)
+
+    def _check_processing_time(self, t_arrival, fstate):
+        """
+        Let the watchdog check that the message was processed in time, raise an exception if we are falling behind
+        and its policy is to stop.
+
+        :param float t_arrival: The time.perf_counter() when the message arrived.
+        :param fstate: The message's state.
+        :return: None
+        """
+        if self.watchdog is not None:
+            action = self.watchdog.check(fstate, t_arrival, time.perf_counter(), self.track_change_callback)
+
+            if action == 'stop':
+
+                # When we are allowed to drop messages a slow callback isn't fatal, we just lose frames.
+                if self._receiver is not None and self.drop_policy != 'block':
+                    print("Warning: processing is falling behind FicTrac, dropping frames. " +
+                          self.watchdog.describe())
+                else:
+                    self._terminate_fictrac()
+                    raise Exception("Processing fell behind FicTrac, the processing callback is probably operating " +
+                                    "too slow. " + self.watchdog.describe())
+
+        self.frame_cnt = self.frame_cnt + 1
+
+    def _message_arrival_time(self, t0):
+        """
+        Get the time the message being processed arrived. The receiver thread stamps messages as they come off the
+        socket, otherwise the message arrived when we received it.
+
+        :param float t0: The time.perf_counter() when the message was received.
+        :return: The arrival time, in time.perf_counter() seconds.
+        """
+        if self._receiver is not None:
+            return self._receiver.last_arrival_time
+
+        return t0
+
+    def _record_latency(self, t_arrival, t0, t1, t2, fstate):
+        """
+        Record the timing of a processed frame in the latency histograms.
+
+        :param float t_arrival: When the message arrived.
+        :param float t0: When parsing started.
+        :param float t1: When parsing and checking was done and the callback was called.
+        :param float t2: When the callback returned.
+        :param fstate: The frame's state.
+        :return: None
+        """
+        stats = self.latency_stats
+        stats.record('recv_to_parse', t0 - t_arrival)
+        stats.record('parse', t1 - t0)
+        stats.record('callback', t2 - t1)
+        stats.record('process', t2 - t0)
+        stats.record('total', t2 - t_arrival)
+
+        # Compare the time between arrivals with the time between the frames in FicTrac. For consecutive frames this
+        # is delta_timestamp, if frames were missed in between we go by the timestamps. FicTrac's are in milliseconds.
+        if self._last_arrival is not None:
+            if fstate.frame_cnt - self._last_arrival_frame == 1 and fstate.delta_timestamp > 0:
+                frame_dt = fstate.delta_timestamp
+            else:
+                frame_dt = fstate.timestamp - self._last_arrival_timestamp
+            stats.record('jitter', abs((t_arrival - self._last_arrival) - frame_dt / 1000.0))
+
+        self._last_arrival = t_arrival
+        self._last_arrival_frame = fstate.frame_cnt
+        self._last_arrival_timestamp = fstate.timestamp
+
+    def get_latency_stats(self):
+        """
+        Get a summary of the per frame latency so far. This can be called while running, from the callback or
+        another thread.
+
+        :return: A dict mapping each of LATENCY_STAGES to a dict with the count, mean, p50, p99 and max, in seconds.
+        None if the driver isn't tracking latency.
+        """
+        if self.latency_stats is None:
+            return None
+
+        return self.latency_stats.summary()
+
+    def _report_latency(self):
+        """
+        Print the latency summary, if we are tracking latency.
+
+        :return: None
+        """
+        if self.latency_stats is not None:
+            print(self.latency_stats.report(title="FicTrac frame latency"))
+
+    def _report_watchdog(self):
+        """
+        Print the watchdog's statistics, if any frames missed their deadline.
 
-            # Add the speed to our history
-            time_history.append(t1 - t0)
+        :return: None
+        """
+        if self.watchdog is not None and self.watchdog.num_misses > 0:
+            print("FicTrac frame deadlines: " + self.watchdog.describe())
 
-            # Get the running average fps
-            avg_fps = 1 / (sum(time_history) / len(time_history))
+    def _enable_profiling(self):
+        """
+        Start profiling the callback afresh, if we are profiling.
 
-            if self.average_fps_threshold != 0 and avg_fps < self.average_fps_threshold and self.frame_cnt > 300:
-                self.fictrac_process.terminate()
-                raise Exception("Average FPS fell below avg_fps_threshold({}). Processing callback is " +
-                                "probably operating too slow.")
+        :return: None
+        """
+        if self.profiler is not None:
+            self.profiler.clear()
+            self.track_change_callback.enable_profiling(self.profiler)
 
-            self.frame_cnt = self.frame_cnt + 1
+    def _call_callback(self, name, *args):
+        """
+        Call one of the callback's entry points, other than process_callback, timing it if we are profiling.
+
+        :param str name: The name of the method.
+        :param args: Its arguments.
+        :return: What it returned.
+        """
+        method = getattr(self.track_change_callback, name)
+        if self.profiler is None:
+            return method(*args)
+
+        return self.profiler.time_call(name, method, *args)
+
+    def _report_profile(self):
+        """
+        Print the profile report, and write it to the profiler's report file, if we are profiling.
+
+        :return: None
+        """
+        if self.profiler is None:
+            return
+
+        print(self.profiler.report())
+        if self.profiler.report_file is not None:
+            self.profiler.write_report()
+
+    def get_loss_stats(self):
+        """
+        Get statistics on the frames we didn't process.
+
+        :return: A dict with the number of frames processed, the number lost in gaps, the number of gaps, the fraction
+        of frames lost, and the number dropped by the receiver thread's drop policy.
+        """
+        num_missing = self.num_lost_frames + self.num_dropped_frames
+        num_expected = self.frame_cnt + num_missing
+        return {'frames': self.frame_cnt,
+                'lost_frames': self.num_lost_frames,
+                'gaps': len(self.gap_log),
+                'loss_fraction': num_missing / num_expected if num_expected > 0 else 0.0,
+                'dropped_frames': self.num_dropped_frames}
+
+    def _report_losses(self):
+        """
+        Print the loss statistics, if we are tolerating gaps or dropping frames.
+
+        :return: None
+        """
+        if self.tolerate_gaps or self.num_dropped_frames > 0:
+            stats = self.get_loss_stats()
+            print("FicTrac frames processed: {}, lost: {} in {} gaps, dropped: {} ({:.2%} missing)".format(
+                  stats['frames'], stats['lost_frames'], stats['gaps'], stats['dropped_frames'],
+                  stats['loss_fraction']))
 
-        self.fictrac_process.terminate()
+    def _recv_message(self, socket):
+        """
+        Receive a single message from FicTrac. In binary mode the message is received without copying, the returned
+        zmq.Frame owns the memory the state will be mapped onto.
+
+        :param socket: The zero MQ SUB socket connected to FicTrac.
+        :return: The message string, or the zmq.Frame in binary mode.
+        """
+        if self.binary_msgs:
+            return socket.recv(copy=False)
+        else:
+            return socket.recv_string()
+
+    def _parse_message(self, data):
+        """
+        Turn a message received from FicTrac into a FicTracState.
+
+        :param data: The message returned from _recv_message.
+        :return: The FicTracState for the message, or None if FicTrac signaled the END of tracking.
+        """
+        if self.reuse_state:
+            return self._parse_message_in_place(data)
+
+        if self.binary_msgs:
+            buf = data.buffer
+            if len(buf) == ctypes.sizeof(FicTracState):
+                return FicTracState.from_buffer(buf)
+            elif buf == b"END":
+                return None
+            else:
+                raise ValueError("Binary message from FicTrac was {} bytes, expected {}.".format(
+                    len(buf), ctypes.sizeof(FicTracState)))
+        else:
+            if data == "END":
+                return None
+
+            return FicTracState.zmq_string_msg_to_state(data)
+
+    def _parse_message_in_place(self, data):
+        """
+        Turn a message received from FicTrac into a FicTracStateView, reusing the preallocated state buffers. We
+        alternate between the two buffers so the previous frame's state stays intact while the new one is filled.
+
+        :param data: The message returned from _recv_message.
+        :return: The FicTracStateView for the message, or None if FicTrac signaled the END of tracking.
+        """
+        index = 1 - self._state_buffer_index
+
+        if self.binary_msgs:
+            buf = data.buffer
+            if len(buf) == ctypes.sizeof(FicTracState):
+                self._state_buffer_bytes[index][:] = buf
+            elif buf == b"END":
+                return None
+            else:
+                raise ValueError("Binary message from FicTrac was {} bytes, expected {}.".format(
+                    len(buf), ctypes.sizeof(FicTracState)))
+        else:
+            if data == "END":
+                return None
+
+            self._state_buffers[index].update_from_zmq_string_msg(data)
+
+        self._state_buffer_index = index
+
+        return self._state_buffers[index]
+
+    def _terminate_fictrac(self):
+        """
+        Terminate the FicTrac process, if we started one.
+
+        :return: None
+        """
+        if self.fictrac_process is not None:
+            self.fictrac_process.terminate()
 
     def _cleanup(self):
         """
@@ -0,0 +1,258 @@
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pybmt.callback.stats import WindowedMean
+
+TWO_PI = 2.0 * np.pi
+
+# The kinematics worked out for each frame. Distances are in ball radii (radians of ball rotation) unless a ball radius
+# is given, times are in seconds.
+KINEMATICS_DTYPE = np.dtype([
+    ('forward_velocity', np.float64),   # Forward velocity of the animal, along its heading.
+    ('side_velocity', np.float64),      # Sideways velocity, positive to the animal's right.
+    ('turn_rate', np.float64),          # Angular velocity of the heading, in radians per second.
+    ('speed', np.float64),              # Speed of travel, the length of the forward and side velocity.
+    ('heading', np.float64),            # The heading, unwrapped, so it doesn't jump at 2 pi.
+    ('path_length', np.float64),        # The distance travelled since the first frame.
+    ('curvature', np.float64),          # Radians turned per unit distance travelled, NaN when not moving.
+])
+
+
+def wrap_angle(angle):
+    """
+    Wrap angles into [-pi, pi). Works on a single angle or on numpy arrays of them.
+
+    :param angle: The angle(s), in radians.
+    :return: The wrapped angle(s).
+    """
+    return (angle + np.pi) % TWO_PI - np.pi
+
+
+def wrap_angle_2pi(angle):
+    """
+    Wrap angles into [0, 2 pi), the range FicTrac uses for heading and direction.
+
+    :param angle: The angle(s), in radians.
+    :return: The wrapped angle(s).
+    """
+    return angle % TWO_PI
+
+
+def angle_diff(angle1, angle2):
+    """
+    The signed difference between two angles, angle2 - angle1, wrapped into [-pi, pi).
+
+    :param angle1: The first angle(s), in radians.
+    :param angle2: The second angle(s).
+    :return: The difference(s).
+    """
+    return wrap_angle(angle2 - angle1)
+
+
+def unwrap_angle(angles):
+    """
+    Unwrap a series of angles, removing the jumps of 2 pi when they wrap around, like FicTrac's heading does going past
+    0 or 2 pi. The result is continuous, so it can be differentiated or averaged.
+
+    :param angles: A 1D numpy array of angles, in radians.
+    :return: The unwrapped angles.
+    """
+    return np.unwrap(angles)
+
+
+def lab_motion(del_rot_lab_vec):
+    """
+    Split FicTrac's per frame ball rotation, in lab coordinates, into the animal's motion. The animal walks forward by
+    rotating the ball about the lab y axis, sideways (to the right) about -x, and turns (its heading increases) about
+    -z. This is how FicTrac itself integrates intx, inty and heading.
+
+    :param del_rot_lab_vec: The del_rot_lab_vec of one frame, or an (N, 3) numpy array of them.
+    :return: A tuple of (forward, side, turn), in radians per frame.
+    """
+    del_rot_lab_vec = np.asarray(del_rot_lab_vec, dtype=np.float64)
+    return del_rot_lab_vec[..., 1], -del_rot_lab_vec[..., 0], -del_rot_lab_vec[..., 2]
+
+
+def frame_intervals(states):
+    """
+    The time between each frame and the one before, from delta_timestamp.
+
+    :param states: A numpy structured array of states, like read_dat_file returns.
+    :return: A numpy array of the intervals, in seconds. The first frame's is usually 0.
+    """
+    return states['delta_timestamp'] / 1000.0
+
+
+def _per_second(per_frame, dt):
+    """
+    Divide per frame values by the frame intervals, 0 where there isn't an interval.
+    """
+    return np.divide(per_frame, dt, out=np.zeros_like(per_frame), where=dt > 0)
+
+
+def windowed_sum(values, window):
+    """
+    The sum of each value and the window - 1 before it (fewer at the start). Each window is summed on its own, rather
+    than from the differences of the cumulative sum, which lose precision as the cumulative sum grows over a long
+    recording. This agrees with KinematicsTracker's compensated running sums.
+
+    :param values: A 1D numpy array.
+    :param int window: The number of values to sum.
+    :return: A numpy array of the sums.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    total = np.cumsum(values[:window])
+    if window < len(values):
+        total = np.concatenate([total, sliding_window_view(values, window)[1:].sum(axis=1)])
+    return total
+
+
+def curvature(turn, distance, window=1, min_distance=1e-9):
+    """
+    The curvature of the path, the angle turned per unit distance travelled. Over window frames the total turn is
+    divided by the total distance, which smooths out the noise of single frames.
+
+    :param turn: A 1D numpy array of the heading change each frame, in radians.
+    :param distance: A 1D numpy array of the distance travelled each frame.
+    :param int window: The number of frames to work out each curvature over.
+    :param float min_distance: Below this total distance the animal is taken to be standing still and the curvature is
+    NaN.
+    :return: A numpy array of the curvatures.
+    """
+    turned = windowed_sum(turn, window)
+    travelled = windowed_sum(distance, window)
+
+    moving = travelled >= min_distance
+    result = np.full(len(turned), np.nan)
+    np.divide(turned, travelled, out=result, where=moving)
+    return result
+
+
+def kinematics(states, ball_radius=1.0, curvature_window=1, min_distance=1e-9):
+    """
+    Work out the kinematics of the animal over a whole recording, or the history of a live one, in a few vectorized
+    passes.
+
+    :param states: A numpy structured array of states, FicTracState.np_dtype(), like read_dat_file or load_recording
+    return.
+    :param float ball_radius: The radius of the ball, to get distances and velocities in its units. By default they are
+    in ball radii, the radians of ball rotation FicTrac reports.
+    :param int curvature_window: The number of frames to work out each curvature over.
+    :param float min_distance: The least distance over the curvature window to work out a curvature for.
+    :return: A numpy structured array of KINEMATICS_DTYPE, one element per state.
+    """
+    forward, side, turn = lab_motion(states['del_rot_lab_vec'])
+    forward = forward * ball_radius
+    side = side * ball_radius
+    distance = np.hypot(forward, side)
+    dt = frame_intervals(states)
+
+    result = np.zeros(len(states), dtype=KINEMATICS_DTYPE)
+    result['forward_velocity'] = _per_second(forward, dt)
+    result['side_velocity'] = _per_second(side, dt)
+    result['turn_rate'] = _per_second(turn, dt)
+    result['speed'] = _per_second(distance, dt)
+    result['heading'] = unwrap_angle(states['heading'])
+    result['path_length'] = np.cumsum(distance)
+    result['curvature'] = curvature(turn, distance, window=curvature_window, min_distance=min_distance)
+
+    return result
+
+
+class KinematicsTracker:
+    """
+    Works out the same kinematics as kinematics(), one frame at a time, for use in process_callback. Each update is a
+    fixed amount of work, however long the curvature window:
+
+        tracker = KinematicsTracker(ball_radius=4.5, curvature_window=10)
+        tracker.update(track_state)
+        if tracker.turn_rate > 1.0:
+            ...
+
+    The values for the last frame are attributes, named like the fields of KINEMATICS_DTYPE.
+    """
+
+    def __init__(self, ball_radius=1.0, curvature_window=1, min_distance=1e-9):
+        """
+        :param float ball_radius: The radius of the ball, to get distances and velocities in its units.
+        :param int curvature_window: The number of frames to work out each curvature over.
+        :param float min_distance: The least distance over the curvature window to work out a curvature for.
+        """
+        if curvature_window < 1:
+            raise ValueError("The curvature window must be at least one frame.")
+
+        self.ball_radius = ball_radius
+        self.curvature_window = curvature_window
+        self.min_distance = min_distance
+
+        # Running sums over the curvature window, compensated so rounding errors don't build up over a long session.
+        self._turned = WindowedMean(curvature_window)
+        self._travelled = WindowedMean(curvature_window)
+        self.reset()
+
+    def reset(self):
+        """
+        Start again, as if no frames have been seen.
+
+        :return: None
+        """
+        self.num_frames = 0
+        self.forward_velocity = 0.0
+        self.side_velocity = 0.0
+        self.turn_rate = 0.0
+        self.speed = 0.0
+        self.heading = 0.0
+        self.path_length = 0.0
+        self.curvature = math.nan
+
+        self._last_heading = 0.0
+        self._turned.reset()
+        self._travelled.reset()
+
+    def update(self, state):
+        """
+        Update the kinematics with a new frame.
+
+        :param state: The FicTracState.
+        :return: self
+        """
+        rot = state.del_rot_lab_vec
+        forward = rot[1] * self.ball_radius
+        side = -rot[0] * self.ball_radius
+        turn = -rot[2]
+        distance = math.hypot(forward, side)
+
+        dt = state.delta_timestamp / 1000.0
+        if dt > 0:
+            self.forward_velocity = forward / dt
+            self.side_velocity = side / dt
+            self.turn_rate = turn / dt
+            self.speed = distance / dt
+        else:
+            self.forward_velocity = 0.0
+            self.side_velocity = 0.0
+            self.turn_rate = 0.0
+            self.speed = 0.0
+
+        # Unwrap the heading as we go, by adding up the wrapped differences.
+        if self.num_frames == 0:
+            self.heading = state.heading
+        else:
+            self.heading = self.heading + (state.heading - self._last_heading + math.pi) % TWO_PI - math.pi
+        self._last_heading = state.heading
+
+        self.path_length = self.path_length + distance
+
+        self._turned.update(turn)
+        self._travelled.update(distance)
+        travelled = self._travelled.sum
+        if travelled >= self.min_distance:
+            self.curvature = self._turned.sum / travelled
+        else:
+            self.curvature = math.nan
+
+        self.num_frames = self.num_frames + 1
+
+        return self
@@ -0,0 +1,161 @@
+import bisect
+
+
+class LatencyHistogram:
+    """
+    A histogram of durations with fixed, logarithmically spaced, buckets. Recording a value is a bisect and an
+    increment, cheap enough to do every frame, and the memory used never grows. Percentiles are estimated from the
+    buckets, they are accurate to the bucket width, about 12% with the default of 20 buckets per decade. The maximum
+    is exact.
+    """
+
+    def __init__(self, min_value=1e-7, max_value=100.0, buckets_per_decade=20):
+        """
+        Create the histogram. Values below min_value go in the first bucket, values above max_value in the last.
+
+        :param float min_value: The smallest duration to resolve, in seconds.
+        :param float max_value: The largest duration to resolve, in seconds.
+        :param int buckets_per_decade: The number of buckets for each factor of 10.
+        """
+        self.edges = []
+        edge = min_value
+        step = 10.0 ** (1.0 / buckets_per_decade)
+        while edge < max_value * step:
+            self.edges.append(edge)
+            edge = edge * step
+
+        self.counts = [0] * (len(self.edges) + 1)
+        self.clear()
+
+    def clear(self):
+        """
+        Forget all recorded values.
+
+        :return: None
+        """
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        """
+        Record a duration.
+
+        :param float value: The duration in seconds.
+        :return: None
+        """
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        Estimate a percentile of the recorded values, the upper edge of the bucket it falls in.
+
+        :param float p: The percentile, between 0 and 100.
+        :return: The estimated value, in seconds. 0 if nothing has been recorded.
+        """
+        if self.count == 0:
+            return 0.0
+
+        target = p / 100.0 * self.count
+        cumulative = 0
+        for i, c in enumerate(self.counts):
+            cumulative = cumulative + c
+            if cumulative >= target and c > 0:
+                # The last bucket has no upper edge, and no estimate should be bigger than the real maximum.
+                if i == len(self.edges):
+                    return self.max
+                return min(self.edges[i], self.max)
+
+        return self.max
+
+    def summary(self):
+        """
+        Summarize the recorded values.
+
+        :return: A dict with count, mean, p50, p99 and max, times are in seconds.
+        """
+        return {'count': self.count,
+                'mean': self.total / self.count if self.count > 0 else 0.0,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'max': self.max}
+
+
+class LatencyStats:
+    """
+    A set of named LatencyHistogram, one for each stage of processing a frame.
+    """
+
+    def __init__(self, stages, **histogram_args):
+        """
+        :param stages: The names of the stages.
+        :param histogram_args: Passed on to each LatencyHistogram.
+        """
+        self.stages = list(stages)
+        self.histograms = {stage: LatencyHistogram(**histogram_args) for stage in self.stages}
+        self._histogram_args = histogram_args
+
+    def __getitem__(self, stage):
+        return self.histograms[stage]
+
+    def __contains__(self, stage):
+        return stage in self.histograms
+
+    def add_stage(self, stage):
+        """
+        Add a stage, after the ones there already.
+
+        :param str stage: The stage name.
+        :return: The stage's LatencyHistogram.
+        """
+        if stage not in self.histograms:
+            self.stages.append(stage)
+            self.histograms[stage] = LatencyHistogram(**self._histogram_args)
+
+        return self.histograms[stage]
+
+    def record(self, stage, value):
+        """
+        Record a duration for a stage.
+
+        :param str stage: The stage name.
+        :param float value: The duration in seconds.
+        :return: None
+        """
+        self.histograms[stage].record(value)
+
+    def clear(self):
+        """
+        Forget all recorded values.
+
+        :return: None
+        """
+        for h in self.histograms.values():
+            h.clear()
+
+    def summary(self):
+        """
+        :return: A dict mapping each stage name to its LatencyHistogram.summary()
+        """
+        return {stage: self.histograms[stage].summary() for stage in self.stages}
+
+    def report(self, title="Latency"):
+        """
+        Format the summary as a table, times in microseconds.
+
+        :param str title: The title of the table.
+        :return: The report string.
+        """
+        lines = ["{} (us)".format(title),
+                 "{:<16} {:>10} {:>10} {:>10} {:>10} {:>10}".format("stage", "count", "mean", "p50", "p99", "max")]
+        for stage, s in self.summary().items():
+            lines.append("{:<16} {:>10d} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                stage, s['count'], s['mean'] * 1e6, s['p50'] * 1e6, s['p99'] * 1e6, s['max'] * 1e6))
+
+        return "\n".join(lines)
@@ -0,0 +1,192 @@
+import time
+
+import zmq
+
+from pybmt.fictrac.driver import FicTracDriver
+
+
+class MultiRigDriver:
+    """
+    Drives several FicTrac instances, one per ball rig, from a single python process. Each rig is described by its own
+    FicTracDriver, with its own config file (FicTrac's socket_port is read from it) or remote endpoint, and its own
+    callback. The SUB sockets of all the rigs are multiplexed with one zmq.Poller, each message is handed to the
+    callback of the rig it came from.
+
+    Every rig keeps its own frame accounting, the same checks FicTracDriver does, and has its own watchdog. A rig that
+    fails, or stops sending frames for rig_timeout seconds, is shut down on its own while the other rigs keep
+    running.
+    """
+
+    def __init__(self, rigs, rig_timeout=1.0, poll_interval=0.01):
+        """
+        Create the multi rig driver.
+
+        :param rigs: A list of FicTracDriver, one for each rig. Their run() methods are not called, this driver runs
+        them all.
+        :param float rig_timeout: The watchdog timeout, in seconds. A rig that doesn't send a frame for this long
+        after its first frame is considered failed.
+        :param float poll_interval: How often, in seconds, the watchdogs are checked when no messages are arriving.
+        """
+        for rig in rigs:
+            if not isinstance(rig, FicTracDriver):
+                raise TypeError("MultiRigDriver rigs must be FicTracDriver objects.")
+            if rig.recv_queue_size is not None:
+                raise ValueError("MultiRigDriver polls the rigs' sockets directly, recv_queue_size is not supported.")
+
+        self.rigs = list(rigs)
+        self.rig_timeout = rig_timeout
+        self.poll_interval = poll_interval
+
+        # The exception that stopped each rig, None if the rig finished fine.
+        self.rig_errors = [None] * len(self.rigs)
+
+        self._sockets = [None] * len(self.rigs)
+        self._console_files = [None] * len(self.rigs)
+        self._last_frame_time = [None] * len(self.rigs)
+
+    def run(self):
+        """
+        Start all the rigs and block until they have all finished.
+
+        :return: None
+        """
+        poller = zmq.Poller()
+        socket_rigs = {}
+        active = set()
+
+        try:
+            for i, rig in enumerate(self.rigs):
+                try:
+                    self._start_rig(i)
+                except Exception as ex:
+                    self._stop_rig(i, ex)
+                    continue
+
+                poller.register(self._sockets[i], zmq.POLLIN)
+                socket_rigs[self._sockets[i]] = i
+                active.add(i)
+
+            poll_ms = max(1, int(self.poll_interval * 1000))
+            while active:
+                events = dict(poller.poll(poll_ms))
+
+                for socket in events:
+                    i = socket_rigs[socket]
+                    try:
+                        isOK = self._process_message(i, socket)
+                    except Exception as ex:
+                        isOK = False
+                        self.rig_errors[i] = ex
+
+                    if not isOK:
+                        poller.unregister(socket)
+                        active.discard(i)
+                        self._stop_rig(i, self.rig_errors[i])
+
+                for i in list(active):
+                    try:
+                        self._watchdog(i)
+                    except Exception as ex:
+                        poller.unregister(self._sockets[i])
+                        active.discard(i)
+                        self._stop_rig(i, ex)
+        finally:
+            for i in active:
+                self._stop_rig(i, None)
+
+        failed = [(i, ex) for i, ex in enumerate(self.rig_errors) if ex is not None]
+        if len(failed) > 0:
+            raise Exception("PyBMT Error! Rig(s) {} failed.".format([i for i, ex in failed])) from failed[0][1]
+
+    def _start_rig(self, i):
+        """
+        Setup the callback, start FicTrac if needed, and connect to rig i.
+        """
+        rig = self.rigs[i]
+
+        rig._setup_callback()
+        rig._start_run()
+
+        if rig.start_fictrac:
+            self._console_files[i] = open(rig.console_output_file, "wb")
+            rig._start_fictrac_process(self._console_files[i])
+
+        self._sockets[i] = rig._connect()
+
+    def _process_message(self, i, socket):
+        """
+        Receive and process a message for rig i, its socket is ready.
+
+        :return: True if the rig should keep running, False if it is done.
+        """
+        rig = self.rigs[i]
+
+        data = rig._recv_message(socket)
+
+        # Message received start the timer, want to keep track of how long it takes to process the message.
+        t0 = time.perf_counter()
+        self._last_frame_time[i] = t0
+
+        fstate = rig._parse_message(data)
+
+        # If FicTrac sent and END signal, this rig is done
+        if fstate is None:
+            return False
+
+        return rig._process_frame(fstate, t0, t0)
+
+    def _watchdog(self, i):
+        """
+        Check that rig i is still alive, raise an exception if it isn't.
+        """
+        rig = self.rigs[i]
+
+        if rig.time_to_first_frame is None:
+            rig._check_startup()
+        elif time.perf_counter() - self._last_frame_time[i] > self.rig_timeout:
+            raise RuntimeError("Rig {} ({}) sent no frames for {} s.".format(i, rig.remote_endpoint_url,
+                                                                            self.rig_timeout))
+
+    def _stop_rig(self, i, error):
+        """
+        Shutdown rig i, recording the error that stopped it, if any.
+        """
+        rig = self.rigs[i]
+
+        if error is None:
+            try:
+                rig._terminate_fictrac()
+                rig._check_exit_status()
+            except Exception as ex:
+                error = ex
+        else:
+            rig._terminate_fictrac()
+
+        self.rig_errors[i] = error
+
+        try:
+            rig._end_run()
+            rig._call_callback('shutdown_callback')
+        finally:
+            if self._sockets[i] is not None:
+                rig._disconnect(self._sockets[i])
+                self._sockets[i] = None
+            if self._console_files[i] is not None:
+                self._console_files[i].close()
+                self._console_files[i] = None
+            rig._finish_run()
+
+    def rig_stats(self):
+        """
+        Get the frame accounting of each rig.
+
+        :return: A list with a dict of statistics for each rig.
+        """
+        return [{'endpoint': rig.remote_endpoint_url,
+                 'frame_cnt': rig.frame_cnt,
+                 'last_frame': rig._last_frame_cnt,
+                 'time_to_first_frame': rig.time_to_first_frame,
+                 'latency': rig.get_latency_stats(),
+                 'losses': rig.get_loss_stats(),
+                 'error': self.rig_errors[i]}
+                for i, rig in enumerate(self.rigs)]
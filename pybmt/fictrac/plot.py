@@ -1,112 +1,325 @@
+import multiprocessing
+import time
 
+import matplotlib
+import numpy as np
 
-def angle_diff(angle1, angle2):
-    diff = angle2 - angle1
-    while diff < np.deg2rad(-180.0):
-        diff += np.deg2rad(360.0)
-    while diff > np.deg2rad(180):
-        diff -= np.deg2rad(360.0)
-    return diff
+from pybmt.fictrac.kinematics import wrap_angle
+from pybmt.fictrac.ring_buffer import StateRingBuffer
+from pybmt.fictrac.shmem import SharedStateRing
+from pybmt.fictrac.state import FicTracState
 
-def plot_task_fictrac(remote_endpoint_url,
-                      fictrac_state_fields=['speed', 'direction', 'del_rot_cam_vec', 'del_rot_error'],
-                      num_history=200):
+# The fields plotted by default.
+DEFAULT_PLOT_FIELDS = ('speed', 'direction', 'del_rot_cam_vec', 'del_rot_error')
+
+# Starting y axis limits for each field, the axes grow if the data goes outside them. Fields not listed here start at
+# (-1, 1).
+FIELD_AX_LIMITS = {'speed': (0, .03),
+                   'direction': (0, 2*np.pi),
+                   'heading': (0, 2*np.pi),
+                   'heading_diff': (0, 0.261799),
+                   'direction_diff': (0, 0.261799),
+                   'del_rot_error': (0, 15000),
+                   'del_rot_cam_vec': (-0.025, 0.025)}
+
+# Fields that are angles, their differences are wrapped.
+ANGLE_FIELDS = ('heading', 'direction')
+
+
+def field_values(history, field):
+    """
+    Pull the values to plot for a field out of a history of states, as a whole column. A field name ending in _diff
+    plots the frame to frame difference of the field, wrapped into [0, pi] for angles. For vector fields, the second
+    component is plotted.
+
+    :param history: A numpy structured array of states, oldest first.
+    :param str field: The name of the field.
+    :return: A 1D numpy array, one value per state.
+    """
+    if field.endswith('_diff'):
+        real_field = field[:-len('_diff')]
+        values = history[real_field]
+        diff = np.diff(values, prepend=values[:1])
+
+        if real_field in ANGLE_FIELDS:
+            return np.abs(wrap_angle(diff))
+        return diff
+
+    values = history[field]
+    if values.ndim > 1:
+        return values[:, 1]
+    return values
+
+
+def decimate(values, max_points):
+    """
+    Reduce a trace to at most max_points points for plotting. The trace is split into bins and the minimum and maximum
+    of each bin are kept, in the order they happened, so spikes still show up. If the trace doesn't divide evenly into
+    bins, the oldest few values are left out.
+
+    :param values: A 1D numpy array.
+    :param int max_points: The most points to return.
+    :return: An (indices, values) tuple of numpy arrays, the indices are into the original trace.
+    """
+    num_values = len(values)
+    if num_values <= max_points:
+        return np.arange(num_values), values
+
+    num_bins = max(1, max_points // 2)
+    bin_size = -(-num_values // num_bins)
+    start = num_values % bin_size
+    bins = values[start:].reshape(-1, bin_size)
+    offsets = start + np.arange(len(bins)) * bin_size
+
+    i_min = bins.argmin(axis=1)
+    i_max = bins.argmax(axis=1)
+
+    indices = np.empty(2 * len(bins), dtype=np.intp)
+    indices[0::2] = offsets + np.minimum(i_min, i_max)
+    indices[1::2] = offsets + np.maximum(i_min, i_max)
+
+    return indices, values[indices]
+
+
+class LivePlotter:
+    """
+    A figure of traces of the recent history of some FicTrac state fields, one subplot per field. States are added as
+    they come in, which only copies them into the history, and update() redraws. Redraws are blitted, the axes are
+    only drawn in full when the figure is first shown, resized, or a trace outgrows its y axis. The rest of the time
+    only the traces are drawn over a cached background. Each trace is decimated to max_points, so redraws cost the
+    same however long the history is.
+    """
+
+    def __init__(self, fields=DEFAULT_PLOT_FIELDS, num_history=2000, max_points=500, fig=None):
+        """
+        :param fields: The names of the fields to plot, see field_values().
+        :param int num_history: The number of states of history to plot.
+        :param int max_points: The most points to draw per trace.
+        :param fig: The matplotlib figure to plot in, a new pyplot figure if None.
+        """
+        if fig is None:
+            import matplotlib.pyplot as plt
+            fig = plt.figure()
+            if fig.canvas.manager is not None:
+                fig.canvas.manager.set_window_title('traces: fictrac')
+
+        self.fig = fig
+        self.fields = list(fields)
+        self.max_points = max_points
+
+        # The history starts out flat, at zero, and scrolls to the left as states come in.
+        self.history = StateRingBuffer(num_history)
+        self.history.extend(np.zeros(num_history, dtype=FicTracState.np_dtype()))
+
+        self.axes = []
+        self.lines = []
+        for i, field in enumerate(self.fields):
+            ax = fig.add_subplot(len(self.fields), 1, i + 1)
+            ax.set_title(field)
+            ax.set_xlim(0, num_history)
+            ax.set_ylim(*FIELD_AX_LIMITS.get(field, (-1, 1)))
+
+            # Animated artists are left out of full draws, we draw them ourselves over the background.
+            line, = ax.plot([], [], animated=True)
+            self.axes.append(ax)
+            self.lines.append(line)
+
+        self._background = None
+        fig.canvas.mpl_connect('draw_event', self._on_draw)
+
+        self.num_states = 0
+        self.num_draws = 0
+        self._num_states_drawn = 0
+
+    def _on_draw(self, event):
+        # The figure was drawn in full, cache everything but the traces.
+        self._background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def add_state(self, state):
+        """
+        Add a state to the history.
+
+        :param state: The FicTracState.
+        :return: None
+        """
+        self.history.append(state)
+        self.num_states = self.num_states + 1
+
+    def read_ring(self, ring):
+        """
+        Add all the states waiting in a SharedStateRing to the history.
+
+        :param ring: The SharedStateRing.
+        :return: The number of states added.
+        """
+        num_read = 0
+        while True:
+            state = ring.read()
+            if state is None:
+                break
+
+            self.history.append(state)
+            num_read = num_read + 1
+
+        self.num_states = self.num_states + num_read
+        return num_read
+
+    @property
+    def has_new_states(self):
+        return self.num_states != self._num_states_drawn
+
+    def update(self):
+        """
+        Redraw the traces from the current history.
+
+        :return: None
+        """
+        canvas = self.fig.canvas
+        history = self.history.last()
+
+        full_draw = self._background is None
+        for ax, line, field in zip(self.axes, self.lines, self.fields):
+            x, y = decimate(field_values(history, field), self.max_points)
+            line.set_data(x, y)
+
+            # Grow the y axis if the trace doesn't fit, that needs the axes drawn again.
+            if len(y) > 0:
+                y_min, y_max = np.nanmin(y), np.nanmax(y)
+                lo, hi = ax.get_ylim()
+                if y_min < lo or y_max > hi:
+                    ax.set_ylim(min(lo, y_min), max(hi, y_max))
+                    full_draw = True
+
+        if full_draw:
+            canvas.draw()
+
+        canvas.restore_region(self._background)
+        for ax, line in zip(self.axes, self.lines):
+            ax.draw_artist(line)
+        canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+
+        self._num_states_drawn = self.num_states
+        self.num_draws = self.num_draws + 1
+
+
+def plot_task_fictrac(ring_name, fields=DEFAULT_PLOT_FIELDS, num_history=2000, display_rate=30.0, max_points=500,
+                      backend=None):
+    """
+    The live plot of the tracking state, run in its own process by PlotProcess. States are read from the driver's
+    SharedStateRing as they arrive, and the plot is redrawn at display_rate, however fast the states come in. Returns
+    once the ring is closed, after plotting the last states, or when the plot window is closed.
+
+    :param str ring_name: The name of the SharedStateRing the driver writes the states to.
+    :param fields: The names of the fields to plot.
+    :param int num_history: The number of states of history to plot.
+    :param float display_rate: How many times a second to redraw.
+    :param int max_points: The most points to draw per trace.
+    :param str backend: The matplotlib backend to use, the default backend if None. 'Agg' plots without a display.
+    :return: The LivePlotter.
     """
-    A coroutine for plotting fast, realtime as per: https://gist.github.com/pklaus/62e649be55681961f6c4. This is used
-    for plotting streaming data coming from FicTrac.
+    if backend is not None:
+        matplotlib.use(backend)
+    import matplotlib.pyplot as plt
+
+    ring = SharedStateRing.attach(ring_name)
+    try:
+        plt.ion()
+        plotter = LivePlotter(fields=fields, num_history=num_history, max_points=max_points)
+        plt.show(block=False)
+
+        draw_interval = 1.0 / display_rate
+        next_draw = time.perf_counter()
+        while plt.fignum_exists(plotter.fig.number):
+
+            # States written before the ring was closed are all there once we see it closed.
+            closed = ring.closed
+            plotter.read_ring(ring)
+            if closed:
+                break
 
-    :param disp_queue: The message queue from which data is sent for plotting.
-    :return: None
+            # Draw if it is time and there is something new, don't try to catch up on draws we missed.
+            now = time.perf_counter()
+            if now >= next_draw:
+                if plotter.has_new_states:
+                    plotter.update()
+                next_draw = max(next_draw + draw_interval, now)
+
+            # Handle GUI events till the next draw is due.
+            plotter.fig.canvas.start_event_loop(max(next_draw - time.perf_counter(), 0.001))
+
+        if plotter.has_new_states:
+            plotter.update()
+
+        plt.close(plotter.fig)
+
+        return plotter
+    finally:
+        ring.close()
+
+
+class PlotProcess:
+    """
+    Runs the live plot in a separate process, so drawing never holds up tracking. The driver hands each state over
+    with write(), which only copies it into a SharedStateRing. The plot process reads the ring at its own pace, if it
+    falls more than ring_capacity states behind it skips ahead.
     """
 
-    # Open or create the shared memory region for accessing FicTrac's state
-    shmem = mmap.mmap(-1, ctypes.sizeof(fictrac.FicTracState), "FicTracStateSHMEM")
-
-    warnings.filterwarnings("ignore", category=matplotlib.cbook.mplDeprecation)
-    plt.ion()
-
-    fig = plt.figure()
-    fig.canvas.set_window_title('traces: fictrac')
-
-    # Number of fields to display
-    num_channels = len(fictrac_state_fields)
-
-    # Axes limits for each field
-    field_ax_limits = {'speed': (0, .03),
-                       'direction': (0, 2*np.pi),
-                       'heading': (0, 2*np.pi),
-                       'heading_diff': (0, 0.261799),
-                       'del_rot_error': (0, 15000),
-                       'del_rot_cam_vec': (-0.025, 0.025)}
-
-    # Setup a queue for caching the historical data received so we can plot history of samples up to
-    # some N
-    data_history = deque([FicTracState() for i in range(num_history)], maxlen=num_history)
-
-    plot_data = np.zeros((num_history, num_channels))
-
-    # We want to create a subplot for each channel
-    axes = []
-    backgrounds = []
-    point_sets = []
-    for chn in range(1, num_channels + 1):
-        field_name = fictrac_state_fields[chn-1]
-        ax = fig.add_subplot(num_channels, 1, chn)
-        ax.set_title(field_name)
-        backgrounds.append(fig.canvas.copy_from_bbox(ax.bbox))  # cache the background
-        ax.axis([0, num_history, field_ax_limits[field_name][0], field_ax_limits[field_name][1]])
-        axes.append(ax)
-        point_sets.append(ax.plot(np.arange(num_history), plot_data)[0])  # init plot content
-
-    plt.show()
-    plt.draw()
-    fig.canvas.start_event_loop(0.001)  # otherwise plot freezes after 3-4 iterations
-
-    RUN = True
-    data = fictrac.FicTracState.from_buffer(shmem)
-    first_frame_count = data.frame_cnt
-    old_frame_count = data.frame_cnt
-    while flyvr_state.is_running_well():
-        new_frame_count = data.frame_cnt
-
-        if old_frame_count != new_frame_count:
-
-            # Copy the current state.
-            data_copy = FicTracState()
-            ctypes.pointer(data_copy)[0] = data
-
-            # Append to the history
-            data_history.append(data_copy)
-
-            # Turned the queued chunks into a flat array
-            sample_i = 0
-            last_d = data_history[0]
-            for d in data_history:
-                chan_i = 0
-                for field in fictrac_state_fields:
-                    if field.endswith('_diff'):
-                        real_field = field.replace('_diff', '')
-
-                        if real_field in ['heading', 'direction']:
-                            plot_data[sample_i, chan_i] = abs(angle_diff(getattr(d, real_field), getattr(last_d, real_field)))
-                        else:
-                            plot_data[sample_i, chan_i] = getattr(d, real_field) - getattr(last_d, real_field)
-                    elif field.endswith('vec'):
-                        plot_data[sample_i, chan_i] = getattr(d, field)[1]
-                    else:
-                        plot_data[sample_i,chan_i] = getattr(d, field)
-                    chan_i = chan_i + 1
-                last_d = d
-                sample_i = sample_i + 1
-
-            for chn in range(num_channels):
-                fig.canvas.restore_region(backgrounds[chn])         # restore background
-                point_sets[chn].set_data(np.arange(num_history), plot_data[:,chn])
-                axes[chn].draw_artist(point_sets[chn])              # redraw just the points
-                #fig.canvas.blit(axes[chn].bbox)                    # fill in the axes rectangle
-
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-
-    # clean up
-    plt.close(fig)
+    def __init__(self, fields=DEFAULT_PLOT_FIELDS, num_history=2000, display_rate=30.0, max_points=500,
+                 ring_capacity=4096, backend=None, start_method=None):
+        """
+        :param fields: The names of the fields to plot, see field_values().
+        :param int num_history: The number of states of history to plot.
+        :param float display_rate: How many times a second to redraw.
+        :param int max_points: The most points to draw per trace.
+        :param int ring_capacity: The number of states the ring to the plot process holds.
+        :param str backend: The matplotlib backend for the plot process, the default backend if None.
+        :param str start_method: The multiprocessing start method, the platform default if None.
+        """
+        self.plot_args = dict(fields=list(fields), num_history=num_history, display_rate=display_rate,
+                              max_points=max_points, backend=backend)
+        self.ring_capacity = ring_capacity
+        self._mp_context = multiprocessing.get_context(start_method)
+
+        self.ring = None
+        self.process = None
+
+    def start(self):
+        """
+        Create the ring and start the plot process.
+
+        :return: None
+        """
+        self.ring = SharedStateRing.create(self.ring_capacity)
+        self.process = self._mp_context.Process(target=plot_task_fictrac, name="pybmt-plot",
+                                                args=(self.ring.name,), kwargs=self.plot_args, daemon=True)
+        self.process.start()
+
+    def write(self, state):
+        """
+        Hand a state to the plot process.
+
+        :param state: The FicTracState.
+        :return: None
+        """
+        self.ring.write(state)
+
+    def stop(self, timeout=5.0):
+        """
+        Let the plot process draw the last states and exit, then clean up the ring.
+
+        :param float timeout: How long to wait, in seconds, for the plot process before terminating it.
+        :return: None
+        """
+        if self.ring is None:
+            return
+
+        self.ring.mark_closed()
+
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+
+        self.ring.close()
+        self.ring = None
@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import deque
+
+import zmq
+
+
+class MessageReceiver:
+    """
+    Receives FicTrac's messages on a dedicated thread and hands them to the driver's thread through a bounded queue.
+    The socket is always read promptly, even while a slow callback is running, and what happens when the callback
+    can't keep up is decided by the drop policy:
+
+        'block'       - The receiver waits for room in the queue. Messages back up into zero MQ, which holds up to
+                        maxsize more and drops them after that, like receiving on the driver's thread.
+        'drop_oldest' - The oldest queued message is dropped to make room for the newest.
+        'conflate'    - Only the latest message is kept, the queue holds a single message.
+
+    Dropped messages are counted. To the driver this object looks like the zero MQ socket, it has the same recv(),
+    recv_string() and poll() methods, and they time out after RCVTIMEO milliseconds like the socket's.
+    """
+
+    DROP_POLICIES = ('block', 'drop_oldest', 'conflate')
+
+    def __init__(self, driver, maxsize=64, drop_policy='block'):
+        """
+        Create the receiver, call start() to connect and start receiving.
+
+        :param driver: The FicTracDriver, its _connect, _recv_message and _disconnect methods are used to talk to
+        FicTrac.
+        :param int maxsize: The maximum number of messages to queue up.
+        :param str drop_policy: One of DROP_POLICIES.
+        """
+        if drop_policy not in self.DROP_POLICIES:
+            raise ValueError("Unknown drop policy '{}', must be one of {}.".format(drop_policy, self.DROP_POLICIES))
+        if maxsize < 1:
+            raise ValueError("The receive queue must hold at least one message.")
+
+        self.driver = driver
+        self.drop_policy = drop_policy
+        self.maxsize = 1 if drop_policy == 'conflate' else maxsize
+
+        # Timeout, in milliseconds, when getting messages from the queue.
+        self.RCVTIMEO = 1000
+
+        # How often the receiving thread checks if it has been asked to stop, in milliseconds.
+        self.poll_interval = 100
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._error = None
+        self._thread = None
+
+        # Message statistics, num_dropped_at_get is the value of num_dropped when the last message was taken off
+        # the queue.
+        self.num_received = 0
+        self.num_dropped = 0
+        self.num_dropped_at_get = 0
+        self.max_queue_depth = 0
+
+        # The time.perf_counter() when the message last taken off the queue came off the socket.
+        self.last_arrival_time = None
+
+    def start(self):
+        """
+        Start the receiving thread.
+
+        :return: self
+        """
+        self._thread = threading.Thread(target=self._run, name="pybmt-receiver", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop the receiving thread and wait for it to close the socket.
+
+        :return: None
+        """
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        try:
+            # When we drop messages ourselves the thread always keeps up with the socket, and we don't want zero MQ
+            # dropping messages behind our back. When we block, messages back up in zero MQ and its high water mark
+            # is all that keeps them from piling up without limit.
+            socket = self.driver._connect(rcvhwm=self.maxsize if self.drop_policy == 'block' else 0)
+        except Exception as ex:
+            with self._cond:
+                self._error = ex
+                self._cond.notify_all()
+            return
+
+        socket.RCVTIMEO = self.poll_interval
+        try:
+            while not self._stopping:
+                try:
+                    data = self.driver._recv_message(socket)
+                except zmq.error.Again:
+                    continue
+
+                self._put((data, time.perf_counter()))
+        except Exception as ex:
+            with self._cond:
+                self._error = ex
+                self._cond.notify_all()
+        finally:
+            self.driver._disconnect(socket)
+
+    def _put(self, item):
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                if self.drop_policy == 'block':
+                    while len(self._queue) >= self.maxsize and not self._stopping:
+                        self._cond.wait(self.poll_interval / 1000.0)
+                else:
+                    self._queue.popleft()
+                    self.num_dropped = self.num_dropped + 1
+
+            self._queue.append(item)
+            self.num_received = self.num_received + 1
+            if len(self._queue) > self.max_queue_depth:
+                self.max_queue_depth = len(self._queue)
+
+            self._cond.notify_all()
+
+    def _wait(self, timeout):
+        """
+        Wait, with self._cond held, for a message to be queued.
+
+        :param float timeout: The time to wait, in seconds.
+        :return: True if there is a message waiting, False if we timed out.
+        """
+        deadline = time.monotonic() + timeout
+        while not self._queue:
+            if self._error is not None:
+                raise self._error
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+
+            self._cond.wait(remaining)
+
+        return True
+
+    def _get(self):
+        with self._cond:
+            if not self._wait(self.RCVTIMEO / 1000.0):
+                raise zmq.error.Again()
+
+            data, self.last_arrival_time = self._queue.popleft()
+            self.num_dropped_at_get = self.num_dropped
+
+            # Let the receiving thread know there is room, if it is waiting.
+            if self.drop_policy == 'block':
+                self._cond.notify_all()
+
+            return data
+
+    def poll(self, timeout=None):
+        """
+        Wait for a message, same as zmq.Socket.poll.
+
+        :param int timeout: The time to wait in milliseconds, None waits for RCVTIMEO.
+        :return: zmq.POLLIN if a message is waiting, 0 otherwise.
+        """
+        timeout = self.RCVTIMEO if timeout is None else timeout
+        with self._cond:
+            return zmq.POLLIN if self._wait(timeout / 1000.0) else 0
+
+    def recv(self, copy=True):
+        """
+        Get the next message from the queue, same as zmq.Socket.recv. The copy argument is ignored, whatever the
+        driver received is returned.
+        """
+        return self._get()
+
+    def recv_string(self):
+        """
+        Get the next message from the queue, same as zmq.Socket.recv_string.
+        """
+        return self._get()
+
+    def queue_depth(self):
+        """
+        :return: The number of messages currently waiting in the queue.
+        """
+        return len(self._queue)
@@ -0,0 +1,320 @@
+import ast
+import ctypes
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from pybmt.fictrac.state import FicTracState
+
+# The start of every recording file, followed by the format version.
+RECORDING_MAGIC = b'PYBMTREC'
+RECORDING_VERSION = 1
+
+# magic, version, header size, record count. The dtype description follows, the records start at the header size.
+_HEADER_PREFIX = struct.Struct('<8sIIQ')
+_COUNT_OFFSET = 16
+
+# Records start on a multiple of this, so memory mapped records are aligned.
+_HEADER_ALIGN = 64
+
+# The records of a session's event stream. kind is a short name, like 'stimulus_on', and value a number that goes
+# with it. frame_cnt is the FicTrac frame the event happened on, time is time.perf_counter().
+EVENT_DTYPE = np.dtype([('frame_cnt', '<i8'), ('time', '<f8'), ('kind', 'S24'), ('value', '<f8')])
+
+
+def _make_header(dtype):
+    descr = repr(np.lib.format.dtype_to_descr(dtype)).encode()
+    size = _HEADER_PREFIX.size + len(descr)
+    size = size + (-size % _HEADER_ALIGN)
+    header = _HEADER_PREFIX.pack(RECORDING_MAGIC, RECORDING_VERSION, size, 0) + descr
+    return header.ljust(size, b' ')
+
+
+def read_recording_header(path):
+    """
+    Read the header of a recording file.
+
+    :param str path: The path to the recording.
+    :return: A (dtype, header size, record count) tuple.
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(_HEADER_PREFIX.size)
+        if len(prefix) < _HEADER_PREFIX.size:
+            raise ValueError("{} is too short to be a pybmt recording.".format(path))
+
+        magic, version, header_size, count = _HEADER_PREFIX.unpack(prefix)
+        if magic != RECORDING_MAGIC:
+            raise ValueError("{} is not a pybmt recording.".format(path))
+        if version != RECORDING_VERSION:
+            raise ValueError("{} is a version {} recording, expected version {}.".format(path, version,
+                                                                                        RECORDING_VERSION))
+
+        descr = f.read(header_size - _HEADER_PREFIX.size).decode().strip()
+
+    dtype = np.lib.format.descr_to_dtype(ast.literal_eval(descr))
+    return dtype, header_size, count
+
+
+def load_recording(path, mode='r'):
+    """
+    Load a recording file as a numpy memory map, zero copy. Only the records the header counts are included, records
+    from a chunk that was being written when the recorder crashed are left out.
+
+    :param str path: The path to the recording.
+    :param str mode: The numpy.memmap mode, 'r' for read only.
+    :return: A numpy.memmap structured array of the records.
+    """
+    dtype, header_size, count = read_recording_header(path)
+
+    # numpy can't map zero bytes
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+
+    return np.memmap(path, dtype=dtype, mode=mode, offset=header_size, shape=(count,))
+
+
+class RecordingWriter:
+    """
+    Appends fixed size records to a recording file without holding up the caller. Records are copied into a
+    preallocated chunk, a numpy array of chunk_size records. Full chunks are handed to a background thread, which
+    appends them to the file and only then updates the record count in the header. If the process dies mid write, the
+    header still counts only whole chunks, load_recording() gives back everything up to the last chunk written.
+
+    When the writer thread can't keep up, more chunks are allocated, record() never waits on the disk. A writer is
+    meant to be written to from a single thread.
+    """
+
+    def __init__(self, path, dtype=None, chunk_size=4096, num_chunks=8, fsync=False):
+        """
+        :param str path: The path of the recording file, it is overwritten.
+        :param dtype: The numpy dtype of the records, FicTracState.np_dtype() if None.
+        :param int chunk_size: The number of records in a chunk.
+        :param int num_chunks: The number of chunks to preallocate.
+        :param bool fsync: Sync each chunk to disk before counting it in the header. Slower, but survives the machine
+        going down, not just the process.
+        """
+        self.path = path
+        self.dtype = FicTracState.np_dtype() if dtype is None else np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.fsync = fsync
+
+        self._free_chunks = queue.Queue()
+        for i in range(num_chunks):
+            self._free_chunks.put(np.zeros(chunk_size, dtype=self.dtype))
+
+        self._itemsize = self.dtype.itemsize
+        self._chunk = None
+        self._index = 0
+
+        self._file = None
+        self._queue = None
+        self._thread = None
+        self._error = None
+
+        # The number of records recorded, the number counted in the file so far, and the number of extra chunks that
+        # had to be allocated because the writer thread fell behind.
+        self.num_records = 0
+        self.num_written = 0
+        self.num_chunk_allocs = 0
+
+    def open(self):
+        """
+        Create the file, write the header and start the writer thread.
+
+        :return: None
+        """
+        self._file = open(self.path, 'wb')
+        self._file.write(_make_header(self.dtype))
+        self._file.flush()
+
+        self.num_records = 0
+        self.num_written = 0
+        self._error = None
+        self._next_chunk()
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="pybmt-recorder", daemon=True)
+        self._thread.start()
+
+    def _next_chunk(self):
+        try:
+            self._chunk = self._free_chunks.get_nowait()
+        except queue.Empty:
+            self._chunk = np.zeros(self.chunk_size, dtype=self.dtype)
+            self.num_chunk_allocs = self.num_chunk_allocs + 1
+
+        self._chunk_address = self._chunk.ctypes.data
+        self._index = 0
+
+    def record(self, record):
+        """
+        Add a record.
+
+        :param record: A ctypes structure with the same memory layout as the dtype, like a FicTracState, or anything
+        numpy can assign to an element of the dtype.
+        :return: None
+        """
+        i = self._index
+        if isinstance(record, ctypes.Structure) and ctypes.sizeof(record) == self._itemsize:
+            ctypes.memmove(self._chunk_address + i * self._itemsize, ctypes.addressof(record), self._itemsize)
+        else:
+            self._chunk[i] = record
+
+        self._index = i + 1
+        self.num_records = self.num_records + 1
+
+        if self._index == self.chunk_size:
+            self._hand_off()
+
+    def _hand_off(self):
+        if self._error is not None:
+            raise Exception("Recording to {} failed.".format(self.path)) from self._error
+
+        self._queue.put((self._chunk, self._index))
+        self._next_chunk()
+
+    def flush(self):
+        """
+        Hand the records so far to the writer thread, without waiting for them to be written.
+
+        :return: None
+        """
+        if self._index > 0:
+            self._hand_off()
+
+    def _run(self):
+        fd = self._file.fileno()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            chunk, count = item
+            try:
+                # The records go in first, then the header counts them.
+                self._file.write(chunk[:count].data)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(fd)
+
+                self.num_written = self.num_written + count
+                self._file.seek(_COUNT_OFFSET)
+                self._file.write(struct.pack('<Q', self.num_written))
+                self._file.seek(0, os.SEEK_END)
+                self._file.flush()
+                if self.fsync:
+                    os.fsync(fd)
+            except Exception as ex:
+                self._error = ex
+                return
+            finally:
+                # Partial chunks from flush() go back in the pool too, they are refilled from the start.
+                self._free_chunks.put(chunk)
+
+    def close(self):
+        """
+        Write out the remaining records, wait for the writer thread and close the file.
+
+        :return: None
+        """
+        if self._file is None:
+            return
+
+        try:
+            if self._error is None:
+                self.flush()
+            self._queue.put(None)
+            self._thread.join()
+        finally:
+            self._file.close()
+            self._file = None
+
+        if self._error is not None:
+            raise Exception("Recording to {} failed.".format(self.path)) from self._error
+
+
+class SessionRecorder:
+    """
+    Records a session for later analysis, every tracking state and any events, like stimuli or callback decisions.
+    Give it to the driver (recorder=) and the driver records each state before the callback sees it, and any gaps in
+    the frames. Callbacks that have the recorder can add their own events with record_event().
+
+    A session is a directory with one recording file per stream, states.rec with FicTracState records and events.rec
+    with EVENT_DTYPE records, see RecordingWriter. Load it back with load_session().
+    """
+
+    STATES_FILE = "states.rec"
+    EVENTS_FILE = "events.rec"
+
+    def __init__(self, directory, chunk_size=4096, fsync=False):
+        """
+        :param str directory: The directory to record into, created if it doesn't exist.
+        :param int chunk_size: The number of states written to the file at a time.
+        :param bool fsync: See RecordingWriter.
+        """
+        self.directory = directory
+        self.states = RecordingWriter(os.path.join(directory, self.STATES_FILE), chunk_size=chunk_size, fsync=fsync)
+        self.events = RecordingWriter(os.path.join(directory, self.EVENTS_FILE), dtype=EVENT_DTYPE,
+                                      chunk_size=256, fsync=fsync)
+        self.is_open = False
+
+    def open(self):
+        """
+        Start recording, the driver calls this at the start of run().
+
+        :return: None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self.states.open()
+        self.events.open()
+        self.is_open = True
+
+    def record_state(self, state):
+        """
+        Record a tracking state.
+
+        :param state: The FicTracState.
+        :return: None
+        """
+        self.states.record(state)
+
+    def record_event(self, kind, value=0.0, frame_cnt=-1):
+        """
+        Record an event.
+
+        :param str kind: What happened, at most 24 characters.
+        :param float value: A number that goes with it.
+        :param int frame_cnt: The FicTrac frame it happened on.
+        :return: None
+        """
+        self.events.record((frame_cnt, time.perf_counter(), kind, value))
+
+    def close(self):
+        """
+        Write out everything and close the files, the driver calls this at the end of run().
+
+        :return: None
+        """
+        if not self.is_open:
+            return
+
+        self.is_open = False
+        try:
+            self.states.close()
+        finally:
+            self.events.close()
+
+
+def load_session(directory):
+    """
+    Load a session recorded by a SessionRecorder, zero copy.
+
+    :param str directory: The session directory.
+    :return: A dict with 'states' and 'events' numpy.memmap arrays.
+    """
+    return {'states': load_recording(os.path.join(directory, SessionRecorder.STATES_FILE)),
+            'events': load_recording(os.path.join(directory, SessionRecorder.EVENTS_FILE))}
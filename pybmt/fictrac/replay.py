@@ -0,0 +1,167 @@
+import os
+import time
+
+import numpy as np
+
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.state import FicTracState
+
+
+def read_dat_file(dat_file):
+    """
+    Read a FicTrac output log (.dat) file into a numpy structured array of FicTracState.np_dtype(). Each line of the
+    file is one frame, the values in the same order as the tracking state messages. Older versions of FicTrac don't
+    write the delta_timestamp and alt_timestamp columns, for these logs delta_timestamp is worked out from the
+    timestamps and alt_timestamp is left at zero.
+
+    :param str dat_file: The path to the .dat file.
+    :return: A numpy structured array with one element per frame.
+    """
+
+    _, _, num_fictrac_fields, field_columns = FicTracState._message_layout()
+
+    values = np.loadtxt(dat_file, delimiter=',', dtype=np.float64, ndmin=2)
+
+    # Without the two newest fields we are two columns short
+    num_columns = values.shape[1] if values.size > 0 else num_fictrac_fields
+    if num_columns not in (num_fictrac_fields, num_fictrac_fields - 2):
+        raise ValueError("FicTrac log file {} has {} columns, expected {} or {}.".format(
+            dat_file, num_columns, num_fictrac_fields - 2, num_fictrac_fields))
+
+    states = np.zeros(values.shape[0], dtype=FicTracState.np_dtype())
+    for field_name, start, length in field_columns:
+        if start >= num_columns:
+            continue
+
+        if length == 1:
+            states[field_name] = values[:, start]
+        else:
+            states[field_name] = values[:, start:start+length]
+
+    if num_columns < num_fictrac_fields and len(states) > 1:
+        states['delta_timestamp'][1:] = np.diff(states['timestamp'])
+
+    return states
+
+
+class ReplayDriver(FicTracDriver):
+    """
+    Replays a recorded FicTrac output log (.dat) file through a callback, no FicTrac, camera or video needed. It has
+    the same interface as FicTracDriver, call run() and the callback gets one FicTracState per line of the log with
+    the same frame checks and latency tracking. The states are replayed as fast as possible, to benchmark or
+    regression test callbacks, or paced in real time from the recorded timestamps.
+    """
+
+    def __init__(self, dat_file, track_change_callback=None, realtime=False, speed=1.0, plot_on=False,
+                 reuse_state=False, track_latency=False, tolerate_gaps=False, max_lost_frames=None,
+                 state_shmem_name=None, recorder=None, watchdog_policy='warn', profile=False):
+        """
+        Create the replay driver, the whole log is read up front.
+
+        :param str dat_file: The path to the FicTrac .dat file to replay.
+        :param track_change_callback: The PyBMTCallback to call for each frame.
+        :param bool realtime: Pace the frames by their recorded timestamps. If False, the default, replay as fast as
+        the callback allows.
+        :param float speed: With realtime, how many times faster than recorded to replay.
+        :param bool plot_on: Same as FicTracDriver.
+        :param bool reuse_state: Same as FicTracDriver.
+        :param bool track_latency: Same as FicTracDriver.
+        :param bool tolerate_gaps: Same as FicTracDriver.
+        :param int max_lost_frames: Same as FicTracDriver.
+        :param str state_shmem_name: Same as FicTracDriver.
+        :param recorder: Same as FicTracDriver.
+        :param str watchdog_policy: Same as FicTracDriver, only used with realtime.
+        :param profile: Same as FicTracDriver.
+        """
+
+        # _setup_source needs to know where the states come from.
+        self.dat_file = dat_file
+        super(ReplayDriver, self).__init__(track_change_callback=track_change_callback,
+                                           plot_on=plot_on, reuse_state=reuse_state, track_latency=track_latency,
+                                           tolerate_gaps=tolerate_gaps, max_lost_frames=max_lost_frames,
+                                           state_shmem_name=state_shmem_name, recorder=recorder,
+                                           watchdog_policy=watchdog_policy, profile=profile)
+
+        self.realtime = realtime
+        self.speed = speed
+
+        # Replaying as fast as we can there are no deadlines to miss. In real time frames are due at their recorded
+        # times, like FicTrac's.
+        if not realtime:
+            self.watchdog = None
+        elif self.watchdog is not None:
+            self.watchdog.time_scale = speed
+
+        self.states = read_dat_file(dat_file)
+
+        # Raw bytes of each state, what the "messages" of the replay are.
+        self._state_bytes = self.states.view(np.uint8).reshape(len(self.states), self.states.dtype.itemsize)
+
+        # How long the last run took, in seconds.
+        self.run_time = None
+
+    def _setup_source(self, config_file, remote_endpoint_url, console_ouput_file, pgr_enable, fic_trac_bin_path):
+        """
+        The states come from the log, there is no FicTrac to find or start, or socket to connect to.
+
+        :return: None
+        """
+        self.remote_endpoint_url = "file://" + os.path.abspath(self.dat_file)
+        self.start_fictrac = False
+
+    def _run_messages(self):
+        """
+        Replay the frames, there is no FicTrac to start. run() blocks until all the frames have been processed or the
+        callback returns False.
+
+        :return: None
+        """
+        self._message_loop(self._state_bytes)
+
+        self.run_time = time.perf_counter() - self._t_start
+
+    def _message_loop(self, messages):
+
+        timestamps = self.states['timestamp']
+
+        isOK = True
+        for i in range(len(messages)):
+            if not isOK:
+                break
+
+            # Wait till the frame is due, the recorded timestamps are in milliseconds.
+            if self.realtime:
+                t_due = self._t_start + (timestamps[i] - timestamps[0]) / 1000.0 / self.speed
+                delay = t_due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+            t0 = time.perf_counter()
+
+            fstate = self._parse_message(messages[i])
+
+            isOK = self._process_frame(fstate, t0, t0)
+
+    def _parse_message(self, data):
+        """
+        Turn the raw bytes of a recorded state into a FicTracState, or a FicTracStateView if reusing state.
+
+        :param data: The bytes of the state.
+        :return: The FicTracState.
+        """
+        if self.reuse_state:
+            index = 1 - self._state_buffer_index
+            self._state_buffer_bytes[index][:] = data
+            self._state_buffer_index = index
+            return self._state_buffers[index]
+
+        return FicTracState.from_buffer_copy(data)
+
+    def _check_exit_status(self):
+        """
+        Raise an exception if nothing was replayed.
+
+        :return: None
+        """
+        if self.frame_cnt == 0:
+            raise RuntimeError("Zero frames processed. Is the FicTrac log file ({}) empty?".format(self.dat_file))
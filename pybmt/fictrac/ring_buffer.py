@@ -0,0 +1,131 @@
+import ctypes
+
+import numpy as np
+
+from pybmt.fictrac.state import FicTracState
+
+
+class StateRingBuffer:
+    """
+    A fixed size history of tracking states backed by a preallocated numpy structured array. Appending is O(1) and
+    never allocates. The buffer is mirrored, every sample is written twice, once in each half of an array twice the
+    capacity. This way the last N samples, for any N up to the capacity, are always a single contiguous slice of the
+    array, so windows are zero copy numpy views even when they wrap around.
+
+    Windows returned by last() and field() are views, they will see later appends overwrite old samples. Copy them if
+    they need to be kept.
+    """
+
+    def __init__(self, capacity, dtype=None):
+        """
+        Create the ring buffer.
+
+        :param int capacity: The number of samples of history to keep.
+        :param dtype: The numpy dtype of a sample. Defaults to FicTracState.np_dtype(), any other numpy dtype can be
+        used to keep a history of other values.
+        """
+        if capacity < 1:
+            raise ValueError("StateRingBuffer capacity must be at least 1.")
+
+        self.capacity = capacity
+        self.dtype = FicTracState.np_dtype() if dtype is None else np.dtype(dtype)
+
+        self._data = np.zeros(2 * capacity, dtype=self.dtype)
+        self._address = self._data.ctypes.data
+        self._itemsize = self.dtype.itemsize
+
+        # The position the next sample will be written to, and the total number of samples ever appended.
+        self._index = 0
+        self.total = 0
+
+    def __len__(self):
+        return min(self.total, self.capacity)
+
+    def append(self, sample):
+        """
+        Add a sample to the buffer, overwriting the oldest one if the buffer is full.
+
+        :param sample: A ctypes structure (like a FicTracState) with the same memory layout as the dtype, or anything
+        numpy can assign to an element of the dtype.
+        :return: None
+        """
+        i = self._index
+
+        if isinstance(sample, ctypes.Structure) and ctypes.sizeof(sample) == self._itemsize:
+            dst = self._address + i * self._itemsize
+            ctypes.memmove(dst, ctypes.addressof(sample), self._itemsize)
+            ctypes.memmove(dst + self.capacity * self._itemsize, ctypes.addressof(sample), self._itemsize)
+        else:
+            self._data[i] = sample
+            self._data[i + self.capacity] = sample
+
+        self._index = i + 1 if i + 1 < self.capacity else 0
+        self.total = self.total + 1
+
+    def extend(self, samples):
+        """
+        Add many samples at once, for example an array from FicTracState.zmq_string_msgs_to_array.
+
+        :param samples: A numpy array of samples.
+        :return: None
+        """
+        samples = np.asarray(samples, dtype=self.dtype)
+        num_samples = len(samples)
+
+        # Only the last capacity samples can survive anyway.
+        kept = samples[-self.capacity:]
+        num_kept = len(kept)
+
+        # Write the samples in at most two pieces, if they wrap around, into both halves of the buffer.
+        first = min(num_kept, self.capacity - self._index)
+        for offset in (0, self.capacity):
+            self._data[offset + self._index:offset + self._index + first] = kept[:first]
+            self._data[offset:offset + num_kept - first] = kept[first:]
+
+        self._index = (self._index + num_kept) % self.capacity
+        self.total = self.total + num_samples
+
+    def last(self, n=None):
+        """
+        Get a view of the last n samples, oldest first.
+
+        :param int n: The number of samples. Defaults to all the samples in the buffer.
+        :return: A numpy array view of the samples.
+        """
+        if n is None:
+            n = len(self)
+        elif n > len(self):
+            raise ValueError("Asked for the last {} samples but the buffer only has {}.".format(n, len(self)))
+
+        end = self._index + self.capacity
+        return self._data[end - n:end]
+
+    def field(self, name, n=None):
+        """
+        Get a view of a single field over the last n samples, oldest first.
+
+        :param str name: The name of the field, for example 'speed'.
+        :param int n: The number of samples. Defaults to all the samples in the buffer.
+        :return: A numpy array view of the field.
+        """
+        return self.last(n)[name]
+
+    def latest(self):
+        """
+        Get the most recent sample.
+
+        :return: The sample, as a numpy scalar or structured element.
+        """
+        if self.total == 0:
+            raise IndexError("StateRingBuffer is empty.")
+
+        return self._data[self._index + self.capacity - 1]
+
+    def clear(self):
+        """
+        Forget all samples.
+
+        :return: None
+        """
+        self._index = 0
+        self.total = 0
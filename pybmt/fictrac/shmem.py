@@ -0,0 +1,444 @@
+import ctypes
+import multiprocessing
+import time
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # multiprocessing.shared_memory is new in python 3.8
+    shared_memory = None
+
+from pybmt.fictrac.state import FicTracState
+
+
+def _check_shared_memory():
+    if shared_memory is None:
+        raise RuntimeError("Sharing FicTrac state between processes needs multiprocessing.shared_memory, python 3.8+")
+
+
+# The name the driver publishes the latest state under, unless told otherwise.
+DEFAULT_STATE_SHMEM_NAME = "pybmt_fictrac_state"
+
+# The names of the shared memory blocks created by this process.
+_created_names = set()
+
+
+def _attach(name):
+    """
+    Attach to an existing shared memory block. The block belongs to the process that created it, only that process
+    should unlink it. Attaching registers the block with our resource tracker, which unlinks it when we exit. The
+    creator and its multiprocessing children share a resource tracker so that is harmless, but an unrelated process
+    has its own and has to unregister the block.
+    """
+    shm = shared_memory.SharedMemory(name=name)
+    if name not in _created_names and multiprocessing.parent_process() is None:
+        try:
+            resource_tracker.unregister(shm._name, "shared_memory")
+        except Exception:
+            pass
+    return shm
+
+
+class _RingHeader(ctypes.Structure):
+    """
+    The header at the start of a SharedStateRing's shared memory block.
+    """
+    _fields_ = [
+        ('write_seq', ctypes.c_uint64),     # The sequence number of the last state written, 0 before any
+        ('capacity', ctypes.c_uint64),      # The number of slots in the ring
+        ('state_size', ctypes.c_uint64),    # The size of each state, a check that both ends agree on FicTracState
+        ('closed', ctypes.c_uint64),        # Set by the writer when no more states will be written
+        ('stop_requested', ctypes.c_uint64),  # Set by a reader to ask the writer to stop
+        ('_pad', ctypes.c_uint64 * 3),      # Pad to 64 bytes
+    ]
+
+
+class SharedStateRing:
+    """
+    A ring buffer of FicTracState in a named shared memory block (multiprocessing.shared_memory), written by one
+    process and read by any number of others. Each state written gets the next sequence number, the header holds the
+    sequence number of the last state written and each slot holds the sequence number of the state in it.
+
+    Writing is a memmove of the state's bytes and a few integer stores. The slot's sequence number is cleared before
+    the copy and set after it, so a reader that copies a slot while it is being overwritten sees the sequence number
+    change and knows its copy is bad. A reader that falls more than capacity states behind skips ahead to the oldest
+    state still in the ring and counts the states it missed.
+
+    The header also has two flags, closed, set by the writer when it is done, and stop_requested, which readers can set
+    to ask the writer to stop.
+    """
+
+    def __init__(self, shm, owner):
+        """
+        Don't call directly, use create() or attach().
+        """
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        self.header = _RingHeader.from_buffer(shm.buf)
+        self.capacity = self.header.capacity
+        if self.header.state_size != ctypes.sizeof(FicTracState):
+            raise ValueError("Shared state ring {} holds {} byte states, expected {}.".format(
+                self.name, self.header.state_size, ctypes.sizeof(FicTracState)))
+
+        seq_offset = ctypes.sizeof(_RingHeader)
+        self.slot_seqs = (ctypes.c_uint64 * self.capacity).from_buffer(shm.buf, seq_offset)
+
+        self._slots = (FicTracState * self.capacity).from_buffer(shm.buf, seq_offset + 8 * self.capacity)
+        self._slots_addr = ctypes.addressof(self._slots)
+        self._state_size = ctypes.sizeof(FicTracState)
+
+        # Where the reader is up to, the sequence number of the next state to read.
+        self.read_seq = 1
+        self.num_missed = 0
+
+    @classmethod
+    def create(cls, capacity=1024, name=None):
+        """
+        Create a new ring in a new shared memory block.
+
+        :param int capacity: The number of states the ring holds.
+        :param str name: The name of the shared memory block, a random name is picked if None.
+        :return: The SharedStateRing, it owns the block and unlinks it when closed.
+        """
+        _check_shared_memory()
+
+        size = ctypes.sizeof(_RingHeader) + capacity * (8 + ctypes.sizeof(FicTracState))
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        _created_names.add(shm.name)
+
+        header = _RingHeader.from_buffer(shm.buf)
+        header.capacity = capacity
+        header.state_size = ctypes.sizeof(FicTracState)
+        del header
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to an existing ring by name, to read it from another process.
+
+        :param str name: The name of the ring's shared memory block.
+        :return: The SharedStateRing.
+        """
+        _check_shared_memory()
+        return cls(_attach(name), owner=False)
+
+    def write(self, state):
+        """
+        Write a state into the next slot of the ring.
+
+        :param state: The FicTracState.
+        :return: The sequence number of the state.
+        """
+        header = self.header
+        seq = header.write_seq + 1
+        slot = (seq - 1) % self.capacity
+
+        self.slot_seqs[slot] = 0
+        ctypes.memmove(self._slots_addr + slot * self._state_size, ctypes.addressof(state), self._state_size)
+        self.slot_seqs[slot] = seq
+        header.write_seq = seq
+
+        return seq
+
+    def read(self):
+        """
+        Read the next state, if it has been written.
+
+        :return: A copy of the next state, or None if no new state has been completely written yet.
+        """
+        while True:
+            head = self.header.write_seq
+            if self.read_seq > head:
+                return None
+
+            # If we have been lapped, skip ahead to the oldest state still in the ring.
+            if head - self.read_seq >= self.capacity:
+                oldest = head - self.capacity + 1
+                self.num_missed = self.num_missed + oldest - self.read_seq
+                self.read_seq = oldest
+
+            # The copy is only good if the slot held our state the whole time. If it doesn't hold it yet, the writer
+            # is still busy with it.
+            slot = (self.read_seq - 1) % self.capacity
+            if self.slot_seqs[slot] != self.read_seq:
+                return None
+
+            state = FicTracState.from_buffer_copy(self._slots[slot])
+
+            if self.slot_seqs[slot] == self.read_seq:
+                self.read_seq = self.read_seq + 1
+                return state
+
+    def wait(self, timeout=None, poll_interval=0.0005):
+        """
+        Wait for the next state and read it.
+
+        :param float timeout: How long to wait, in seconds, None waits until the ring is closed.
+        :param float poll_interval: How often to check for a new state, in seconds.
+        :return: A copy of the next state, or None if we timed out or the ring was closed.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            state = self.read()
+            if state is not None:
+                return state
+
+            # The last states may have been written just before the ring was closed.
+            if self.header.closed:
+                return self.read()
+
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+
+            time.sleep(poll_interval)
+
+    @property
+    def write_seq(self):
+        """
+        The sequence number of the last state written.
+        """
+        return self.header.write_seq
+
+    @property
+    def closed(self):
+        return bool(self.header.closed)
+
+    def mark_closed(self):
+        """
+        Let the readers know no more states will be written.
+
+        :return: None
+        """
+        self.header.closed = 1
+
+    @property
+    def stop_requested(self):
+        return bool(self.header.stop_requested)
+
+    def request_stop(self):
+        """
+        Ask the writer to stop.
+
+        :return: None
+        """
+        self.header.stop_requested = 1
+
+    def close(self):
+        """
+        Detach from the shared memory block, and unlink it if we created it.
+
+        :return: None
+        """
+        if self.shm is None:
+            return
+
+        # The ctypes objects hold on to the buffer, they have to go before it can be closed.
+        del self.header
+        del self.slot_seqs
+        del self._slots
+
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created_names.discard(self.name)
+        self.shm = None
+
+
+class _LatestHeader(ctypes.Structure):
+    """
+    The header at the start of a SharedLatestState's shared memory block.
+    """
+    _fields_ = [
+        ('seq', ctypes.c_uint64),           # The seqlock counter, odd while a state is being written
+        ('state_size', ctypes.c_uint64),    # The size of the state, a check that both ends agree on FicTracState
+        ('closed', ctypes.c_uint64),        # Set by the writer when no more states will be written
+        ('_pad', ctypes.c_uint64 * 5),      # Pad to 64 bytes
+    ]
+
+
+class SharedLatestState:
+    """
+    The latest FicTracState, published in a named shared memory block for any number of local processes to read.
+    Plotters, dashboards, stimulus renderers, etc. get the current state with a memcpy, without a zero MQ subscription
+    of their own or parsing any messages.
+
+    The state is guarded by a seqlock. The writer bumps the sequence counter to an odd number, copies the state in,
+    and bumps the counter again to an even number. A reader copies the state out between two reads of the counter,
+    and if the counter was odd or changed, a write got in the way and it tries again. Writing never waits on readers.
+    The number of states published is the counter divided by two.
+    """
+
+    # How many times a reader tries again straight away when a write gets in the way, before it starts sleeping.
+    SPIN_RETRIES = 100
+
+    # The longest a reader sleeps between tries, in seconds.
+    MAX_BACKOFF = 0.001
+
+    def __init__(self, shm, owner):
+        """
+        Don't call directly, use create() or attach().
+        """
+        self.shm = shm
+        self.name = shm.name
+        self.owner = owner
+
+        self.header = _LatestHeader.from_buffer(shm.buf)
+        if self.header.state_size != ctypes.sizeof(FicTracState):
+            raise ValueError("Shared state {} holds {} byte states, expected {}.".format(
+                self.name, self.header.state_size, ctypes.sizeof(FicTracState)))
+
+        self._state = FicTracState.from_buffer(shm.buf, ctypes.sizeof(_LatestHeader))
+        self._state_addr = ctypes.addressof(self._state)
+        self._state_size = ctypes.sizeof(FicTracState)
+
+        # The sequence number of the last state a reader read.
+        self.last_seq = 0
+
+    @classmethod
+    def create(cls, name, takeover=False):
+        """
+        Create the shared memory block to publish states in.
+
+        :param str name: The name of the shared memory block, readers attach to it by this name.
+        :param bool takeover: If a block with this name already exists, take it over and start it fresh. Only do this
+        for a block left behind by a run that didn't shut down cleanly, not one another run is still publishing to.
+        :return: The SharedLatestState, it owns the block and unlinks it when closed.
+        """
+        _check_shared_memory()
+
+        size = ctypes.sizeof(_LatestHeader) + ctypes.sizeof(FicTracState)
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not takeover:
+                raise FileExistsError("Shared state {} already exists. Another run may be publishing to it, if it was "
+                                      "left behind by a run that crashed, create it with takeover=True.".format(name))
+            shm = shared_memory.SharedMemory(name=name)
+            if shm.size < size:
+                shm.close()
+                raise
+        _created_names.add(shm.name)
+
+        header = _LatestHeader.from_buffer(shm.buf)
+        header.seq = 0
+        header.closed = 0
+        header.state_size = ctypes.sizeof(FicTracState)
+        del header
+
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attach to a published state by name, to read it from another process.
+
+        :param str name: The name of the shared memory block.
+        :return: The SharedLatestState.
+        """
+        _check_shared_memory()
+        return cls(_attach(name), owner=False)
+
+    def publish(self, state):
+        """
+        Publish a new state.
+
+        :param state: The FicTracState.
+        :return: None
+        """
+        header = self.header
+        header.seq = header.seq + 1
+        ctypes.memmove(self._state_addr, ctypes.addressof(state), self._state_size)
+        header.seq = header.seq + 1
+
+    def read(self, into=None, timeout=0.1):
+        """
+        Read the latest state.
+
+        :param into: A FicTracState to copy the state into, a new one is made if None.
+        :param float timeout: How long to keep trying, in seconds, while writes get in the way. A write is a memmove,
+        this only runs out if the writer died part way through one.
+        :return: The state, or None if nothing has been published yet.
+        """
+        if into is None:
+            into = FicTracState()
+
+        header = self.header
+        retries = 0
+        deadline = None
+        while True:
+            seq = header.seq
+            if seq == 0:
+                return None
+
+            # Odd means the writer is in the middle of it.
+            if not seq & 1:
+                ctypes.memmove(ctypes.addressof(into), self._state_addr, self._state_size)
+                if header.seq == seq:
+                    self.last_seq = seq
+                    return into
+
+            # Writes are quick, try again straight away a few times before backing off.
+            retries = retries + 1
+            if retries <= self.SPIN_RETRIES:
+                continue
+
+            if deadline is None:
+                deadline = time.perf_counter() + timeout
+            elif time.perf_counter() > deadline:
+                raise TimeoutError("Shared state {} has been mid write for more than {} s, "
+                                   "did the writer die?".format(self.name, timeout))
+
+            time.sleep(min(self.MAX_BACKOFF, 1e-6 * 2 ** (retries - self.SPIN_RETRIES)))
+
+    def read_new(self, into=None):
+        """
+        Read the latest state, if a new one has been published since we last read.
+
+        :param into: A FicTracState to copy the state into, a new one is made if None.
+        :return: The state, or None if there is no new state.
+        """
+        if self.header.seq == self.last_seq:
+            return None
+
+        return self.read(into)
+
+    @property
+    def num_published(self):
+        """
+        The number of states published so far.
+        """
+        return self.header.seq // 2
+
+    @property
+    def closed(self):
+        return bool(self.header.closed)
+
+    def mark_closed(self):
+        """
+        Let the readers know no more states will be published.
+
+        :return: None
+        """
+        self.header.closed = 1
+
+    def close(self):
+        """
+        Detach from the shared memory block, and unlink it if we created it.
+
+        :return: None
+        """
+        if self.shm is None:
+            return
+
+        del self.header
+        del self._state
+
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+            _created_names.discard(self.name)
+        self.shm = None
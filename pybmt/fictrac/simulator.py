@@ -0,0 +1,319 @@
+import argparse
+import signal
+import sys
+import threading
+import time
+
+import numpy as np
+import zmq
+
+from pybmt.fictrac.config import get_socket_port
+from pybmt.fictrac.state import FicTracState
+
+
+def synthetic_states(num_frames, fps=100.0, first_frame=1):
+    """
+    Generate a sequence of well formed, made up, FicTrac states. The ball rolls forward at a slowly varying speed while
+    turning gently, this is enough to drive callbacks and the driver without a camera or a video.
+
+    :param int num_frames: The number of states to generate.
+    :param float fps: The frame rate the timestamps should correspond to.
+    :param int first_frame: The frame count of the first state.
+    :return: A numpy structured array of FicTracState.np_dtype()
+    """
+    states = np.zeros(num_frames, dtype=FicTracState.np_dtype())
+
+    t = np.arange(num_frames)
+    dt_ms = 1000.0 / fps
+
+    speed = 0.01 + 0.005 * np.sin(2 * np.pi * t / 200.0)
+    yaw = 0.002 * np.sin(2 * np.pi * t / 500.0)
+    heading = np.cumsum(yaw) % (2 * np.pi)
+
+    states['frame_cnt'] = t + first_frame
+    states['del_rot_lab_vec'][:, 1] = speed
+    states['del_rot_lab_vec'][:, 2] = yaw
+    states['del_rot_cam_vec'] = states['del_rot_lab_vec']
+    states['heading'] = heading
+    states['direction'] = heading
+    states['speed'] = speed
+    states['posx'] = np.cumsum(speed * np.cos(heading))
+    states['posy'] = np.cumsum(speed * np.sin(heading))
+    states['intx'] = np.cumsum(speed)
+    states['timestamp'] = (t + 1) * dt_ms
+    states['seq_num'] = t + first_frame
+    states['delta_timestamp'] = dt_ms
+    states['alt_timestamp'] = states['timestamp']
+
+    return states
+
+
+class FicTracPublisher:
+    """
+    A small stand-in for FicTrac. It binds a zero MQ socket and publishes a sequence of states followed by an END
+    message, exactly as FicTrac does. This lets the driver and callbacks be run and tested without FicTrac.
+
+    For load testing, the messages can be published at a fixed rate, up to 10 kHz or so, with timing jitter, bursts
+    of messages arriving at once, and frames that are never sent (a jump in the frame counter). The send time of every
+    message is worked out up front, see send_times(), so the pacing doesn't drift however long the run.
+    """
+
+    def __init__(self, states, endpoint="tcp://127.0.0.1:*", binary_msgs=False, rate=None, wait_for_subscriber=True,
+                 subscriber_timeout=10.0, send_end=True, jitter=0.0, burst_every=None, burst_size=10,
+                 drop_frames=(), seed=None):
+        """
+        Setup the publisher, the socket is bound straight away so its endpoint is known before publishing starts.
+
+        :param states: A numpy structured array of FicTracState.np_dtype(), or a sequence of FicTracState.
+        :param str endpoint: The zero MQ endpoint to bind. Use a * for the port to bind to a random free port.
+        :param bool binary_msgs: Publish the packed FicTracState structure instead of FicTrac's text messages.
+        :param float rate: The rate in Hz to publish at. If None, publish as fast as possible.
+        :param bool wait_for_subscriber: Don't publish anything until a subscriber has connected, otherwise the first
+        messages are lost while the subscriber connects.
+        :param float subscriber_timeout: How long to wait for a subscriber, in seconds.
+        :param bool send_end: Send an END message after the last state. If False, the publisher just goes quiet, like
+        a FicTrac that has hung.
+        :param float jitter: The standard deviation, in seconds, of random timing noise added to each send time. Needs
+        a rate.
+        :param int burst_every: If not None, every burst_every messages, hold back burst_size messages and send them
+        all at once when the last one is due, like a FicTrac that stalled and caught up. Needs a rate.
+        :param int burst_size: The number of messages in each burst.
+        :param drop_frames: The indices of states that are never sent, the subscriber sees the frame counter jump.
+        :param int seed: The seed for the jitter random numbers.
+        """
+        self.binary_msgs = binary_msgs
+        self.rate = rate
+        self.wait_for_subscriber = wait_for_subscriber
+        self.subscriber_timeout = subscriber_timeout
+        self.send_end = send_end
+        self.jitter = jitter
+        self.burst_every = burst_every
+        self.burst_size = burst_size
+
+        # Below this delay we spin instead of sleeping, sleep isn't precise enough for kHz rates.
+        self.spin_threshold = 0.001
+
+        # Pre-format all the messages, we want to spend our time publishing.
+        if isinstance(states, np.ndarray):
+            states = [FicTracState.from_buffer_copy(s.tobytes()) for s in states]
+        drop_frames = set(drop_frames)
+        states = [s for i, s in enumerate(states) if i not in drop_frames]
+        if self.binary_msgs:
+            self.messages = [bytes(s) for s in states]
+        else:
+            self.messages = [s.to_zmq_string_msg().encode() for s in states]
+
+        self._send_times = self.send_times(seed)
+
+        # An XPUB socket behaves like a PUB socket, but we get told when a subscriber shows up.
+        self.context = zmq.Context()
+        self.socket = self.context.socket(zmq.XPUB)
+        self.socket.setsockopt(zmq.SNDHWM, 0)
+        self.socket.bind(endpoint)
+        self.endpoint = self.socket.getsockopt_string(zmq.LAST_ENDPOINT)
+
+        # Publishing statistics, the achieved rate and the worst lateness of a send compared to its schedule.
+        self.num_sent = 0
+        self.elapsed_time = None
+        self.max_lateness = 0.0
+        self._thread = None
+
+    def send_times(self, seed=None):
+        """
+        Work out when each message should be sent.
+
+        :param int seed: The seed for the jitter random numbers.
+        :return: A numpy array with the send time of each message in seconds from the start of publishing, None when
+        publishing as fast as possible.
+        """
+        if self.rate is None:
+            return None
+
+        num_msgs = len(self.messages)
+        t = np.arange(num_msgs) / float(self.rate)
+
+        if self.jitter > 0:
+            t = t + np.random.RandomState(seed).normal(0.0, self.jitter, num_msgs)
+            t = np.maximum.accumulate(np.maximum(t, 0.0))
+
+        # Every message in a burst goes out when the last one of the burst is due.
+        if self.burst_every is not None:
+            for start in range(self.burst_every, num_msgs, self.burst_every):
+                end = min(start + self.burst_size, num_msgs)
+                t[start:end] = t[end - 1]
+
+        return t
+
+    @property
+    def port(self):
+        """
+        The TCP port the publisher is bound to.
+        """
+        return int(self.endpoint.rsplit(':', 1)[1])
+
+    @property
+    def achieved_rate(self):
+        """
+        The rate, in Hz, messages were actually published at. None until publishing is done.
+        """
+        if self.elapsed_time is None or self.elapsed_time <= 0:
+            return None
+
+        return self.num_sent / self.elapsed_time
+
+    def run(self):
+        """
+        Publish all the messages and then, if send_end, an END message. This blocks until done, see start() to publish in the
+        background.
+
+        :return: None
+        """
+        try:
+            if self.wait_for_subscriber:
+                if not self.socket.poll(int(self.subscriber_timeout * 1000)):
+                    raise RuntimeError("No subscriber connected to the FicTrac publisher.")
+                self.socket.recv()
+
+            send_times = self._send_times
+            spin_threshold = self.spin_threshold
+            t_start = time.perf_counter()
+            for i, msg in enumerate(self.messages):
+                if send_times is not None:
+                    t_due = t_start + send_times[i]
+                    delay = t_due - time.perf_counter()
+                    if delay > spin_threshold:
+                        time.sleep(delay - spin_threshold)
+                    while time.perf_counter() < t_due:
+                        pass
+
+                    lateness = time.perf_counter() - t_due
+                    if lateness > self.max_lateness:
+                        self.max_lateness = lateness
+
+                self.socket.send(msg)
+                self.num_sent = self.num_sent + 1
+
+            self.elapsed_time = time.perf_counter() - t_start
+
+            if self.send_end:
+                self.socket.send(b"END")
+        finally:
+            self.socket.close(linger=1000)
+            self.context.term()
+
+    def start(self):
+        """
+        Start publishing on a background thread.
+
+        :return: self
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """
+        Wait for the background thread started by start() to finish.
+
+        :return: None
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+def load_test(callback, rate, num_frames=1000, binary_msgs=False, **driver_args):
+    """
+    Run a FicTracDriver with the given callback against a FicTracPublisher at a fixed rate and see if it keeps up.
+
+    :param callback: The PyBMTCallback to run.
+    :param float rate: The rate, in Hz, to publish at.
+    :param int num_frames: The number of frames to publish.
+    :param bool binary_msgs: Publish binary messages.
+    :param driver_args: Any other FicTracDriver arguments.
+    :return: A tuple of (the exception the driver failed with or None, the driver, the publisher)
+    """
+
+    # Importing here, the driver isn't needed to just publish.
+    from pybmt.fictrac.driver import FicTracDriver
+
+    publisher = FicTracPublisher(synthetic_states(num_frames, fps=rate), binary_msgs=binary_msgs, rate=rate)
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=callback, plot_on=False, binary_msgs=binary_msgs, **driver_args)
+
+    error = None
+    publisher.start()
+    try:
+        tracDrv.run()
+    except Exception as ex:
+        error = ex
+    publisher.join()
+
+    return error, tracDrv, publisher
+
+
+def max_sustainable_rate(make_callback, rates=(100, 200, 500, 1000, 2000, 5000, 10000), duration=2.0, **load_args):
+    """
+    Find the highest frame rate the driver and a callback can keep up with, on this machine. Each rate is load tested
+    in turn, from lowest to highest, until one fails.
+
+    :param make_callback: A function that returns a new callback for each run.
+    :param rates: The rates, in Hz, to try.
+    :param float duration: How long, in seconds, to run at each rate.
+    :param load_args: Passed on to load_test.
+    :return: A tuple of (the highest rate that passed or None, a dict mapping each tried rate to its error or None)
+    """
+    results = {}
+    best = None
+    for rate in sorted(rates):
+        error, _, _ = load_test(make_callback(), rate, num_frames=int(rate * duration), **load_args)
+        results[rate] = error
+        if error is not None:
+            break
+        best = rate
+
+    return best, results
+
+
+def main(argv=None):
+    """
+    Run the simulator from the command line. It takes the same FicTrac config file argument FicTrac does, and
+    publishes on its socket_port, so the driver can start it in place of FicTrac with
+    fic_trac_bin_path=[sys.executable, '-m', 'pybmt.fictrac.simulator'].
+    """
+    parser = argparse.ArgumentParser(description="Publish made up FicTrac tracking state, a stand-in for FicTrac.")
+    parser.add_argument("config_file", nargs="?", default=None,
+                        help="A FicTrac config file, its socket_port is published on.")
+    parser.add_argument("--port", type=int, default=None, help="The port to publish on, overrides the config file.")
+    parser.add_argument("--rate", type=float, default=100.0, help="Frames per second, 0 for as fast as possible.")
+    parser.add_argument("--frames", type=int, default=1000, help="Number of frames to publish.")
+    parser.add_argument("--binary", action="store_true", help="Publish binary messages.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Timing jitter standard deviation, in seconds.")
+    parser.add_argument("--burst-every", type=int, default=None, help="Send a burst of messages every N messages.")
+    parser.add_argument("--burst-size", type=int, default=10, help="Number of messages in a burst.")
+    parser.add_argument("--drop", type=int, nargs="*", default=[], help="Frame indices to never send.")
+    parser.add_argument("--no-end", action="store_true", help="Don't send END when done.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the jitter.")
+    args = parser.parse_args(argv)
+
+    port = args.port
+    if port is None:
+        port = get_socket_port(args.config_file) if args.config_file is not None else 5556
+
+    rate = args.rate if args.rate > 0 else None
+    publisher = FicTracPublisher(synthetic_states(args.frames, fps=rate if rate is not None else 100.0),
+                                 endpoint="tcp://*:{}".format(port), binary_msgs=args.binary, rate=rate,
+                                 send_end=not args.no_end, jitter=args.jitter, burst_every=args.burst_every,
+                                 burst_size=args.burst_size, drop_frames=args.drop, seed=args.seed)
+
+    # The driver terminates FicTrac once it gets END, that is a normal exit for us.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    print("Publishing {} frames on {}".format(len(publisher.messages), publisher.endpoint))
+    sys.stdout.flush()
+    publisher.run()
+    print("Published {} frames at {:.1f} Hz, max lateness {:.1f} us".format(
+        publisher.num_sent, publisher.achieved_rate or 0.0, publisher.max_lateness * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,8 @@
-import numpy as np
 import ctypes
+import struct
+
+import numpy as np
+
 
 class FicTracState(ctypes.Structure):
     """
@@ -27,45 +30,177 @@ class FicTracState(ctypes.Structure):
         ('alt_timestamp', ctypes.c_double),
     ]
 
+    @classmethod
+    def _message_layout(cls):
+        """
+        Work out how the flat list of values in a FicTrac message maps onto the memory layout of this structure. This
+        is done once per class and cached, the result is a struct.Struct that packs the values with the same native
+        alignment ctypes uses, the indices of the values that must be packed as integers, the total number of
+        values expected in a message, and the (field name, first value index, number of values) of each field.
+
+        :return: A tuple of (struct.Struct, tuple of integer value indices, number of values, field columns)
+        """
+
+        # Look in the class dictionary directly, we don't want a subclass picking up the layout of its parent.
+        layout = cls.__dict__.get('_msg_layout')
+        if layout is not None:
+            return layout
+
+        fmt = '@'
+        int_indices = []
+        field_columns = []
+        num_values = 0
+        for field_name, field_type in cls._fields_:
+
+            # Array fields (the 3-vectors) have a length and an element type, scalars are just a simple type.
+            length = getattr(field_type, '_length_', 1)
+            elem_code = field_type._type_._type_ if hasattr(field_type, '_length_') else field_type._type_
+
+            fmt = fmt + str(length) + elem_code
+            if elem_code in 'bBhHiIlLqQ':
+                int_indices.extend(range(num_values, num_values + length))
+            field_columns.append((field_name, num_values, length))
+            num_values = num_values + length
+
+        # struct doesn't add trailing padding, ctypes does. Make sure the packed size matches the structure.
+        packer = struct.Struct(fmt)
+        if packer.size < ctypes.sizeof(cls):
+            packer = struct.Struct(fmt + str(ctypes.sizeof(cls) - packer.size) + 'x')
+
+        layout = (packer, tuple(int_indices), num_values, tuple(field_columns))
+        cls._msg_layout = layout
+
+        return layout
+
+    @classmethod
+    def _zmq_string_msg_values(cls, data):
+        """
+        Convert a zero MQ string message to the flat list of values to pack into the structure.
+
+        :param data: The raw string message received from the zero MQ socket.
+        :return: A tuple of (struct.Struct, list of values)
+        """
+
+        packer, int_indices, num_fictrac_fields, _ = cls._message_layout()
+
+        # Parse the string, float() doesn't care about the whitespace around each value.
+        values = data.split(',')
+
+        if len(values) != num_fictrac_fields:
+            raise ValueError("Message from FicTrac did not have appropriate number of fields.")
+
+        values = list(map(float, values))
+        for i in int_indices:
+            values[i] = int(values[i])
+
+        return packer, values
+
     @classmethod
     def zmq_string_msg_to_state(cls, data):
         """
         A simpe functiont that parses a zero MQ string message and converts it to our
-        fic trac state data structure.
+        fic trac state data structure. The values are converted in a single pass and packed straight into the memory
+        layout of the structure, no per field attribute access is done.
 
         :param data: The raw string message received from the zero MQ socket.
         :return: The FicTracState structure with values corresponding to data.
         """
+        packer, values = cls._zmq_string_msg_values(data)
+        return cls.from_buffer_copy(packer.pack(*values))
 
-        # The number of FicTrac fields in the output file
-        num_fictrac_fields = 25
+    def update_from_zmq_string_msg(self, data):
+        """
+        Parse a zero MQ string message into this existing structure, in place. No new state is allocated, this is the
+        in place version of zmq_string_msg_to_state.
 
-        # Create a FicTrac state object\structure
-        fstate = cls()
+        :param data: The raw string message received from the zero MQ socket.
+        :return: self
+        """
+        packer, values = self._zmq_string_msg_values(data)
+        packer.pack_into(self, 0, *values)
+        return self
 
-        # Parse the string
-        values = [x.strip() for x in data.split(',')]
+    def snapshot(self):
+        """
+        Get a copy of this state that is safe to keep around and modify.
 
-        if len(values) != num_fictrac_fields:
-            raise ValueError("Message from FicTrac did not have appropriate number of fields.")
+        :return: A new FicTracState with the same values.
+        """
+        return FicTracState.from_buffer_copy(self)
+
+    def to_zmq_string_msg(self):
+        """
+        Format this state as a zero MQ string message, the same comma separated format FicTrac sends. This is the
+        inverse of zmq_string_msg_to_state.
+
+        :return: The message string.
+        """
+        packer = self._message_layout()[0]
+        return ", ".join(map(str, packer.unpack_from(self)))
+
+    @classmethod
+    def np_dtype(cls):
+        """
+        Get a numpy structured dtype that mirrors _fields_, with the same field offsets and item size as the ctypes
+        structure. Arrays of this dtype can be filled from, or viewed as, FicTracState memory directly.
+
+        :return: The numpy.dtype for this structure.
+        """
+        dtype = cls.__dict__.get('_np_dtype')
+        if dtype is None:
+            dtype = np.dtype(cls)
+            cls._np_dtype = dtype
+
+        return dtype
+
+    @classmethod
+    def zmq_string_msgs_to_array(cls, messages):
+        """
+        Parse many zero MQ string messages at once into a numpy structured array of np_dtype(). All the messages are
+        converted in one vectorized pass, no FicTracState objects are created. This is useful for catching up on a
+        backlog of messages, replaying, or offline analysis.
+
+        :param messages: A list or iterable of raw string (or bytes) messages, as received from the zero MQ socket.
+        :return: A numpy structured array with one element per message.
+        """
+
+        _, _, num_fictrac_fields, field_columns = cls._message_layout()
+
+        messages = list(messages)
+        num_msgs = len(messages)
 
-        # Convert strings to appropriate types and assign fields
-        i = 0
-        for field_name, field_type in fstate._fields_:
-            field = getattr(fstate, field_name)
-            if (isinstance(field, float) ):
-                setattr(fstate, field_name, float(values[i]))
-                i = i + 1
-            elif (isinstance(field, int)):
-                setattr(fstate, field_name, int(values[i]))
-                i = i + 1
-            elif len(field) == 3:
-                field[0] = float(values[i])
-                field[1] = float(values[i+1])
-                field[2] = float(values[i+2])
-                i = i + 3
-
-        return fstate
+        out = np.zeros(num_msgs, dtype=cls.np_dtype())
+        if num_msgs == 0:
+            return out
+
+        sep = b',' if isinstance(messages[0], bytes) else ','
+
+        # Check each message on its own, extra fields in one message and missing ones in another would add up to the
+        # right total.
+        for i, msg in enumerate(messages):
+            if msg.count(sep) != num_fictrac_fields - 1:
+                raise ValueError("Message {} from FicTrac did not have appropriate number of fields.".format(i))
+
+        # numpy converts the strings with float(), which doesn't care about the whitespace around each value.
+        values = np.array(sep.join(messages).split(sep), dtype=np.float64)
+        values = values.reshape(num_msgs, num_fictrac_fields)
+
+        for field_name, start, length in field_columns:
+            if length == 1:
+                out[field_name] = values[:, start]
+            else:
+                out[field_name] = values[:, start:start+length]
+
+        return out
+
+    def to_np_view(self):
+        """
+        Get a zero copy view of this structure as a numpy structured array of np_dtype(). The view shares memory with
+        the structure, changes to one are seen by the other.
+
+        :return: A numpy structured array with a single element.
+        """
+        return np.frombuffer(self, dtype=self.np_dtype())
 
     def to_np_array(self):
         """
@@ -73,32 +208,8 @@ class FicTracState(ctypes.Structure):
 
         :return: The fic trace state as a simply 1D numpy.array
         """
-        return np.array([self.frame_cnt,
-                         self.del_rot_cam_vec[0],
-                         self.del_rot_cam_vec[1],
-                         self.del_rot_cam_vec[2],
-                         self.del_rot_error,
-                         self.del_rot_lab_vec[0],
-                         self.del_rot_lab_vec[1],
-                         self.del_rot_lab_vec[2],
-                         self.abs_ori_cam_vec[0],
-                         self.abs_ori_cam_vec[1],
-                         self.abs_ori_cam_vec[2],
-                         self.abs_ori_lab_vec[0],
-                         self.abs_ori_lab_vec[1],
-                         self.abs_ori_lab_vec[2],
-                         self.posx,
-                         self.posy,
-                         self.heading,
-                         self.direction,
-                         self.speed,
-                         self.intx,
-                         self.inty,
-                         self.timestamp,
-                         self.seq_num,
-                         self.delta_timestamp,
-                         self.alt_timestamp
-                         ])
+        packer = self._message_layout()[0]
+        return np.array(packer.unpack_from(self), dtype=np.float64)
 
     def __repr__(self):
         return "FicTracState({})".format(self.__str__())
@@ -117,4 +228,19 @@ class FicTracState(ctypes.Structure):
             else:
                 state_string = state_string + str(field[0]) + "\t" + str(field[1]) + "\t" + str(field[2]) + "\t"
 
-        return(state_string)
\ No newline at end of file
+        return(state_string)
+
+
+class FicTracStateView(FicTracState):
+    """
+    A read-only FicTracState. The driver can reuse a couple of these preallocated states for every message instead of
+    allocating a new one per frame. Callbacks get a view that will be overwritten with a later frame, so the fields
+    can't be assigned to. Call snapshot() to get a copy to keep. Note, the 3 element vector fields can't be protected
+    this way, don't write to them either.
+    """
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FicTracStateView is read-only, use snapshot() to get a copy that can be modified.")
+
+    def __repr__(self):
+        return "FicTracStateView({})".format(self.__str__())
@@ -0,0 +1,185 @@
+class DeadlineWatchdog:
+    """
+    Keeps an eye on whether frames are processed in time. Each frame's deadline is FicTrac's frame period, worked out
+    from the delta_timestamp of the frames, a frame is on time if it is processed before the next one arrives. For
+    each frame the watchdog records how late it was (negative if it was early), keeping an exponentially weighted
+    moving average (EWMA) and the maximum, and counts the frames that missed their deadline. It also tracks how far
+    behind FicTrac we are, by comparing how much time has passed for FicTrac (its timestamps) and for us since the
+    frame we were least behind on. This lag is a clock offset, in seconds, not a count of messages. Divided by the
+    frame period it is the backlog, the number of frames FicTrac has sent that we haven't got to yet.
+
+    The run is overloaded when frames are late on average (the lateness EWMA is above zero) and at least
+    min_misses frames in a row missed their deadline, or the lag is over max_lag. A single long stall, a garbage
+    collection or a disk flush, can push the average up on its own, but the frames after it catch up on time and
+    it doesn't overload the run. What happens when the run is overloaded is up to the policy:
+
+        'warn' - Print a warning.
+        'shed' - Print a warning and ask the callback to shed load, see PyBMTCallback.shed_load. Once the run has
+                 caught up, the callback is told it can stop shedding.
+        'stop' - Stop the run with an error.
+    """
+
+    POLICIES = ('warn', 'shed', 'stop')
+
+    def __init__(self, policy='warn', deadline=None, max_lag=None, ewma_alpha=0.05, warmup_frames=100, min_misses=5):
+        """
+        :param str policy: What to do when the run is overloaded, one of POLICIES. Default is 'warn'.
+        :param float deadline: The time, in seconds, each frame must be processed in. None, the default, uses FicTrac's
+        frame period.
+        :param float max_lag: How far, in seconds, we can fall behind FicTrac before the run is overloaded. None for no
+        limit.
+        :param float ewma_alpha: The weight of each new frame in the lateness and frame period averages.
+        :param int warmup_frames: The number of frames at the start that can't overload the run, while things settle.
+        :param int min_misses: The number of deadline misses in a row it takes for late frames to overload the run.
+        """
+        if policy not in self.POLICIES:
+            raise ValueError("Unknown watchdog policy '{}', must be one of {}.".format(policy, self.POLICIES))
+
+        self.policy = policy
+        self.deadline = deadline
+        self.max_lag = max_lag
+        self.ewma_alpha = ewma_alpha
+        self.warmup_frames = warmup_frames
+        self.min_misses = min_misses
+
+        # How many times faster than FicTrac's timestamps say frames arrive. The replay driver sets this to its speed.
+        self.time_scale = 1.0
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forget everything, the driver calls this at the start of each run.
+
+        :return: None
+        """
+        self.num_frames = 0
+        self.num_misses = 0
+        self.consecutive_misses = 0
+
+        # FicTrac's frame period, in seconds, averaged over delta_timestamp.
+        self.frame_period = None
+
+        # How late frames are, in seconds, and the frame that was latest.
+        self.ewma_lateness = 0.0
+        self.max_lateness = None
+        self.max_lateness_frame = None
+
+        # How far behind FicTrac we are, in seconds, and in frames. The smallest difference seen between our clock
+        # and FicTrac's is taken as not behind at all.
+        self.lag = 0.0
+        self.max_lag_seen = 0.0
+        self.backlog = 0.0
+        self.max_backlog = 0.0
+        self._min_clock_offset = None
+
+        self.overloaded = False
+        self.num_overloads = 0
+
+    def check(self, fstate, t_arrival, t_done, callback=None):
+        """
+        Record the timing of a processed frame and apply the policy if the run has become overloaded, or caught up.
+
+        :param fstate: The frame's FicTracState.
+        :param float t_arrival: The time.perf_counter() when the frame's message arrived.
+        :param float t_done: The time.perf_counter() when the frame was done.
+        :param callback: The callback to ask to shed load, with the 'shed' policy.
+        :return: 'stop' if the run should be stopped, None otherwise.
+        """
+        self.num_frames = self.num_frames + 1
+        alpha = self.ewma_alpha
+
+        # FicTrac's timestamps are in milliseconds
+        ms = 1000.0 * self.time_scale
+        dt = fstate.delta_timestamp / ms
+        if dt > 0:
+            if self.frame_period is None:
+                self.frame_period = dt
+            else:
+                self.frame_period = self.frame_period + alpha * (dt - self.frame_period)
+
+        deadline = self.deadline if self.deadline is not None else self.frame_period
+        if deadline is None:
+            return None
+
+        lateness = (t_done - t_arrival) - deadline
+        self.ewma_lateness = self.ewma_lateness + alpha * (lateness - self.ewma_lateness)
+        if lateness > 0:
+            self.num_misses = self.num_misses + 1
+            self.consecutive_misses = self.consecutive_misses + 1
+        else:
+            self.consecutive_misses = 0
+        if self.max_lateness is None or lateness > self.max_lateness:
+            self.max_lateness = lateness
+            self.max_lateness_frame = fstate.frame_cnt
+
+        clock_offset = t_done - fstate.timestamp / ms
+        if self._min_clock_offset is None or clock_offset < self._min_clock_offset:
+            self._min_clock_offset = clock_offset
+        self.lag = clock_offset - self._min_clock_offset
+        if self.lag > self.max_lag_seen:
+            self.max_lag_seen = self.lag
+        if self.frame_period:
+            self.backlog = self.lag / self.frame_period
+            if self.backlog > self.max_backlog:
+                self.max_backlog = self.backlog
+
+        if self.num_frames <= self.warmup_frames:
+            return None
+
+        lagging = self.max_lag is not None and self.lag > self.max_lag
+        late = self.ewma_lateness > 0 and self.consecutive_misses >= self.min_misses
+        if not self.overloaded:
+            if late or lagging:
+                self.overloaded = True
+                self.num_overloads = self.num_overloads + 1
+                return self._on_overload(fstate, callback)
+
+        # Only call it over once we are on time again and well clear of the lag limit.
+        elif self.ewma_lateness <= 0 and (self.max_lag is None or self.lag <= self.max_lag / 2):
+            self.overloaded = False
+            if self.policy == 'shed' and callback is not None:
+                callback.shed_load(False)
+
+        return None
+
+    def _on_overload(self, fstate, callback):
+        if self.policy == 'stop':
+            return 'stop'
+
+        print("Warning: processing is falling behind FicTrac at frame {}. {}".format(fstate.frame_cnt,
+                                                                                    self.describe()))
+        if self.policy == 'shed' and callback is not None:
+            callback.shed_load(True)
+
+        return None
+
+    def stats(self):
+        """
+        :return: A dict of the watchdog's statistics, times in seconds.
+        """
+        return {'frames': self.num_frames,
+                'deadline_misses': self.num_misses,
+                'frame_period': self.frame_period,
+                'ewma_lateness': self.ewma_lateness,
+                'max_lateness': self.max_lateness,
+                'max_lateness_frame': self.max_lateness_frame,
+                'lag': self.lag,
+                'max_lag': self.max_lag_seen,
+                'backlog': self.backlog,
+                'max_backlog': self.max_backlog,
+                'overloads': self.num_overloads}
+
+    def describe(self):
+        """
+        :return: A one line summary of the statistics.
+        """
+        s = self.stats()
+        if s['max_lateness'] is None:
+            return "No frame deadlines checked."
+
+        frame_rate = 1.0 / s['frame_period'] if s['frame_period'] else float('nan')
+        return ("{} of {} frames missed their deadline (FicTrac at {:.1f} fps), average lateness {:.2f} ms, " +
+                "max lateness {:.2f} ms at frame {}, max lag {:.1f} ms ({:.1f} frames).").format(
+            s['deadline_misses'], s['frames'], frame_rate, s['ewma_lateness'] * 1000, s['max_lateness'] * 1000,
+            s['max_lateness_frame'], s['max_lag'] * 1000, s['max_backlog'])
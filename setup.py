@@ -3,18 +3,21 @@ from setuptools import setup, find_packages
 setup(
     name='pybmt',
     version='0.1.0',
-    python_requires='>3.6',
+    python_requires='>=3.8',
     description='Python Ball Motion Tracking (pymbt): A python interface for closed loop fictrac (https://github.com/rjdmoore/fictrac)',
     author='David Turner',
     author_email='dmturner@princeton.edu',
     license='Creative Commons Attribution-NonCommercial-ShareAlike 3.0 Unported License',
     keywords='fictive, tracking, animal tracking, webcamera, sphere, closed loop',
     url="https://github.com/murthylab/pybmt",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     install_requires=[
         'pyzmq',
         'numpy',
         'matplotlib',
         'pytest'],
+    entry_points={
+        'console_scripts': ['pybmt-fictrac-sim=pybmt.fictrac.simulator:main'],
+    },
     zip_safe=False
 )
\ No newline at end of file
@@ -0,0 +1,24 @@
+import json
+
+from benchmarks.__main__ import main
+from benchmarks.suite import BENCHMARKS
+
+
+def test_benchmark_suite(tmpdir, capsys):
+    output = str(tmpdir.join("results.json"))
+
+    assert main(["--frames", "200", "--output", output]) == 0
+
+    with open(output) as f:
+        report = json.load(f)
+
+    assert report['frames'] == 200
+    assert set(report['results'].keys()) == set(BENCHMARKS.keys())
+    for name, result in report['results'].items():
+        assert result['frames'] == 200
+        assert result['fps'] > 0
+        assert 0 <= result['p50_us'] <= result['p99_us'] <= result['max_us']
+
+    # Comparing against itself is never a regression
+    assert main(["--frames", "200", "to_np_array", "--compare", output, "--tolerance", "10"]) == 0
+    assert "Compared to" in capsys.readouterr().out
@@ -0,0 +1,150 @@
+import contextlib
+import io
+import sys
+import threading
+import types
+
+import pytest
+
+from pybmt.callback.actions import ActionExecutor
+from pybmt.callback.threshold_callback import ThresholdCallback
+from pybmt.fictrac.state import FicTracState
+
+
+def test_submit_and_records():
+    actions = ActionExecutor().start()
+    futures = [actions.submit(lambda x: x * 2, i, frame_cnt=i) for i in range(5)]
+    assert [f.result(timeout=5) for f in futures] == [0, 2, 4, 6, 8]
+
+    actions.shutdown()
+    assert [r.frame_cnt for r in actions.records] == [0, 1, 2, 3, 4]
+    assert all(r.t_submit <= r.t_start <= r.t_end for r in actions.records)
+    assert actions.start_latency.count == 5
+
+
+def test_submit_not_running():
+    actions = ActionExecutor()
+    with pytest.raises(RuntimeError, match="not started"):
+        actions.submit(print)
+
+    actions.start().shutdown()
+    with pytest.raises(RuntimeError, match="not started"):
+        actions.submit(print)
+    assert actions.records == []
+
+
+def test_single_worker_runs_in_order():
+    ran = []
+    actions = ActionExecutor().start()
+    for i in range(20):
+        actions.submit(ran.append, i)
+    actions.shutdown(wait=True)
+    assert ran == list(range(20))
+
+
+def test_coalesce_and_errors():
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+        return 'block'
+
+    def fail():
+        raise ValueError("no cameras")
+
+    actions = ActionExecutor(max_queued=2).start()
+    running = actions.submit(block, key='record', frame_cnt=1)
+    started.wait(5)
+
+    # The running action doesn't coalesce the next one, but that one, while waiting, coalesces the rest
+    waiting = actions.submit(block, key='record', frame_cnt=2)
+    assert waiting is not running
+    assert actions.submit(block, key='record', frame_cnt=3) is waiting
+    assert actions.num_coalesced == 1
+
+    failed = actions.submit(fail, frame_cnt=4)
+
+    # The queue is full, submitting doesn't block, the action fails straight away. If it did block, it would be until
+    # the backstop timer let the running action finish.
+    backstop = threading.Timer(5, release.set)
+    backstop.start()
+    rejected = actions.submit(fail, frame_cnt=5)
+    assert not release.is_set()
+    backstop.cancel()
+    with pytest.raises(RuntimeError):
+        rejected.result(timeout=0)
+
+    release.set()
+    assert running.result(timeout=5) == 'block'
+    assert waiting.result(timeout=5) == 'block'
+    with pytest.raises(ValueError):
+        failed.result(timeout=5)
+
+    actions.shutdown()
+    assert actions.num_rejected == 1
+    assert [r.frame_cnt for r in actions.errors] == [5, 4]
+    assert "ValueError: no cameras" in actions.report()
+
+
+def test_shutdown_cancels():
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    actions = ActionExecutor().start()
+    actions.submit(block)
+    pending = actions.submit(lambda: None, frame_cnt=7)
+
+    # The worker is running the first action, the second is still waiting when we shutdown, and cancelling it lets the
+    # first finish.
+    started.wait(5)
+    pending.add_done_callback(lambda future: release.set())
+    actions.shutdown(wait=False)
+    assert pending.cancelled()
+    assert actions.records[0].frame_cnt == 7 and actions.records[0].t_start is None
+
+
+def test_threshold_callback_doesnt_block(monkeypatch):
+    recorded = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def all_cameras_record(arduino, cam_array):
+        started.set()
+        release.wait(5)
+        recorded.append(cam_array)
+
+    monkeypatch.setitem(sys.modules, 'basler', types.SimpleNamespace(all_cameras_record=all_cameras_record))
+
+    callback = ThresholdCallback(speed_threshold=0.009, num_frames_mean=1, cameras=['cam0'])
+    callback.setup_callback()
+
+    states = []
+    for i, speed in enumerate([0.0, 0.01, 0.0, 0.01, 0.0, 0.01]):
+        s = FicTracState()
+        s.frame_cnt = i + 1
+        s.speed = speed
+        states.append(s)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for s in states[:2]:
+            callback.process_callback(s)
+        started.wait(5)
+        for s in states[2:]:
+            callback.process_callback(s)
+
+        # The callback returned while the first recording was still running
+        assert recorded == []
+        release.set()
+
+        callback.shutdown_callback()
+
+    # The first recording was running, the second waiting, and the third coalesced with it
+    assert recorded == [['cam0'], ['cam0']]
+    assert [r.frame_cnt for r in callback.actions.records] == [2, 4]
+    assert callback.actions.num_coalesced == 1
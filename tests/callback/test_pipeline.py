@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.callback.pipeline import CallbackPipeline, PipelineStage
+from pybmt.fictrac.replay import ReplayDriver
+from pybmt.fictrac.state import FicTracState
+
+
+class StageCallback(PyBMTCallback):
+    """
+    Records what it was called with and on which thread, optionally sleeping to take up time.
+    """
+    def __init__(self, log, name, sleep=0.0, stop_at=None):
+        self.log = log
+        self.name = name
+        self.sleep = sleep
+        self.stop_at = stop_at
+
+    def setup_callback(self):
+        self.log.append((self.name, 'setup'))
+        self.frames = []
+        self.gaps = []
+        self.threads = set()
+
+    def process_callback(self, track_state):
+        if self.sleep > 0:
+            time.sleep(self.sleep)
+        self.frames.append(track_state.frame_cnt)
+        self.threads.add(threading.current_thread().name)
+        return self.stop_at is None or track_state.frame_cnt < self.stop_at
+
+    def process_gap(self, first_frame, last_frame):
+        self.gaps.append((first_frame, last_frame))
+
+    def shutdown_callback(self):
+        self.log.append((self.name, 'shutdown'))
+
+
+def make_state(frame_cnt):
+    state = FicTracState()
+    state.frame_cnt = frame_cnt
+    return state
+
+
+def test_pipeline_order_and_budgets(capsys):
+    log = []
+    fast = StageCallback(log, 'fast')
+    slow = StageCallback(log, 'slow', sleep=0.002)
+    logger = StageCallback(log, 'logger', sleep=0.001)
+
+    pipeline = CallbackPipeline([fast, PipelineStage(slow, name='slow', budget=0.001)])
+    pipeline.add_stage(logger, name='logger', deferred=True)
+
+    pipeline.setup_callback()
+    for i in range(1, 11):
+        assert pipeline.process_callback(make_state(i))
+    assert pipeline.process_gap(11, 12)
+    assert pipeline.process_callback(make_state(13))
+    pipeline.shutdown_callback()
+
+    assert log == [('fast', 'setup'), ('slow', 'setup'), ('logger', 'setup'),
+                   ('logger', 'shutdown'), ('slow', 'shutdown'), ('fast', 'shutdown')]
+
+    # Everyone sees every frame, the deferred stage on the worker thread
+    frames = list(range(1, 11)) + [13]
+    assert fast.frames == slow.frames == logger.frames == frames
+    assert fast.gaps == logger.gaps == [(11, 12)]
+    assert logger.threads == {"pybmt-pipeline"}
+    assert "pybmt-pipeline" not in fast.threads
+
+    stats = {s['name']: s for s in pipeline.stage_stats()}
+    assert list(stats.keys()) == ['StageCallback', 'slow', 'logger']
+    assert stats['StageCallback']['overruns'] == 0
+    assert stats['slow']['count'] == 12
+    assert stats['slow']['overruns'] == 11
+    assert stats['slow']['last_overrun_frame'] == 13
+    assert stats['logger']['deferred'] and stats['logger']['count'] == 12
+
+    assert "Callback pipeline stages" in capsys.readouterr().out
+
+
+def test_pipeline_stop():
+    log = []
+    first = StageCallback(log, 'first', stop_at=3)
+    second = StageCallback(log, 'second')
+    pipeline = CallbackPipeline([first, second])
+
+    pipeline.setup_callback()
+    assert pipeline.process_callback(make_state(2))
+    assert not pipeline.process_callback(make_state(3))
+    pipeline.shutdown_callback()
+
+    # All the stages still ran for the frame that stopped things
+    assert second.frames == [2, 3]
+
+
+def test_pipeline_deferred_drops():
+    log = []
+    slow = StageCallback(log, 'slow', sleep=0.01)
+    pipeline = CallbackPipeline(deferred_queue_size=2)
+    pipeline.add_stage(slow, deferred=True)
+
+    pipeline.setup_callback()
+    for i in range(1, 21):
+        pipeline.process_callback(make_state(i))
+    pipeline.shutdown_callback()
+
+    assert pipeline.num_deferred_dropped > 0
+    assert len(slow.frames) + pipeline.num_deferred_dropped == 20
+
+
+class FailingCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        raise ValueError("bad stage")
+
+
+def test_pipeline_deferred_failure():
+    pipeline = CallbackPipeline(deferred_queue_size=1)
+    pipeline.add_stage(FailingCallback(), deferred=True)
+    pipeline.setup_callback()
+
+    with pytest.raises(Exception) as excinfo:
+        for i in range(1, 100):
+            pipeline.process_callback(make_state(i))
+            time.sleep(0.001)
+    assert isinstance(excinfo.value.__cause__, ValueError)
+
+    pipeline.shutdown_callback()
+
+
+def test_pipeline_replay(dat_file):
+    log = []
+    inline = StageCallback(log, 'inline')
+    deferred = StageCallback(log, 'deferred')
+    pipeline = CallbackPipeline(deferred_queue_size=1000)
+    pipeline.add_stage(inline)
+    pipeline.add_stage(deferred, deferred=True)
+
+    replay = ReplayDriver(dat_file, track_change_callback=pipeline, reuse_state=True)
+    replay.run()
+
+    # The deferred stage got copies, not the driver's reused states
+    assert inline.frames == deferred.frames == list(replay.states['frame_cnt'])
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.callback.process_pool import ProcessPoolCallback
+from pybmt.fictrac.replay import ReplayDriver
+
+
+class SumCallback(PyBMTCallback):
+    """
+    Sums the speed over every block of frames in the worker process and sends back the sum.
+    """
+    def __init__(self, block=100):
+        self.block = block
+
+    def setup_callback(self):
+        self.total = 0.0
+        self.count = 0
+
+    def process_callback(self, track_state):
+        self.total = self.total + track_state.speed
+        self.count = self.count + 1
+        if self.count % self.block == 0:
+            return self.total
+        return True
+
+
+class StopCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        return track_state.frame_cnt < 50
+
+
+class FailCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        if track_state.frame_cnt == 20:
+            raise ValueError("bad frame")
+        return True
+
+
+def test_process_pool_results(dat_file):
+    pool = ProcessPoolCallback([SumCallback(), SumCallback(block=200)], ring_capacity=1024)
+    replay = ReplayDriver(dat_file, track_change_callback=pool)
+    replay.run()
+
+    speed = np.cumsum(replay.states['speed'])
+    results = sorted(pool.results)
+    assert [(i, f) for i, f, r in results] == [(0, 99), (0, 199), (0, 299), (0, 399), (0, 499), (0, 599),
+                                               (1, 199), (1, 399), (1, 599)]
+    for i, frame_cnt, total in results:
+        assert np.isclose(total, speed[frame_cnt])
+
+    assert pool.num_missed == {0: 0, 1: 0}
+    assert pool.worker_errors == {}
+
+
+def test_process_pool_stop(dat_file):
+    pool = ProcessPoolCallback([StopCallback()])
+    replay = ReplayDriver(dat_file, track_change_callback=pool, realtime=True, speed=20.0)
+    replay.run()
+
+    # The stop is seen by the driver a few frames later, how many depends on how quickly the worker keeps up
+    assert 50 < replay.frame_cnt < 600
+
+
+def test_process_pool_worker_error(capsys, dat_file):
+    pool = ProcessPoolCallback([FailCallback()])
+    replay = ReplayDriver(dat_file, track_change_callback=pool, realtime=True, speed=20.0)
+
+    with pytest.raises(Exception) as excinfo:
+        replay.run()
+
+    assert "bad frame" in str(excinfo.value.__cause__)
+    assert "ValueError: bad frame" in pool.worker_errors[0]
@@ -0,0 +1,146 @@
+import contextlib
+import io
+import types
+
+import pytest
+
+import pybmt.callback.profiling
+from pybmt.callback.base import PyBMTCallback
+from pybmt.callback.pipeline import CallbackPipeline
+from pybmt.callback.profiling import NO_SECTION, CallbackProfiler
+from pybmt.fictrac.replay import ReplayDriver
+
+SLOW_FRAMES = (100, 250, 400)
+
+
+class FakeClock:
+    """
+    Stands in for time.perf_counter in the profiler, time only passes when the test says so.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def busy_wait(self, seconds):
+        self.now = self.now + seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pybmt.callback.profiling, 'time', types.SimpleNamespace(perf_counter=clock))
+    return clock
+
+
+class StimulusCallback(PyBMTCallback):
+    """
+    A callback whose stimulus is slow on a few frames.
+    """
+
+    def __init__(self, clock=None):
+        super(StimulusCallback, self).__init__()
+        self.clock = clock
+
+    def setup_callback(self):
+        self.num_frames = 0
+
+    def process_callback(self, track_state):
+        self.num_frames = self.num_frames + 1
+        if track_state.frame_cnt in SLOW_FRAMES:
+            with self.profile_section('stimulus'):
+                self.clock.busy_wait(0.01)
+        return True
+
+
+def test_profiler_slowest_frames_and_sections(clock):
+    profiler = CallbackProfiler(num_worst=3, profile_interval=10, num_profiles=2)
+    section = profiler.section('analysis')
+    assert profiler.section('analysis') is section
+
+    # Time spent in the analysis section, and in the rest of the frame, for the slow frames
+    slow = {13: (0.002, 0.001), 50: (0.002, 0.004), 77: (0.003, 0.002)}
+    for frame in range(100):
+        profiler.begin_frame(frame, parse_time=1e-6)
+        in_section, after_section = slow.get(frame, (0.0, 0.0))
+        with section:
+            clock.busy_wait(in_section)
+        clock.busy_wait(after_section)
+        assert profiler.end_frame() == pytest.approx(in_section + after_section)
+
+    assert profiler.num_frames == 100
+    assert profiler.timings['process_callback'].count == 100
+    assert profiler.timings['parse'].count == 100
+    assert profiler.timings['analysis'].count == 100
+    assert profiler.timings['analysis'].total == pytest.approx(0.007)
+    assert profiler.timings['process_callback'].max == pytest.approx(0.006)
+
+    slowest = profiler.slowest_frames()
+    assert slowest == [(pytest.approx(0.006), 50, 1e-6, {'analysis': pytest.approx(0.002)}),
+                       (pytest.approx(0.005), 77, 1e-6, {'analysis': pytest.approx(0.003)}),
+                       (pytest.approx(0.003), 13, 1e-6, {'analysis': pytest.approx(0.002)})]
+
+    # Frames 0, 10, 20, ... were profiled, frame 50 was the slowest of them
+    assert len(profiler.profiles) == 2
+    report = profiler.report()
+    assert "Profile of frame 50" in report
+    assert "busy_wait" in report
+
+    profiler.clear()
+    assert profiler.num_frames == 0 and profiler.slowest_frames() == []
+
+
+def test_profile_section_off():
+    callback = StimulusCallback()
+    assert callback.profiler is None
+    assert callback.profile_section('stimulus') is NO_SECTION
+    with callback.profile_section('stimulus'):
+        pass
+
+
+def test_replay_profile(tmpdir, clock, dat_file):
+    report_file = str(tmpdir.join("profile.txt"))
+    profiler = CallbackProfiler(num_worst=5, report_file=report_file)
+    callback = StimulusCallback(clock)
+    driver = ReplayDriver(dat_file, track_change_callback=callback, profile=profiler)
+
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        driver.run()
+
+    assert callback.profiler is profiler
+    assert profiler.num_frames == callback.num_frames == 600
+    for name in ('setup_callback', 'shutdown_callback', 'parse', 'process_callback'):
+        assert name in profiler.timings
+    assert profiler.timings['stimulus'].count == len(SLOW_FRAMES)
+
+    # The slow frames are the worst outliers, and the stimulus is where the time went
+    slowest = profiler.slowest_frames()[:len(SLOW_FRAMES)]
+    assert sorted(frame for _, frame, _, _ in slowest) == list(SLOW_FRAMES)
+    assert all(duration == sections['stimulus'] == pytest.approx(0.01) for duration, _, _, sections in slowest)
+    assert profiler.slowest_frames()[len(SLOW_FRAMES)][0] == 0.0
+
+    with open(report_file) as f:
+        report = f.read()
+    assert report.strip() == profiler.report().strip()
+    assert "Slowest frames" in out.getvalue()
+    for frame in SLOW_FRAMES:
+        assert "frame {:>8}".format(frame) in report
+
+    # Profiling is off unless asked for
+    assert ReplayDriver(dat_file, track_change_callback=StimulusCallback()).profiler is None
+
+
+def test_pipeline_passes_profiler_on():
+    inline = StimulusCallback()
+    deferred = StimulusCallback()
+    pipeline = CallbackPipeline()
+    pipeline.add_stage(inline)
+    pipeline.add_stage(deferred, deferred=True)
+
+    profiler = CallbackProfiler()
+    pipeline.enable_profiling(profiler)
+    assert pipeline.profiler is profiler
+    assert inline.profiler is profiler
+    assert deferred.profiler is None
@@ -0,0 +1,113 @@
+import contextlib
+import io
+
+import numpy as np
+import pytest
+
+from pybmt.callback.stats import (EWMA, RunningMean, RunningVariance, StateStats, WindowedMean, WindowedMedian,
+                                  WindowedMinMax)
+from pybmt.callback.threshold_callback import ThresholdCallback
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+values = np.random.RandomState(1).randn(1000) * 2.0 + 5.0
+
+
+def test_running_mean_variance():
+    mean = RunningMean()
+    var = RunningVariance(ddof=1)
+    assert mean.value is None
+    assert var.value is None
+
+    for x in values:
+        mean.update(x)
+        var.update(x)
+
+    assert mean.value == pytest.approx(values.mean())
+    assert var.mean == pytest.approx(values.mean())
+    assert var.variance == pytest.approx(values.var(ddof=1))
+    assert var.std == pytest.approx(values.std(ddof=1))
+
+    var.reset()
+    assert var.count == 0 and var.variance is None
+
+
+def test_ewma():
+    ewma = EWMA(span=9)
+    assert ewma.alpha == pytest.approx(0.2)
+
+    expected = values[0]
+    ewma.update(values[0])
+    for x in values[1:]:
+        expected = 0.8 * expected + 0.2 * x
+        assert ewma.update(x) == pytest.approx(expected)
+
+    with pytest.raises(ValueError):
+        EWMA()
+    with pytest.raises(ValueError):
+        EWMA(alpha=1.5)
+
+
+@pytest.mark.parametrize("window", [1, 7, 100])
+def test_windowed_mean_min_max(window):
+    mean = WindowedMean(window)
+    min_max = WindowedMinMax(window)
+    for i, x in enumerate(values):
+        in_window = values[max(0, i - window + 1):i + 1]
+        assert mean.update(x) == pytest.approx(in_window.mean())
+        assert min_max.update(x) == (in_window.min(), in_window.max())
+
+
+def test_windowed_median():
+    median = WindowedMedian(101, low=-5.0, high=15.0, num_bins=200)
+    assert median.value is None
+
+    for i, x in enumerate(values):
+        approx = median.update(x)
+        in_window = np.sort(values[max(0, i - 100):i + 1])
+        assert abs(approx - in_window[(len(in_window) - 1) // 2]) <= median.bin_width
+
+    # Reading the median doesn't change it
+    cursor = (median._median_bin, median._below)
+    assert median.value == median.value == approx
+    assert (median._median_bin, median._below) == cursor
+
+    # Values out of range land in the end bins
+    median = WindowedMedian(3, low=0.0, high=1.0, num_bins=10)
+    for x in [-10, -20, 30]:
+        median.update(x)
+    assert 0.0 <= median.value < 0.1
+
+
+def test_state_stats():
+    states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(200)]
+    stats = StateStats({'speed': [WindowedMean(25), WindowedMinMax(50)],
+                        'heading': EWMA(alpha=0.1)})
+    for s in states:
+        stats.update(s)
+
+    speed = np.array([s.speed for s in states])
+    assert stats['speed'][0].value == pytest.approx(speed[-25:].mean())
+    assert stats['speed'][1].value == (speed[-50:].min(), speed[-50:].max())
+    assert stats['heading'].value is not None
+
+    stats.reset()
+    assert stats['speed'][0].value is None
+    assert stats['heading'].value is None
+
+
+def test_threshold_callback():
+    states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(500)]
+    callback = ThresholdCallback(speed_threshold=0.01, num_frames_mean=25)
+    callback.setup_callback()
+
+    # The stimulus follows the average speed over the last 25 frames
+    speed = np.array([s.speed for s in states])
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i, s in enumerate(states):
+            callback.process_callback(s)
+            avg = speed[max(0, i - 24):i + 1].mean()
+            if abs(avg - 0.01) > 1e-12:
+                assert callback.is_signal_on == (avg > 0.01)
+
+    callback.shutdown_callback()
@@ -0,0 +1,121 @@
+import contextlib
+import io
+
+import pytest
+
+from pybmt.callback.stats import WindowedMean
+from pybmt.callback.threshold_callback import ThresholdCallback
+from pybmt.callback.triggers import Derived, Function, Threshold, Trigger, TriggerEngine
+from pybmt.fictrac.state import FicTracState
+
+
+def make_states(speeds, headings=None):
+    states = []
+    for i, speed in enumerate(speeds):
+        s = FicTracState()
+        s.frame_cnt = i + 1
+        s.speed = speed
+        s.heading = headings[i] if headings is not None else 0.0
+        states.append(s)
+    return states
+
+
+def run(engine, states):
+    """
+    Run the states through the engine, return the frames each trigger was on.
+    """
+    on = {t.name: [] for t in engine.triggers}
+    for s in states:
+        engine.update(s)
+        for name in on:
+            if engine.is_active(name):
+                on[name].append(s.frame_cnt)
+    return on
+
+
+def test_threshold_hysteresis():
+    speeds = [0, 5, 11, 9, 6, 11, 4, 9, 12]
+    plain = Trigger('plain', Threshold('speed', on=10))
+    hysteresis = Trigger('hysteresis', Threshold('speed', on=10, off=5))
+    below = Trigger('below', Threshold('speed', on=1, off=5, below=True))
+
+    on = run(TriggerEngine([plain, hysteresis, below]), make_states(speeds))
+    assert on['plain'] == [3, 6, 9]
+    assert on['hysteresis'] == [3, 4, 5, 6, 9]
+    assert on['below'] == [1, 2]
+
+    with pytest.raises(ValueError):
+        Threshold('speed', on=10, off=15)
+
+
+def test_dwell_and_refractory():
+    speeds = [20, 0, 20, 20, 20, 0, 20, 0, 0, 20, 20, 20, 20, 20]
+    dwell = Trigger('dwell', Threshold('speed', on=10), min_on_frames=3, min_off_frames=2)
+    refractory = Trigger('refractory', Threshold('speed', on=10), refractory_frames=3)
+
+    engine = TriggerEngine([dwell, refractory])
+    on = run(engine, make_states(speeds))
+
+    # One frame blips don't count, it takes 3 frames in a row to turn on and 2 to turn off.
+    assert on['dwell'] == [5, 6, 7, 8, 12, 13, 14]
+
+    # After turning off it can't turn on for 3 frames, off on frames 2 and 8 it can't turn on till 6 and 12.
+    assert on['refractory'] == [1, 7, 12, 13, 14]
+
+    assert [t for t in engine.transitions if t.trigger == 'dwell'] == [(5, 'dwell', True), (9, 'dwell', False),
+                                                                      (12, 'dwell', True)]
+
+
+def test_compound_conditions():
+    speeds = [0, 20, 20, 0, 20]
+    headings = [0, 0, 3, 3, 3]
+    fast = Threshold('speed', on=10)
+    turned = Threshold(Function(lambda s: s.heading), on=1)
+
+    on = run(TriggerEngine([Trigger('and', fast & turned), Trigger('or', fast | turned),
+                            Trigger('not', ~fast)]), make_states(speeds, headings))
+    assert on['and'] == [3, 5]
+    assert on['or'] == [2, 3, 4, 5]
+    assert on['not'] == [1, 4]
+
+
+def test_shared_signals_and_reset():
+    avg = Derived('speed', WindowedMean(2))
+    engine = TriggerEngine([Trigger('a', Threshold(avg, on=10)), Trigger('b', Threshold(avg, on=15))])
+    engine.compile()
+
+    # The derived signal is only updated once per frame, however many triggers use it
+    assert len(engine._getters) == 1
+    on = run(engine, make_states([20, 20, 0, 0]))
+    assert on == {'a': [1, 2, 3], 'b': [1, 2]}
+
+    engine.reset()
+    assert engine.transitions == []
+    assert not engine.is_active('a')
+    assert run(engine, make_states([0, 20]))['a'] == []
+
+    with pytest.raises(ValueError):
+        engine.add(Trigger('a', Threshold('speed', on=1)))
+
+
+def test_on_change():
+    changes = []
+    engine = TriggerEngine([Trigger('t', Threshold('speed', on=10), on_change=lambda t, s: changes.append(t))])
+    run(engine, make_states([0, 20, 0]))
+    assert changes == engine.transitions == [(2, 't', True), (3, 't', False)]
+
+
+def test_threshold_callback_hysteresis():
+    speeds = [0.01, 0.0095, 0.0085, 0.0095, 0.0075, 0.0095]
+    callback = ThresholdCallback(speed_threshold=0.009, speed_off_threshold=0.008, num_frames_mean=1)
+    callback.setup_callback()
+
+    signal = []
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        for s in make_states(speeds):
+            callback.process_callback(s)
+            signal.append(callback.is_signal_on)
+        callback.shutdown_callback()
+
+    assert signal == [True, True, True, True, False, True]
+    assert out.getvalue().count("Stimulus ON!") == 2
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+
+# A short FicTrac log, 600 frames, that the replay tests run through.
+DAT_FILE = os.path.join(os.path.dirname(__file__), "fictrac", "test_config_data", "output_file_ground_truth",
+                        "test.dat")
+
+
+class RecordingCallback(PyBMTCallback):
+    """
+    A callback that keeps a copy of every state it is given, and stops after stop_after states if it isn't None.
+    """
+    def __init__(self, stop_after=None):
+        self.stop_after = stop_after
+
+    def setup_callback(self):
+        self.states = []
+        self.is_shutdown = False
+
+    def process_callback(self, track_state):
+        self.states.append(track_state.snapshot())
+        return self.stop_after is None or len(self.states) < self.stop_after
+
+    def shutdown_callback(self):
+        self.is_shutdown = True
+
+
+@pytest.fixture
+def dat_file():
+    return DAT_FILE
+
+
+@pytest.fixture
+def dat_lines():
+    """
+    The lines of DAT_FILE, to write broken copies of it.
+    """
+    with open(DAT_FILE) as f:
+        return f.readlines()
+
+
+@pytest.fixture
+def recording_callback():
+    return RecordingCallback()
@@ -0,0 +1,70 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from pybmt.callback.base import AsyncPyBMTCallback
+from pybmt.fictrac.async_driver import AsyncFicTracDriver
+from pybmt.fictrac.simulator import FicTracPublisher, synthetic_states
+
+
+class AsyncRecordingCallback(AsyncPyBMTCallback):
+    """
+    Records the frames it sees, while a background task ticks along on the same event loop.
+    """
+    async def setup_callback(self):
+        self.frames = []
+        self.ticks = 0
+        self.ticker = asyncio.ensure_future(self.tick())
+
+    async def tick(self):
+        while True:
+            self.ticks = self.ticks + 1
+            await asyncio.sleep(0.001)
+
+    async def process_callback(self, track_state):
+        self.frames.append(track_state.frame_cnt)
+
+        # Yield to the event loop, like awaiting some I/O would.
+        await asyncio.sleep(0)
+        return True
+
+    async def shutdown_callback(self):
+        self.ticker.cancel()
+
+
+@pytest.mark.parametrize("binary_msgs", [False, True])
+def test_async_driver_simulated(binary_msgs):
+    states = synthetic_states(200)
+    publisher = FicTracPublisher(states, binary_msgs=binary_msgs, rate=500)
+
+    callback = AsyncRecordingCallback()
+    tracDrv = AsyncFicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                                 track_change_callback=callback, plot_on=False, binary_msgs=binary_msgs,
+                                 reuse_state=True, profile=True)
+    tracDrv.watchdog = None
+
+    publisher.start()
+    asyncio.run(tracDrv.run())
+    publisher.join()
+
+    assert tracDrv.frame_cnt == len(states)
+    assert np.array_equal(callback.frames, states['frame_cnt'])
+
+    # The background task got to run while we were tracking
+    assert callback.ticks > 10
+    assert callback.ticker.cancelled()
+
+    # The awaited entry points were profiled too
+    assert tracDrv.profiler.num_frames == len(states)
+    assert tracDrv.profiler.timings['setup_callback'].count == 1
+    assert tracDrv.profiler.timings['shutdown_callback'].count == 1
+
+
+def test_async_driver_no_publisher():
+    callback = AsyncRecordingCallback()
+    tracDrv = AsyncFicTracDriver(remote_endpoint_url="127.0.0.1:1", track_change_callback=callback, plot_on=False)
+    tracDrv.startup_timeout = 0.2
+
+    with pytest.raises(Exception, match="PyBMT Error"):
+        asyncio.run(tracDrv.run())
@@ -62,8 +62,8 @@ def test_driver_local():
     tracDrv = FicTracDriver(config_file=fictrac_config, console_ouput_file=fictrac_console_out,
                             track_change_callback=callback, plot_on=False)
 
-    # Disable average FPS check for this test.
-    tracDrv.average_fps_threshold = 0
+    # Disable the frame deadline watchdog for this test.
+    tracDrv.watchdog = None
 
     # This will start FicTrac and it will block until complete.
     tracDrv.run()
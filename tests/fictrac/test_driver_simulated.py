@@ -0,0 +1,323 @@
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pytest
+import zmq
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.receiver import MessageReceiver
+from pybmt.fictrac.simulator import FicTracPublisher, synthetic_states
+from pybmt.fictrac.state import FicTracState, FicTracStateView
+
+
+class SlowCallback(PyBMTCallback):
+    """
+    A callback that can't keep up, it holds on to the first state until the publisher has sent everything. It keeps the
+    frame counts it was given.
+    """
+    def __init__(self, publisher):
+        self.publisher = publisher
+
+    def setup_callback(self):
+        self.frames = []
+
+    def process_callback(self, track_state):
+        if not self.frames:
+            self.publisher.join(5)
+        self.frames.append(track_state.frame_cnt)
+        return True
+
+
+def run_simulated(states, callback, binary_msgs=False, rate=1000, **driver_args):
+    publisher = FicTracPublisher(states, binary_msgs=binary_msgs, rate=rate)
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=callback, plot_on=False, binary_msgs=binary_msgs, **driver_args)
+    tracDrv.watchdog = None
+
+    publisher.start()
+    tracDrv.run()
+    publisher.join()
+
+    return tracDrv, callback
+
+
+@pytest.mark.parametrize("binary_msgs", [False, True])
+@pytest.mark.parametrize("reuse_state", [False, True])
+def test_driver_simulated(binary_msgs, reuse_state, recording_callback):
+    states = synthetic_states(200)
+
+    tracDrv, callback = run_simulated(states, recording_callback, binary_msgs=binary_msgs, reuse_state=reuse_state)
+
+    assert callback.is_shutdown
+    assert tracDrv.frame_cnt == len(states)
+    received = np.concatenate([s.to_np_view() for s in callback.states])
+    assert np.array_equal(received['frame_cnt'], states['frame_cnt'])
+    assert np.allclose(received['speed'], states['speed'])
+    assert np.allclose(received['del_rot_lab_vec'], states['del_rot_lab_vec'])
+
+
+@pytest.mark.parametrize("binary_msgs", [False, True])
+def test_driver_receiver_thread(binary_msgs, recording_callback):
+    states = synthetic_states(200)
+
+    tracDrv, callback = run_simulated(states, recording_callback, binary_msgs=binary_msgs, reuse_state=True,
+                                      recv_queue_size=16)
+
+    assert tracDrv.frame_cnt == len(states)
+    assert tracDrv.num_dropped_frames == 0
+    assert [s.frame_cnt for s in callback.states] == list(states['frame_cnt'])
+
+
+@pytest.mark.parametrize("drop_policy", ['drop_oldest', 'conflate'])
+def test_driver_receiver_thread_drops(drop_policy):
+    states = synthetic_states(300)
+    publisher = FicTracPublisher(states, rate=1000)
+    callback = SlowCallback(publisher)
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port), track_change_callback=callback,
+                            plot_on=False, recv_queue_size=8, drop_policy=drop_policy)
+    tracDrv.watchdog = None
+
+    publisher.start()
+    tracDrv.run()
+    publisher.join()
+
+    # The callback couldn't keep up, frames were dropped but every frame is accounted for.
+    frames = callback.frames
+    assert tracDrv.num_dropped_frames > 0
+    assert tracDrv.frame_cnt + tracDrv.num_dropped_frames == len(states)
+    assert tracDrv.frame_cnt == len(frames)
+    assert sorted(frames) == frames
+
+    if drop_policy == 'conflate':
+        assert tracDrv._receiver.max_queue_depth == 1
+    else:
+        assert frames[-1] == states['frame_cnt'][-1]
+
+
+@pytest.mark.parametrize("drop_policy,rcvhwm", [('block', 8), ('drop_oldest', 0), ('conflate', 0)])
+def test_receiver_high_water_mark(drop_policy, rcvhwm):
+    class NoFicTrac:
+        def _connect(self, rcvhwm=1):
+            self.rcvhwm = rcvhwm
+            raise RuntimeError("No FicTrac here.")
+
+    # Blocking leaves messages waiting in zero MQ, it must not queue them up without limit.
+    driver = NoFicTrac()
+    receiver = MessageReceiver(driver, maxsize=8, drop_policy=drop_policy).start()
+    receiver.stop()
+    assert driver.rcvhwm == rcvhwm
+
+
+def test_driver_bad_drop_policy():
+    with pytest.raises(ValueError):
+        FicTracDriver(remote_endpoint_url="127.0.0.1:0", recv_queue_size=8, drop_policy='sometimes')
+
+
+def test_driver_time_to_first_frame(recording_callback):
+    tracDrv, callback = run_simulated(synthetic_states(50), recording_callback)
+    assert 0 < tracDrv.time_to_first_frame < 2.0
+
+
+def test_driver_fictrac_exits_at_startup(tmp_path, recording_callback):
+    # Python will fail to run the config file as a script, a stand-in for FicTrac failing to start.
+    config_file = tmp_path / "config.txt"
+    config_file.write_text("src_fn : test.mp4\n")
+
+    tracDrv = FicTracDriver(config_file=str(config_file), console_ouput_file=str(tmp_path / "output.txt"),
+                            track_change_callback=recording_callback, plot_on=False,
+                            fic_trac_bin_path=sys.executable)
+
+    t0 = time.perf_counter()
+    with pytest.raises(Exception) as excinfo:
+        tracDrv.run()
+
+    # We fail as soon as the process exits, not after a fixed startup timeout.
+    assert time.perf_counter() - t0 < tracDrv.startup_timeout
+    assert "exited with return code" in str(excinfo.value.__cause__)
+
+
+def test_driver_startup_timeout(recording_callback):
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:1", track_change_callback=recording_callback,
+                            plot_on=False)
+    tracDrv.startup_timeout = 0.2
+
+    with pytest.raises(Exception) as excinfo:
+        tracDrv.run()
+    assert "startup_timeout" in str(excinfo.value.__cause__)
+
+
+def test_state_string_msg_round_trip():
+    state = FicTracState.from_buffer_copy(synthetic_states(10)[5].tobytes())
+    assert bytes(FicTracState.zmq_string_msg_to_state(state.to_zmq_string_msg())) == bytes(state)
+
+
+def allocations_per_frame(tracDrv, messages, binary_msgs):
+    """
+    Parse messages with the driver, holding on to every state like a callback might, and count the number of memory
+    blocks allocated in pybmt per frame. Binary messages are wrapped in a new zmq.Frame each time, like a receive would.
+    """
+    results = [None] * len(messages)
+
+    # Warm up with a pass over the messages first, so the interpreter's free lists are filled. Otherwise objects parsed
+    # while tracing can be left on them and counted, how many depends on what ran before.
+    for i in range(len(messages)):
+        msg = zmq.Frame(messages[i]) if binary_msgs else messages[i]
+        tracDrv._parse_message(msg)
+    msg = None
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for i in range(len(messages)):
+        msg = zmq.Frame(messages[i]) if binary_msgs else messages[i]
+        results[i] = tracDrv._parse_message(msg)
+        msg = None
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    pybmt_only = [tracemalloc.Filter(True, "*pybmt*")]
+    stats = after.filter_traces(pybmt_only).compare_to(before.filter_traces(pybmt_only), 'filename')
+
+    return sum(s.count_diff for s in stats) / len(messages)
+
+
+@pytest.mark.parametrize("binary_msgs", [False, True])
+def test_reuse_state_allocations(binary_msgs):
+    states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(1000)]
+    if binary_msgs:
+        messages = [bytes(s) for s in states]
+    else:
+        messages = [s.to_zmq_string_msg() for s in states]
+
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:0", binary_msgs=binary_msgs)
+    assert allocations_per_frame(tracDrv, messages, binary_msgs) >= 1
+
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:0", binary_msgs=binary_msgs, reuse_state=True)
+    assert allocations_per_frame(tracDrv, messages, binary_msgs) < 0.01
+
+    # The states are double buffered read-only views
+    if binary_msgs:
+        messages = [zmq.Frame(m) for m in messages]
+    fstate = tracDrv._parse_message(messages[10])
+    assert isinstance(fstate, FicTracStateView)
+    assert fstate.frame_cnt == 11
+    last_fstate = fstate.snapshot()
+    fstate = tracDrv._parse_message(messages[11])
+    assert fstate.frame_cnt == 12
+    assert last_fstate.frame_cnt == 11
+    with pytest.raises(AttributeError):
+        fstate.speed = 1.0
+
+
+class LatencyCallback(PyBMTCallback):
+    """
+    A callback that checks the driver's live latency stats while running.
+    """
+    def __init__(self):
+        self.driver = None
+        self.live_counts = []
+
+    def process_callback(self, track_state):
+        self.live_counts.append(self.driver.get_latency_stats()['callback']['count'])
+        return True
+
+
+@pytest.mark.parametrize("recv_queue_size", [None, 16])
+def test_driver_latency_stats(recv_queue_size):
+    states = synthetic_states(300, fps=1000.0)
+    publisher = FicTracPublisher(states, rate=1000)
+    callback = LatencyCallback()
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=callback, plot_on=False, track_latency=True,
+                            recv_queue_size=recv_queue_size)
+    callback.driver = tracDrv
+
+    publisher.start()
+    tracDrv.run()
+    publisher.join()
+
+    stats = tracDrv.get_latency_stats()
+    assert set(stats.keys()) == set(FicTracDriver.LATENCY_STAGES)
+    assert callback.live_counts == list(range(len(states)))
+    for stage in ('recv_to_parse', 'parse', 'callback', 'process', 'total'):
+        assert stats[stage]['count'] == len(states)
+        assert 0.0 <= stats[stage]['p50'] <= stats[stage]['p99'] <= stats[stage]['max']
+    assert stats['jitter']['count'] == len(states) - 1
+    assert stats['total']['max'] >= stats['parse']['max']
+
+    # Without tracking there is nothing to report
+    assert FicTracDriver(remote_endpoint_url="127.0.0.1:0").get_latency_stats() is None
+
+
+class GapCallback(PyBMTCallback):
+    """
+    A callback that records the frame counts and gaps it is told about, and stops after stop_after_gaps gaps.
+    """
+    def __init__(self, stop_after_gaps=None):
+        self.stop_after_gaps = stop_after_gaps
+        self.frames = []
+        self.gaps = []
+        self.is_shutdown = False
+
+    def process_callback(self, track_state):
+        self.frames.append(track_state.frame_cnt)
+        return True
+
+    def shutdown_callback(self):
+        self.is_shutdown = True
+
+    def process_gap(self, first_frame, last_frame):
+        self.gaps.append((first_frame, last_frame))
+        return self.stop_after_gaps is None or len(self.gaps) < self.stop_after_gaps
+
+
+def run_with_gaps(drop_frames, callback, **driver_args):
+    publisher = FicTracPublisher(synthetic_states(200), rate=2000, drop_frames=drop_frames)
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=callback, plot_on=False, tolerate_gaps=True, **driver_args)
+    tracDrv.watchdog = None
+
+    publisher.start()
+    try:
+        tracDrv.run()
+    finally:
+        publisher.join()
+
+    return tracDrv
+
+
+def test_driver_tolerate_gaps(capsys):
+    callback = GapCallback()
+    tracDrv = run_with_gaps([10, 50, 51, 52], callback, max_lost_frames=4)
+
+    # Frames are 1 based, state index 10 is frame 11
+    assert callback.gaps == [(11, 11), (51, 53)]
+    assert tracDrv.gap_log == callback.gaps
+    assert tracDrv.frame_cnt == 196
+    assert callback.frames[9:11] == [10, 12]
+
+    stats = tracDrv.get_loss_stats()
+    assert stats['lost_frames'] == 4
+    assert stats['gaps'] == 2
+    assert stats['loss_fraction'] == pytest.approx(4 / 200.0)
+    assert "lost: 4 in 2 gaps" in capsys.readouterr().out
+
+
+def test_driver_loss_budget():
+    callback = GapCallback()
+    with pytest.raises(Exception) as excinfo:
+        run_with_gaps([10, 50, 51, 52], callback, max_lost_frames=3)
+
+    assert "loss budget" in str(excinfo.value.__cause__)
+    assert callback.gaps == [(11, 11)]
+    assert callback.is_shutdown
+
+
+def test_driver_process_gap_stop():
+    callback = GapCallback(stop_after_gaps=1)
+    tracDrv = run_with_gaps([10], callback)
+
+    assert callback.gaps == [(11, 11)]
+    assert tracDrv.frame_cnt == 10
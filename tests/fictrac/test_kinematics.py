@@ -0,0 +1,131 @@
+import math
+
+import numpy as np
+import pytest
+
+from pybmt.fictrac.kinematics import (KinematicsTracker, angle_diff, kinematics, lab_motion, unwrap_angle, wrap_angle,
+                                      wrap_angle_2pi)
+from pybmt.fictrac.replay import read_dat_file
+from pybmt.fictrac.state import FicTracState
+
+
+def test_wrap_angles():
+    angles = np.linspace(-20, 20, 1001)
+    wrapped = wrap_angle(angles)
+    assert np.all(wrapped >= -np.pi) and np.all(wrapped < np.pi)
+    assert np.allclose(np.cos(wrapped), np.cos(angles)) and np.allclose(np.sin(wrapped), np.sin(angles))
+
+    wrapped = wrap_angle_2pi(angles)
+    assert np.all(wrapped >= 0) and np.all(wrapped < 2 * np.pi)
+    assert np.allclose(np.sin(wrapped), np.sin(angles))
+
+    # Works on plain floats too, and agrees with the old scalar loops
+    assert angle_diff(0.1, 2 * np.pi - 0.1) == pytest.approx(-0.2)
+    assert angle_diff(3.0, -3.0) == pytest.approx(2 * np.pi - 6.0)
+    assert isinstance(wrap_angle(7.0), float)
+
+    # Unwrapping a heading that goes round and round gets back the continuous heading
+    heading = np.cumsum(np.full(500, 0.1))
+    assert np.allclose(unwrap_angle(wrap_angle_2pi(heading)), heading)
+
+
+def test_kinematics_match_fictrac(dat_file):
+    states = read_dat_file(dat_file)
+    k = kinematics(states)
+
+    # FicTrac integrates the same per frame motion into speed, heading, intx and inty
+    forward, side, turn = lab_motion(states['del_rot_lab_vec'])
+    dt = states['delta_timestamp'][1:] / 1000.0
+    assert np.allclose(k['speed'][1:] * dt, states['speed'][1:], atol=1e-12)
+    assert np.allclose(np.cumsum(k['forward_velocity'][1:] * dt), states['intx'][1:], atol=1e-9)
+    assert np.allclose(np.cumsum(k['side_velocity'][1:] * dt), states['inty'][1:], atol=1e-9)
+    assert np.allclose(np.cumsum(k['turn_rate'][1:] * dt), states['heading'][1:], atol=1e-9)
+    assert np.allclose(k['heading'], states['heading'])
+    assert np.allclose(wrap_angle_2pi(np.arctan2(side, forward)), states['direction'], atol=1e-9)
+    assert k['path_length'][-1] == pytest.approx(states['speed'].sum())
+
+    # The position in the lab is the motion rotated by the heading, half way through each frame
+    heading = k['heading'] - turn / 2
+    posx = np.cumsum(forward * np.cos(heading) - side * np.sin(heading))
+    posy = np.cumsum(forward * np.sin(heading) + side * np.cos(heading))
+    assert np.allclose(posx, states['posx'], atol=1e-6)
+    assert np.allclose(posy, states['posy'], atol=1e-6)
+
+    # The ball radius just scales the distances
+    scaled = kinematics(states, ball_radius=4.5)
+    assert np.allclose(scaled['speed'], 4.5 * k['speed'])
+    assert np.allclose(scaled['curvature'], k['curvature'] / 4.5, equal_nan=True)
+    assert np.array_equal(scaled['turn_rate'], k['turn_rate'])
+
+
+def test_curvature():
+    states = np.zeros(200, dtype=FicTracState.np_dtype())
+    states['delta_timestamp'] = 10.0
+
+    # Walking forward 0.01 and turning 0.02 a frame is a circle of radius 0.5, curvature 2
+    states['del_rot_lab_vec'][:, 1] = 0.01
+    states['del_rot_lab_vec'][:, 2] = -0.02
+    states['heading'] = wrap_angle_2pi(np.cumsum(np.full(200, 0.02)))
+    states['del_rot_lab_vec'][150:] = 0.0
+
+    k = kinematics(states, curvature_window=10)
+    assert np.allclose(k['curvature'][:150], 2.0)
+    assert np.all(np.isnan(k['curvature'][160:]))
+    assert np.allclose(k['turn_rate'][:150], 2.0)
+    assert np.allclose(k['forward_velocity'][:150], 1.0)
+    assert np.allclose(k['heading'], np.cumsum(np.full(200, 0.02)))
+
+
+@pytest.mark.parametrize("window", [1, 25])
+def test_tracker_matches_vectorized(window, dat_file):
+    states = read_dat_file(dat_file)
+
+    # Put the heading through a few turns, so it has to be unwrapped
+    states['heading'] = wrap_angle_2pi(states['heading'] + np.linspace(0, 6 * np.pi, len(states)))
+    k = kinematics(states, ball_radius=2.0, curvature_window=window)
+
+    tracker = KinematicsTracker(ball_radius=2.0, curvature_window=window)
+    for state, expected in zip(states, k):
+        tracker.update(FicTracState.from_buffer_copy(state.tobytes()))
+        for field in k.dtype.names:
+            value = getattr(tracker, field)
+            if math.isnan(expected[field]):
+                assert math.isnan(value)
+            else:
+                assert value == pytest.approx(expected[field], rel=1e-9, abs=1e-9)
+
+    tracker.reset()
+    assert tracker.num_frames == 0 and tracker.path_length == 0.0
+
+
+def test_tracker_long_run():
+    # A burst of fast walking every 1000 frames, a large offset on top of hardly any movement. Running sums and
+    # cumulative sums keep the rounding errors of the big values after they leave the window, and they add up over the
+    # session. The tracker and the vectorized kinematics must both stay with the exact sums, and so with each other.
+    rng = np.random.RandomState(0)
+    window = 25
+    num_frames = 200000
+    distances = rng.uniform(0, 1e-3, num_frames)
+    distances[::1000] = 1e3
+    turns = rng.uniform(-1e-3, 1e-3, num_frames)
+
+    states = np.zeros(num_frames, dtype=FicTracState.np_dtype())
+    states['delta_timestamp'] = 10.0
+    states['del_rot_lab_vec'][:, 1] = distances
+    states['del_rot_lab_vec'][:, 2] = -turns
+    k = kinematics(states, curvature_window=window)
+
+    tracker = KinematicsTracker(curvature_window=window)
+    state = FicTracState()
+    state.delta_timestamp = 10.0
+    for i in range(num_frames):
+        state.del_rot_lab_vec[1] = distances[i]
+        state.del_rot_lab_vec[2] = -turns[i]
+        tracker.update(state)
+
+        if i % 997 == 500:
+            expected = math.fsum(turns[i - window + 1:i + 1]) / math.fsum(distances[i - window + 1:i + 1])
+            assert tracker.curvature == pytest.approx(expected, rel=1e-12, abs=0)
+            assert k['curvature'][i] == pytest.approx(expected, rel=1e-12, abs=0)
+
+    assert tracker.num_frames == num_frames
@@ -0,0 +1,50 @@
+import numpy as np
+
+from pybmt.fictrac.latency import LatencyHistogram, LatencyStats
+
+
+def test_histogram_percentiles():
+    hist = LatencyHistogram()
+    assert hist.summary()['p99'] == 0.0
+
+    values = np.random.RandomState(0).lognormal(np.log(1e-4), 1.0, 10000)
+    for v in values:
+        hist.record(v)
+
+    s = hist.summary()
+    assert s['count'] == len(values)
+    assert np.isclose(s['mean'], values.mean())
+    assert s['max'] == values.max()
+
+    # Estimates are the upper edge of the bucket, within a bucket width of the real value
+    width = 10.0 ** (1.0 / 20)
+    for p in (50, 99):
+        exact = np.percentile(values, p)
+        assert exact / width <= hist.percentile(p) <= exact * width
+
+    hist.clear()
+    assert hist.count == 0 and hist.max == 0.0
+
+
+def test_histogram_out_of_range():
+    hist = LatencyHistogram(min_value=1e-6, max_value=1.0)
+    hist.record(0.0)
+    hist.record(5.0)
+
+    assert hist.counts[0] == 1
+    assert hist.counts[-1] == 1
+    assert hist.percentile(100) == 5.0
+    assert hist.percentile(10) == 1e-6
+
+
+def test_latency_stats_report():
+    stats = LatencyStats(['parse', 'callback'])
+    stats.record('parse', 10e-6)
+    stats['callback'].record(2e-3)
+
+    summary = stats.summary()
+    assert list(summary.keys()) == ['parse', 'callback']
+    assert summary['callback']['max'] == 2e-3
+
+    report = stats.report()
+    assert "parse" in report and "2000.0" in report
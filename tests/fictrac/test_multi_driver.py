@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.config import get_socket_port, read_fictrac_config
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.multi_driver import MultiRigDriver
+from pybmt.fictrac.simulator import FicTracPublisher, synthetic_states
+
+
+class FrameCallback(PyBMTCallback):
+    def setup_callback(self):
+        self.frames = []
+        self.is_shutdown = False
+
+    def process_callback(self, track_state):
+        self.frames.append(track_state.frame_cnt)
+        return True
+
+    def shutdown_callback(self):
+        self.is_shutdown = True
+
+
+def make_rigs(publishers, **driver_args):
+    rigs = []
+    for publisher in publishers:
+        rig = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=FrameCallback(), plot_on=False, **driver_args)
+        rig.watchdog = None
+        rigs.append(rig)
+    return rigs
+
+
+def test_read_fictrac_config():
+    config_file = "tests/fictrac/test_config_data/test_config_local.txt"
+    config = read_fictrac_config(config_file)
+    assert config["src_fn"] == "test.mp4"
+    assert config["roi_r"] == "0.022890"
+    assert get_socket_port(config_file) == 5556
+
+
+def test_multi_rig_driver():
+    num_frames = [150, 200, 250]
+    publishers = [FicTracPublisher(synthetic_states(n, first_frame=10 * i), rate=1000, binary_msgs=(i == 1))
+                  for i, n in enumerate(num_frames)]
+    rigs = make_rigs(publishers[:1]) + make_rigs(publishers[1:2], binary_msgs=True) + make_rigs(publishers[2:])
+
+    multi = MultiRigDriver(rigs)
+    for p in publishers:
+        p.start()
+    multi.run()
+    for p in publishers:
+        p.join()
+
+    # Each rig's states went to its own callback
+    for i, (rig, n) in enumerate(zip(rigs, num_frames)):
+        assert rig.track_change_callback.is_shutdown
+        assert rig.frame_cnt == n
+        assert np.array_equal(rig.track_change_callback.frames, np.arange(n) + 10 * i)
+
+    stats = multi.rig_stats()
+    assert [s['frame_cnt'] for s in stats] == num_frames
+    assert all(s['error'] is None for s in stats)
+
+
+def test_multi_rig_watchdog():
+    # The second rig goes quiet without sending END, the others should be unaffected.
+    publishers = [FicTracPublisher(synthetic_states(100), rate=1000),
+                  FicTracPublisher(synthetic_states(50), rate=1000, send_end=False),
+                  FicTracPublisher(synthetic_states(200), rate=1000)]
+    rigs = make_rigs(publishers)
+
+    multi = MultiRigDriver(rigs, rig_timeout=0.2)
+    for p in publishers:
+        p.start()
+    with pytest.raises(Exception, match=r"Rig\(s\) \[1\] failed"):
+        multi.run()
+    for p in publishers:
+        p.join()
+
+    assert [rig.frame_cnt for rig in rigs] == [100, 50, 200]
+    assert multi.rig_errors[0] is None
+    assert "sent no frames" in str(multi.rig_errors[1])
+    assert multi.rig_errors[2] is None
+    assert all(rig.track_change_callback.is_shutdown for rig in rigs)
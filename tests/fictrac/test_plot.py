@@ -0,0 +1,124 @@
+import matplotlib
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.plot import LivePlotter, PlotProcess, decimate, field_values, plot_task_fictrac
+from pybmt.fictrac.replay import ReplayDriver
+from pybmt.fictrac.shmem import SharedStateRing
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+
+def test_decimate():
+    values = np.random.RandomState(0).randn(2000)
+    values[1234] = 100.0
+    values[77] = -100.0
+
+    # Short traces are left alone
+    x, y = decimate(values[:300], 500)
+    assert np.array_equal(x, np.arange(300))
+    assert np.array_equal(y, values[:300])
+
+    # Long traces keep the extremes, in order
+    x, y = decimate(values, 500)
+    assert len(x) <= 500
+    assert np.all(np.diff(x) > 0)
+    assert np.array_equal(y, values[x])
+    assert y.max() == 100.0 and y.min() == -100.0
+
+    # Traces that don't split evenly into bins lose a few of their oldest values
+    x, y = decimate(values[:1999], 500)
+    assert len(x) <= 500
+    assert x[-1] == 1998
+
+
+def test_field_values():
+    history = np.zeros(4, dtype=FicTracState.np_dtype())
+    history['direction'] = [0.1, 2 * np.pi - 0.1, 0.2, 0.2]
+    history['del_rot_cam_vec'][:, 1] = [1, 2, 3, 4]
+
+    # The change from just under 2 pi to just over 0 is small
+    assert np.allclose(field_values(history, 'direction_diff'), [0, 0.2, 0.3, 0])
+    assert np.array_equal(field_values(history, 'del_rot_cam_vec'), [1, 2, 3, 4])
+    assert np.array_equal(field_values(history, 'direction'), history['direction'])
+
+
+def test_live_plotter():
+    plotter = LivePlotter(num_history=2000, max_points=200)
+    try:
+        for s in synthetic_states(50):
+            plotter.add_state(FicTracState.from_buffer_copy(s.tobytes()))
+        assert plotter.has_new_states
+
+        plotter.update()
+        assert plotter.num_draws == 1
+        assert not plotter.has_new_states
+        for line in plotter.lines:
+            assert len(line.get_xdata()) <= 200
+
+        # The del_rot_error axis grows to fit the data
+        state = FicTracState()
+        state.del_rot_error = 1e6
+        plotter.add_state(state)
+        plotter.update()
+        assert plotter.axes[3].get_ylim()[1] >= 1e6
+    finally:
+        plt.close(plotter.fig)
+
+
+def test_plot_task():
+    ring = SharedStateRing.create(capacity=256)
+    try:
+        for s in synthetic_states(100):
+            ring.write(FicTracState.from_buffer_copy(s.tobytes()))
+        ring.mark_closed()
+
+        plotter = plot_task_fictrac(ring.name, num_history=500, backend='Agg')
+        assert plotter.num_states == 100
+        assert plotter.num_draws == 1
+        assert plotter.history.latest()['frame_cnt'] == 100
+    finally:
+        ring.close()
+
+
+def test_plot_process():
+    plot = PlotProcess(num_history=500, display_rate=100.0, ring_capacity=256, backend='Agg')
+    plot.start()
+    name = plot.ring.name
+    try:
+        for s in synthetic_states(100):
+            plot.write(FicTracState.from_buffer_copy(s.tobytes()))
+        assert plot.ring.write_seq == 100
+    finally:
+        plot.stop()
+
+    # The plot process drew the last states and exited by itself, and the ring is gone
+    assert plot.process.exitcode == 0
+    assert plot.ring is None
+    with pytest.raises(FileNotFoundError):
+        SharedStateRing.attach(name)
+
+
+class NullCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        return True
+
+
+def test_replay_plot_on(dat_file):
+    replay = ReplayDriver(dat_file, track_change_callback=NullCallback(), plot_on=True)
+    replay.plot_args = {'backend': 'Agg', 'display_rate': 100.0}
+    replay.run()
+
+    assert replay._plotter.ring is None
+    assert replay._plotter.process.exitcode == 0
+
+    # The driver spawns the plot process, its own threads are already running
+    assert replay._plotter._mp_context.get_start_method() == 'spawn'
+
+    # Plotting is off unless asked for
+    assert not FicTracDriver(remote_endpoint_url="127.0.0.1:0").plot_on
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.recorder import (EVENT_DTYPE, RecordingWriter, SessionRecorder, load_recording, load_session,
+                                    read_recording_header)
+from pybmt.fictrac.replay import ReplayDriver
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+states = synthetic_states(1000)
+
+
+def test_recording_writer(tmpdir):
+    path = str(tmpdir.join("states.rec"))
+    writer = RecordingWriter(path, chunk_size=64, num_chunks=2)
+    writer.open()
+    for s in states:
+        writer.record(FicTracState.from_buffer_copy(s.tobytes()))
+    writer.close()
+
+    assert writer.num_records == 1000
+    assert writer.num_written == 1000
+
+    dtype, header_size, count = read_recording_header(path)
+    assert count == 1000
+    assert header_size % 64 == 0
+    assert dtype.itemsize == FicTracState.np_dtype().itemsize
+
+    loaded = load_recording(path)
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(loaded['frame_cnt'], states['frame_cnt'])
+    assert np.array_equal(loaded['del_rot_cam_vec'], states['del_rot_cam_vec'])
+
+
+def test_recording_writer_numpy_records(tmpdir):
+    path = str(tmpdir.join("events.rec"))
+    writer = RecordingWriter(path, dtype=EVENT_DTYPE, chunk_size=4)
+    writer.open()
+    for i in range(10):
+        writer.record((i, i / 10.0, 'event', i * 2.0))
+    writer.close()
+
+    loaded = load_recording(path)
+    assert list(loaded['frame_cnt']) == list(range(10))
+    assert loaded['kind'][3] == b'event'
+    assert loaded['value'][9] == 18.0
+
+
+def test_recording_crash(tmpdir):
+    path = str(tmpdir.join("states.rec"))
+    writer = RecordingWriter(path, chunk_size=100)
+    writer.open()
+    for s in states[:250]:
+        writer.record(s)
+    writer.flush()
+    writer._queue.put(None)
+    writer._thread.join()
+    writer._file.close()
+
+    # Bytes of a chunk that was being written when we crashed, the header doesn't count them.
+    with open(path, 'ab') as f:
+        f.write(b'\x01' * 150)
+
+    loaded = load_recording(path)
+    assert len(loaded) == 250
+    assert np.array_equal(loaded['frame_cnt'], states['frame_cnt'][:250])
+
+
+def test_recording_empty_and_bad(tmpdir):
+    path = str(tmpdir.join("empty.rec"))
+    writer = RecordingWriter(path)
+    writer.open()
+    writer.close()
+    assert len(load_recording(path)) == 0
+
+    bad = tmpdir.join("bad.rec")
+    bad.write("this is not a recording, it is just text")
+    with pytest.raises(ValueError):
+        load_recording(str(bad))
+
+
+class EventCallback(PyBMTCallback):
+    def __init__(self, recorder):
+        self.recorder = recorder
+
+    def process_callback(self, track_state):
+        if track_state.frame_cnt % 100 == 0:
+            self.recorder.record_event('stimulus_on', value=1.0, frame_cnt=track_state.frame_cnt)
+        return True
+
+
+def test_replay_session(tmpdir, dat_lines):
+    dat = tmpdir.join("gaps.dat")
+    dat.write("".join(dat_lines[:50] + dat_lines[53:]))
+
+    recorder = SessionRecorder(str(tmpdir.join("session")), chunk_size=128)
+    replay = ReplayDriver(str(dat), track_change_callback=EventCallback(recorder), tolerate_gaps=True,
+                          recorder=recorder)
+    replay.run()
+
+    session = load_session(str(tmpdir.join("session")))
+    assert np.array_equal(session['states'], replay.states)
+
+    events = session['events']
+    gaps = events[events['kind'] == b'gap']
+    assert list(gaps['frame_cnt']) == [50]
+    assert list(gaps['value']) == [3]
+    stimuli = events[events['kind'] == b'stimulus_on']
+    assert list(stimuli['frame_cnt']) == [0, 100, 200, 300, 400, 500]
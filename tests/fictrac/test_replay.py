@@ -0,0 +1,141 @@
+import os
+
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.replay import ReplayDriver, read_dat_file
+from pybmt.fictrac.shmem import SharedLatestState
+
+
+def test_read_dat_file(dat_file):
+    states = read_dat_file(dat_file)
+    raw = np.loadtxt(dat_file, delimiter=',')
+
+    assert len(states) == raw.shape[0]
+    assert np.array_equal(states['frame_cnt'], raw[:, 0])
+    assert np.array_equal(states['del_rot_lab_vec'], raw[:, 5:8])
+    assert np.array_equal(states['timestamp'], raw[:, 21])
+    assert np.array_equal(states['seq_num'], raw[:, 22])
+
+    # This log predates delta_timestamp, it is filled in from the timestamps
+    assert states['delta_timestamp'][0] == 0
+    assert np.allclose(states['delta_timestamp'][1:], 1000.0 / 30, atol=1e-6)
+
+
+def test_read_dat_file_bad_columns(tmpdir):
+    bad = tmpdir.join("bad.dat")
+    bad.write("1, 2, 3\n4, 5, 6\n")
+    with pytest.raises(ValueError):
+        read_dat_file(str(bad))
+
+
+@pytest.mark.parametrize("reuse_state", [False, True])
+def test_replay(reuse_state, dat_file, recording_callback):
+    callback = recording_callback
+    replay = ReplayDriver(dat_file, track_change_callback=callback, reuse_state=reuse_state, track_latency=True)
+    assert replay.remote_endpoint_url == "file://" + os.path.abspath(dat_file)
+    assert not replay.start_fictrac
+    replay.run()
+
+    assert callback.is_shutdown
+    assert replay.frame_cnt == len(replay.states)
+    assert replay.get_latency_stats()['callback']['count'] == len(replay.states)
+    received = np.concatenate([s.to_np_view() for s in callback.states])
+    assert np.array_equal(received, replay.states)
+
+
+class SharedStateCallback(PyBMTCallback):
+    """
+    Reads the state back from the driver's shared memory, like a plotter in another process would.
+    """
+    def setup_callback(self):
+        self.latest = None
+        self.mismatches = 0
+
+    def process_callback(self, track_state):
+        # The driver creates the block after setting up the callback, it is there by the first frame
+        if self.latest is None:
+            self.latest = SharedLatestState.attach("pybmt_test_replay_state")
+
+        if self.latest.read_new().frame_cnt != track_state.frame_cnt:
+            self.mismatches = self.mismatches + 1
+        return True
+
+    def shutdown_callback(self):
+        self.closed = self.latest.closed
+        self.num_published = self.latest.num_published
+        self.latest.close()
+
+
+def test_replay_state_shmem(dat_file):
+    callback = SharedStateCallback()
+    replay = ReplayDriver(dat_file, track_change_callback=callback, state_shmem_name="pybmt_test_replay_state")
+    replay.run()
+
+    assert callback.mismatches == 0
+    assert callback.num_published == len(replay.states)
+    assert callback.closed
+    with pytest.raises(FileNotFoundError):
+        SharedLatestState.attach("pybmt_test_replay_state")
+
+
+def test_replay_callback_stop(dat_file, recording_callback):
+    callback = recording_callback
+    callback.stop_after = 10
+    replay = ReplayDriver(dat_file, track_change_callback=callback)
+    replay.run()
+
+    assert len(callback.states) == 10
+    assert replay.frame_cnt == 10
+
+
+def test_replay_realtime(dat_file, recording_callback):
+    callback = recording_callback
+    callback.stop_after = 16
+    replay = ReplayDriver(dat_file, track_change_callback=callback, realtime=True, speed=5.0)
+    replay.run()
+
+    # 15 frames at 30 Hz, 5 times faster than recorded
+    assert replay.run_time >= 15 / 30.0 / 5.0
+
+
+def test_replay_frame_jump(tmpdir, dat_lines, recording_callback):
+    dat = tmpdir.join("jump.dat")
+    dat.write("".join(dat_lines[:10] + dat_lines[11:20]))
+
+    callback = recording_callback
+    with pytest.raises(Exception) as exc_info:
+        ReplayDriver(str(dat), track_change_callback=callback).run()
+
+    assert "jumped" in str(exc_info.value.__cause__)
+    assert callback.is_shutdown
+
+
+def test_replay_tolerate_gaps(tmpdir, dat_lines, recording_callback):
+    dat = tmpdir.join("gaps.dat")
+    dat.write("".join(dat_lines[:10] + dat_lines[13:20]))
+
+    callback = recording_callback
+    replay = ReplayDriver(str(dat), track_change_callback=callback, tolerate_gaps=True)
+    replay.run()
+
+    # The log's frame counter starts at 0
+    assert replay.gap_log == [(10, 12)]
+    assert replay.num_lost_frames == 3
+    assert len(callback.states) == 17
+
+
+@pytest.mark.parametrize("order", [[9, 9], [9, 5]], ids=["repeat", "backwards"])
+def test_replay_frame_backwards(tmpdir, order, dat_lines, recording_callback):
+    dat = tmpdir.join("backwards.dat")
+    dat.write("".join(dat_lines[:9] + [dat_lines[i] for i in order] + dat_lines[10:20]))
+
+    # Even tolerating gaps, a frame counter that doesn't go up is an error of its own
+    callback = recording_callback
+    with pytest.raises(Exception) as exc_info:
+        ReplayDriver(str(dat), track_change_callback=callback, tolerate_gaps=True).run()
+
+    assert "went backwards or repeated" in str(exc_info.value.__cause__)
+    assert "oldFrame = 9, newFrame = {}".format(order[1]) in str(exc_info.value.__cause__)
+    assert len(callback.states) == 10
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from pybmt.fictrac.ring_buffer import StateRingBuffer
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+states = synthetic_states(100)
+
+
+def test_append_states_wraparound():
+    ring = StateRingBuffer(10)
+    assert len(ring) == 0
+
+    for i in range(25):
+        ring.append(FicTracState.from_buffer_copy(states[i].tobytes()))
+
+        n = min(i + 1, 10)
+        assert len(ring) == n
+        assert ring.total == i + 1
+        assert np.array_equal(ring.field('frame_cnt'), states['frame_cnt'][i + 1 - n:i + 1])
+        assert ring.latest()['frame_cnt'] == states['frame_cnt'][i]
+
+    # Last N windows are views of the buffer, not copies
+    window = ring.last(4)
+    assert np.array_equal(window, states[21:25])
+    assert np.shares_memory(window, ring._data)
+    assert np.array_equal(ring.field('del_rot_lab_vec', 3), states['del_rot_lab_vec'][22:25])
+
+    with pytest.raises(ValueError):
+        ring.last(11)
+
+
+def test_extend():
+    ring = StateRingBuffer(10)
+    ring.extend(states[:7])
+    assert np.array_equal(ring.last(), states[:7])
+
+    # Wraps around the end of the buffer
+    ring.extend(states[7:12])
+    assert np.array_equal(ring.last(), states[2:12])
+
+    # More samples than fit
+    ring.extend(states[12:50])
+    assert np.array_equal(ring.last(), states[40:50])
+    assert ring.total == 50
+
+    ring.append(states[50])
+    assert np.array_equal(ring.last(), states[41:51])
+
+
+def test_other_dtypes():
+    ring = StateRingBuffer(5, dtype=np.float64)
+    for x in range(8):
+        ring.append(float(x))
+    assert np.array_equal(ring.last(), [3.0, 4.0, 5.0, 6.0, 7.0])
+    assert ring.last(2).mean() == 6.5
+
+    ring.clear()
+    assert len(ring) == 0
+    with pytest.raises(IndexError):
+        ring.latest()
@@ -0,0 +1,161 @@
+import time
+
+import numpy as np
+import pytest
+
+from pybmt.fictrac.shmem import SharedLatestState, SharedStateRing
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+
+states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(50)]
+
+
+def test_ring_write_read():
+    ring = SharedStateRing.create(capacity=8)
+    reader = SharedStateRing.attach(ring.name)
+    try:
+        assert reader.capacity == 8
+        assert reader.read() is None
+
+        for i in range(5):
+            assert ring.write(states[i]) == i + 1
+
+        read = [reader.read() for i in range(5)]
+        assert [s.frame_cnt for s in read] == [1, 2, 3, 4, 5]
+        assert np.array_equal(read[3].to_np_view(), states[3].to_np_view())
+        assert reader.read() is None
+        assert reader.wait(timeout=0.01) is None
+
+        ring.mark_closed()
+        assert reader.closed
+        assert reader.wait() is None
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_ring_lapped_reader():
+    ring = SharedStateRing.create(capacity=8)
+    reader = SharedStateRing.attach(ring.name)
+    try:
+        for s in states[:20]:
+            ring.write(s)
+
+        # The reader fell 20 behind a ring of 8, it skips to the oldest state still there
+        assert reader.read().frame_cnt == 13
+        assert reader.num_missed == 12
+        assert [reader.read().frame_cnt for i in range(7)] == list(range(14, 21))
+        assert reader.read() is None
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_ring_torn_slot():
+    ring = SharedStateRing.create(capacity=4)
+    reader = SharedStateRing.attach(ring.name)
+    try:
+        ring.write(states[0])
+        ring.write(states[1])
+
+        # A slot that is being written has no sequence number yet, the reader must not hand it out
+        ring.slot_seqs[0] = 0
+        assert reader.read() is None
+        assert reader.read_seq == 1
+
+        ring.slot_seqs[0] = 1
+        assert [reader.read().frame_cnt, reader.read().frame_cnt] == [1, 2]
+    finally:
+        reader.close()
+        ring.close()
+
+
+def test_ring_stop_request():
+    ring = SharedStateRing.create(capacity=4)
+    reader = SharedStateRing.attach(ring.name)
+    try:
+        assert not ring.stop_requested
+        reader.request_stop()
+        assert ring.stop_requested
+    finally:
+        reader.close()
+        ring.close()
+
+    with pytest.raises(FileNotFoundError):
+        SharedStateRing.attach(ring.name)
+
+
+def test_latest_state():
+    latest = SharedLatestState.create("pybmt_test_latest")
+    reader = SharedLatestState.attach("pybmt_test_latest")
+    try:
+        assert reader.read() is None
+        assert reader.read_new() is None
+
+        for s in states[:3]:
+            latest.publish(s)
+        assert reader.num_published == 3
+
+        # Only the latest state is there, reading it again is fine but it isn't new
+        into = FicTracState()
+        assert reader.read_new(into) is into
+        assert np.array_equal(into.to_np_view(), states[2].to_np_view())
+        assert reader.read_new(into) is None
+        assert reader.read().frame_cnt == 3
+
+        latest.publish(states[3])
+        assert reader.read_new().frame_cnt == 4
+
+        latest.mark_closed()
+        assert reader.closed
+    finally:
+        reader.close()
+        latest.close()
+
+
+def test_latest_state_torn_write():
+    latest = SharedLatestState.create("pybmt_test_latest")
+    reader = SharedLatestState.attach("pybmt_test_latest")
+    try:
+        latest.publish(states[0])
+
+        # A reader never gets the state while the counter says a write is in progress
+        latest.header.seq = latest.header.seq + 1
+        assert reader.header.seq & 1
+        latest.header.seq = latest.header.seq + 1
+        assert reader.read().frame_cnt == 1
+        assert reader.last_seq == 4
+
+        # A writer that died part way through a write doesn't leave the reader spinning forever
+        latest.header.seq = latest.header.seq + 1
+        t0 = time.perf_counter()
+        with pytest.raises(TimeoutError):
+            reader.read(timeout=0.05)
+        assert time.perf_counter() - t0 >= 0.05
+        assert reader.last_seq == 4
+    finally:
+        reader.close()
+        latest.close()
+
+
+def test_latest_state_takeover():
+    left_behind = SharedLatestState.create("pybmt_test_latest")
+    left_behind.publish(states[0])
+    left_behind.mark_closed()
+    try:
+        # The block isn't taken over unless asked
+        with pytest.raises(FileExistsError):
+            SharedLatestState.create("pybmt_test_latest")
+        assert left_behind.num_published == 1
+
+        # A new run takes over a block a crashed run didn't unlink, starting fresh
+        latest = SharedLatestState.create("pybmt_test_latest", takeover=True)
+        assert latest.num_published == 0
+        assert not latest.closed
+        latest.close()
+    finally:
+        left_behind.owner = False
+        left_behind.close()
+
+    with pytest.raises(FileNotFoundError):
+        SharedLatestState.attach("pybmt_test_latest")
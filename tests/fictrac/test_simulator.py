@@ -0,0 +1,100 @@
+import os
+import socket
+import sys
+
+import numpy as np
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.fictrac.driver import FicTracDriver
+from pybmt.fictrac.simulator import FicTracPublisher, synthetic_states, load_test, max_sustainable_rate
+
+
+class CountingCallback(PyBMTCallback):
+    def setup_callback(self):
+        self.frames = []
+
+    def process_callback(self, track_state):
+        self.frames.append(track_state.frame_cnt)
+        return True
+
+
+def make_publisher(num_frames=100, **kwargs):
+    publisher = FicTracPublisher(synthetic_states(num_frames), wait_for_subscriber=False, **kwargs)
+    publisher.socket.close()
+    publisher.context.term()
+    return publisher
+
+
+def test_send_times():
+    assert make_publisher().send_times() is None
+
+    t = make_publisher(rate=1000).send_times()
+    assert np.allclose(np.diff(t), 0.001)
+
+    t = make_publisher(rate=1000, jitter=0.0005, seed=1).send_times()
+    assert np.all(np.diff(t) >= 0)
+    assert np.abs(t - np.arange(100) / 1000.0).max() < 0.005
+
+    t = make_publisher(rate=1000, burst_every=20, burst_size=5).send_times()
+    assert np.all(t[20:25] == t[24])
+    assert np.all(t[40:45] == t[44])
+    assert np.isclose(t[25] - t[24], 0.001)
+
+
+def test_drop_frames():
+    publisher = make_publisher(10, drop_frames=[3, 4])
+    assert len(publisher.messages) == 8
+
+    states = synthetic_states(50)
+    publisher = FicTracPublisher(states, rate=1000, drop_frames=[20])
+    callback = CountingCallback()
+    tracDrv = FicTracDriver(remote_endpoint_url="127.0.0.1:{}".format(publisher.port),
+                            track_change_callback=callback, plot_on=False)
+    publisher.start()
+    with pytest.raises(Exception) as exc_info:
+        tracDrv.run()
+    publisher.join()
+
+    assert "jumped" in str(exc_info.value.__cause__)
+    assert callback.frames == list(range(1, 21))
+
+
+@pytest.mark.parametrize("binary_msgs", [False, True])
+def test_load_test_rate(binary_msgs):
+    error, tracDrv, publisher = load_test(CountingCallback(), 5000, num_frames=2500, binary_msgs=binary_msgs)
+
+    assert error is None
+    assert tracDrv.frame_cnt == 2500
+    assert publisher.achieved_rate == pytest.approx(5000, rel=0.1)
+
+
+def test_max_sustainable_rate():
+    best, results = max_sustainable_rate(CountingCallback, rates=(200, 500), duration=0.5)
+    assert best == 500
+    assert results == {200: None, 500: None}
+
+
+def test_local_simulator(tmpdir, monkeypatch):
+
+    # Find a free port for the simulator to publish on
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    config_file = tmpdir.join("config.txt")
+    config_file.write("socket_port : {}\n".format(port))
+
+    # The simulator runs in the config file's directory, it needs to find pybmt
+    repo_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    monkeypatch.setenv("PYTHONPATH", repo_dir)
+
+    callback = CountingCallback()
+    tracDrv = FicTracDriver(config_file=str(config_file), console_ouput_file=str(tmpdir.join("output.txt")),
+                            track_change_callback=callback, plot_on=False,
+                            fic_trac_bin_path=[sys.executable, "-m", "pybmt.fictrac.simulator",
+                                               "--rate", "1000", "--frames", "300"])
+    tracDrv.run()
+
+    assert callback.frames == list(range(1, 301))
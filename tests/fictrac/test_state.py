@@ -1,11 +1,13 @@
+import ctypes
+
 import pytest
 import numpy as np
 from math import isclose
 
-from pybmt.fictrac.state import FicTracState
+from pybmt.fictrac.state import FicTracState, FicTracStateView
 
 # A test message that is exactly formatted like fictrac's state messages
-test_msg = "1, 0.00061658055072047, 0.00049280924124894, 0.00028854775028054, 4383.0244305051, -0.00049229297796647, 0.00028846777828354, -0.00061703022026165, 0.0053108667004006, -0.0013475230246914, 0.00028682299296761, -1.2046443372631, 1.2104273986131, 1.2054460682211, 0.00028831588044736, 0.00049238194388207, 0.00061703022026165, 1.0407586027826, 0.00057058394234585, 0.00028846777828354, 0.00049229297796647, 20, 1, 0.0000234"
+test_msg = "1, 0.00061658055072047, 0.00049280924124894, 0.00028854775028054, 4383.0244305051, -0.00049229297796647, 0.00028846777828354, -0.00061703022026165, 0.0053108667004006, -0.0013475230246914, 0.00028682299296761, -1.2046443372631, 1.2104273986131, 1.2054460682211, 0.00028831588044736, 0.00049238194388207, 0.00061703022026165, 1.0407586027826, 0.00057058394234585, 0.00028846777828354, 0.00049229297796647, 20, 1, 0.0000234, 20.5"
 
 # The values of the message.
 test_values = np.array([1, 0.00061658055072047, 0.00049280924124894, 0.00028854775028054,
@@ -14,7 +16,7 @@ test_values = np.array([1, 0.00061658055072047, 0.00049280924124894, 0.000288547
                         0.00028682299296761, -1.2046443372631, 1.2104273986131, 1.2054460682211,
                         0.00028831588044736, 0.00049238194388207, 0.00061703022026165,
                         1.0407586027826, 0.00057058394234585, 0.00028846777828354, 0.00049229297796647,
-                        20, 1, 0.0000234])
+                        20, 1, 0.0000234, 20.5])
 
 # Create a state from the above message
 fstate = FicTracState.zmq_string_msg_to_state(test_msg)
@@ -41,6 +43,14 @@ def test_zmq_string_to_fictrac_state():
     assert isclose(fstate.inty, test_values[20])
     assert isclose(fstate.timestamp, test_values[21])
     assert (fstate.seq_num == test_values[22])
+    assert isclose(fstate.delta_timestamp, test_values[23])
+    assert isclose(fstate.alt_timestamp, test_values[24])
+
+def test_zmq_string_wrong_num_fields():
+    with pytest.raises(ValueError):
+        FicTracState.zmq_string_msg_to_state(test_msg + ", 1.0")
+    with pytest.raises(ValueError):
+        FicTracState.zmq_string_msg_to_state(test_msg[:test_msg.rindex(',')])
 
 def test_print():
     print(fstate)
@@ -52,3 +62,61 @@ def test_to_np_array():
     assert (test_values[22] == fstate.to_np_array()[22])
 
 
+def test_np_dtype_matches_structure():
+    dtype = FicTracState.np_dtype()
+    assert dtype.itemsize == ctypes.sizeof(FicTracState)
+    assert dtype.names == tuple(name for name, _ in FicTracState._fields_)
+
+def test_to_np_view_is_zero_copy():
+    state = FicTracState.zmq_string_msg_to_state(test_msg)
+    view = state.to_np_view()
+    assert view['frame_cnt'][0] == 1
+    assert np.allclose(view['del_rot_lab_vec'][0], test_values[5:8])
+
+    # Changes to the structure show up in the view and vice versa
+    state.speed = 5.0
+    assert view['speed'][0] == 5.0
+    view['frame_cnt'] = 7
+    assert state.frame_cnt == 7
+
+def test_zmq_string_msgs_to_array():
+    msgs = [test_msg.replace("1, ", "{}, ".format(i), 1) for i in range(1, 101)]
+    states = FicTracState.zmq_string_msgs_to_array(msgs)
+
+    assert states.dtype == FicTracState.np_dtype()
+    assert len(states) == 100
+    assert np.array_equal(states['frame_cnt'], np.arange(1, 101))
+
+    # Each element should be byte for byte what the single message parser produces.
+    for i in [0, 50, 99]:
+        assert states[i].tobytes() == bytes(FicTracState.zmq_string_msg_to_state(msgs[i]))
+
+    # Bytes messages and generators work too
+    states_b = FicTracState.zmq_string_msgs_to_array(m.encode() for m in msgs)
+    assert np.array_equal(states_b, states)
+
+    assert len(FicTracState.zmq_string_msgs_to_array([])) == 0
+
+    with pytest.raises(ValueError):
+        FicTracState.zmq_string_msgs_to_array(msgs + ["1, 2, 3"])
+
+    # A field too many in one message and one too few in another is still caught
+    fields = test_msg.split(",")
+    with pytest.raises(ValueError, match="Message 1 "):
+        FicTracState.zmq_string_msgs_to_array([test_msg, ",".join(fields + ["1"]), ",".join(fields[:-1])])
+
+    with pytest.raises(ValueError):
+        FicTracState.zmq_string_msgs_to_array([test_msg.replace("1, ", "one, ", 1)])
+
+def test_update_from_zmq_string_msg():
+    state = FicTracStateView()
+    assert state.update_from_zmq_string_msg(test_msg) is state
+    assert bytes(state) == bytes(fstate)
+
+    with pytest.raises(AttributeError):
+        state.frame_cnt = 2
+
+    copy = state.snapshot()
+    assert type(copy) is FicTracState
+    copy.frame_cnt = 2
+    assert state.frame_cnt == 1
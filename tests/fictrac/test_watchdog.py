@@ -0,0 +1,154 @@
+import time
+
+import pytest
+
+from pybmt.callback.base import PyBMTCallback
+from pybmt.callback.pipeline import CallbackPipeline
+from pybmt.fictrac.replay import ReplayDriver
+from pybmt.fictrac.simulator import synthetic_states
+from pybmt.fictrac.state import FicTracState
+from pybmt.fictrac.watchdog import DeadlineWatchdog
+
+# 100 fps, a 10 ms frame deadline
+states = [FicTracState.from_buffer_copy(s.tobytes()) for s in synthetic_states(400, fps=100.0)]
+
+
+def run_watchdog(watchdog, processing_times, callback=None, lag_per_frame=0.0):
+    """
+    Feed the watchdog frames that take the given times to process, arriving lag_per_frame later than FicTrac sent
+    them each frame. Returns the frame it said to stop at, or None.
+    """
+    t = 0.0
+    for fstate, processing in zip(states, processing_times):
+        t = fstate.timestamp / 1000.0 + lag_per_frame * fstate.frame_cnt
+        if watchdog.check(fstate, t, t + processing, callback) == 'stop':
+            return fstate.frame_cnt
+
+    return None
+
+
+def test_watchdog_on_time():
+    watchdog = DeadlineWatchdog(warmup_frames=10)
+    assert run_watchdog(watchdog, [0.002] * 300) is None
+
+    stats = watchdog.stats()
+    assert stats['frames'] == 300
+    assert stats['deadline_misses'] == 0
+    assert stats['frame_period'] == pytest.approx(0.01)
+    assert stats['ewma_lateness'] == pytest.approx(-0.008)
+    assert stats['max_lag'] == pytest.approx(0.0, abs=1e-9)
+    assert not watchdog.overloaded
+
+
+def test_watchdog_single_stall():
+    times = [0.002] * 300
+    times[150] = 0.05
+
+    # One long stall doesn't stop the run, but it is counted and is the max lateness
+    watchdog = DeadlineWatchdog(warmup_frames=10)
+    assert run_watchdog(watchdog, times) is None
+    assert watchdog.num_misses == 1
+    assert watchdog.max_lateness == pytest.approx(0.04)
+    assert watchdog.max_lateness_frame == states[150].frame_cnt
+    assert "1 of 300 frames missed their deadline" in watchdog.describe()
+
+
+def test_watchdog_single_long_stall():
+    times = [0.002] * 300
+    times[150] = 1.0
+
+    # A 1 s stall, a garbage collection or a disk flush, pushes the lateness average over zero by itself, but the
+    # frames after it are on time and it doesn't stop a healthy run.
+    watchdog = DeadlineWatchdog(policy='stop', warmup_frames=10)
+    stop_frame = None
+    for i, (fstate, processing) in enumerate(zip(states, times)):
+        t = fstate.timestamp / 1000.0
+        if watchdog.check(fstate, t, t + processing) == 'stop':
+            stop_frame = fstate.frame_cnt
+        if i == 150:
+            assert watchdog.ewma_lateness > 0
+    assert stop_frame is None
+    assert not watchdog.overloaded
+    assert watchdog.num_misses == 1 and watchdog.consecutive_misses == 0
+
+
+def test_watchdog_default_policy():
+    assert DeadlineWatchdog().policy == 'warn'
+
+
+def test_watchdog_too_slow():
+    watchdog = DeadlineWatchdog(policy='stop', warmup_frames=10)
+    assert run_watchdog(watchdog, [0.002] * 100 + [0.015] * 200) is not None
+    assert watchdog.overloaded
+    assert watchdog.consecutive_misses >= watchdog.min_misses
+
+    # The warmup frames can't stop the run
+    watchdog = DeadlineWatchdog(policy='stop', warmup_frames=1000)
+    assert run_watchdog(watchdog, [0.015] * 300) is None
+
+
+def test_watchdog_lag():
+    # Frames are on time, but each arrives a little later than the last, we are falling behind FicTrac
+    watchdog = DeadlineWatchdog(policy='stop', max_lag=0.1, warmup_frames=10)
+    stop_frame = run_watchdog(watchdog, [0.002] * 300, lag_per_frame=0.001)
+    assert stop_frame is not None
+    assert watchdog.lag > 0.1
+
+    # At 100 fps, 10 ms behind is a frame behind
+    assert watchdog.backlog == pytest.approx(watchdog.lag / 0.01)
+    assert watchdog.stats()['max_backlog'] > 10
+    assert watchdog.num_misses == 0
+
+
+def test_watchdog_bad_policy():
+    with pytest.raises(ValueError):
+        DeadlineWatchdog(policy='panic')
+
+
+class ShedCallback(PyBMTCallback):
+    def __init__(self):
+        self.shed_calls = []
+
+    def shed_load(self, shed):
+        self.shed_calls.append(shed)
+
+
+def test_watchdog_shed():
+    pipeline = CallbackPipeline()
+    callback = ShedCallback()
+    pipeline.add_stage(callback)
+    pipeline.add_stage(PyBMTCallback(), deferred=True)
+    pipeline.setup_callback()
+    try:
+        # Fall behind for a while, then catch up
+        watchdog = DeadlineWatchdog(policy='shed', warmup_frames=10)
+        assert run_watchdog(watchdog, [0.002] * 50 + [0.02] * 50 + [0.001] * 300, callback=pipeline) is None
+        assert callback.shed_calls == [True, False]
+        assert watchdog.num_overloads == 1
+
+        pipeline.shed_load(True)
+        for s in states[:5]:
+            pipeline.process_callback(s)
+        assert pipeline.num_deferred_shed == 5
+    finally:
+        pipeline.shutdown_callback()
+
+
+class SlowCallback(PyBMTCallback):
+    def process_callback(self, track_state):
+        time.sleep(0.04)
+        return True
+
+
+def test_replay_watchdog_stop(dat_file):
+    # The recording is at 30 fps, 40 ms per frame is too slow to replay it in real time
+    replay = ReplayDriver(dat_file, track_change_callback=SlowCallback(), realtime=True, watchdog_policy='stop')
+    replay.watchdog.warmup_frames = 5
+    with pytest.raises(Exception) as exc_info:
+        replay.run()
+
+    assert "fell behind FicTrac" in str(exc_info.value.__cause__)
+    assert replay.frame_cnt < 20
+
+    # Replaying as fast as possible has no deadlines
+    assert ReplayDriver(dat_file).watchdog is None